@@ -0,0 +1,201 @@
+# ann_index.py — IVF (inverted file) approximate nearest-neighbour index on NumPy
+#
+# Vectors are L2-normalized, so inner product == cosine. A spherical k-means
+# coarse quantizer splits the gallery into `nlist` cells; a query scans only
+# the `nprobe` closest cells. nprobe is the recall/latency knob: nprobe=nlist
+# is an exact scan, small nprobe trades recall for speed.
+
+import os
+import numpy as np
+
+
+def _normalize_rows(x):
+    x = np.asarray(x, dtype=np.float32)
+    return x / np.maximum(np.linalg.norm(x, axis=1, keepdims=True), 1e-12)
+
+
+def default_nlist(n):
+    """Rule of thumb: about 4 * sqrt(N) cells, never more than N."""
+    return int(max(1, min(n, round(4 * np.sqrt(max(n, 1))))))
+
+
+def spherical_kmeans(x, k, iters=10, seed=0, chunk=65536):
+    """Cluster unit vectors by cosine; returns (k, dim) unit centroids."""
+    rng = np.random.default_rng(seed)
+    n = x.shape[0]
+    centroids = x[rng.choice(n, size=k, replace=False)].copy()
+    for _ in range(iters):
+        sums = np.zeros_like(centroids)
+        counts = np.zeros(k, dtype=np.int64)
+        for s in range(0, n, chunk):
+            part = x[s:s + chunk]
+            assign = np.argmax(part @ centroids.T, axis=1)
+            np.add.at(sums, assign, part)
+            counts += np.bincount(assign, minlength=k)
+        empty = counts == 0
+        if empty.any():
+            # re-seed dead cells with random points so every cell stays useful
+            sums[empty] = x[rng.choice(n, size=int(empty.sum()), replace=False)]
+        centroids = _normalize_rows(sums)
+    return centroids
+
+
+class IVFIndex:
+    def __init__(self, nlist=None, nprobe=8):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.centroids = None
+        self._vecs = []      # per cell: (cap, dim) float32
+        self._ids = []       # per cell: (cap,) int64
+        self._sizes = None   # per cell: live rows
+        self._where = {}     # id -> (cell, pos)
+
+    @property
+    def trained(self):
+        return self.centroids is not None
+
+    def __len__(self):
+        return len(self._where)
+
+    def train(self, vectors, iters=10, max_train=None, seed=0):
+        """Fit the coarse quantizer on (a sample of) the vectors."""
+        x = _normalize_rows(vectors)
+        nlist = self.nlist or default_nlist(x.shape[0])
+        nlist = max(1, min(nlist, x.shape[0]))
+        max_train = max_train or 64 * nlist
+        if x.shape[0] > max_train:
+            rng = np.random.default_rng(seed)
+            x = x[rng.choice(x.shape[0], size=max_train, replace=False)]
+        self.set_centroids(spherical_kmeans(x, nlist, iters=iters, seed=seed))
+
+    def set_centroids(self, centroids):
+        self.centroids = _normalize_rows(centroids)
+        self.nlist = self.centroids.shape[0]
+        dim = self.centroids.shape[1]
+        self._vecs = [np.zeros((0, dim), dtype=np.float32) for _ in range(self.nlist)]
+        self._ids = [np.zeros(0, dtype=np.int64) for _ in range(self.nlist)]
+        self._sizes = np.zeros(self.nlist, dtype=np.int64)
+        self._where = {}
+
+    def _grow(self, cell, needed):
+        cap = self._vecs[cell].shape[0]
+        if needed <= cap:
+            return
+        cap = max(needed, 2 * cap, 16)
+        size = self._sizes[cell]
+        vecs = np.zeros((cap, self.centroids.shape[1]), dtype=np.float32)
+        ids = np.zeros(cap, dtype=np.int64)
+        vecs[:size] = self._vecs[cell][:size]
+        ids[:size] = self._ids[cell][:size]
+        self._vecs[cell], self._ids[cell] = vecs, ids
+
+    def _insert(self, id_, cell, vec):
+        self.remove(id_)
+        pos = int(self._sizes[cell])
+        self._grow(cell, pos + 1)
+        self._vecs[cell][pos] = vec
+        self._ids[cell][pos] = id_
+        self._sizes[cell] = pos + 1
+        self._where[id_] = (cell, pos)
+
+    def _fill(self, ids, vectors, cells):
+        """Bulk-load an empty index: one grouped copy per cell."""
+        order = np.argsort(cells, kind="stable")
+        counts = np.bincount(cells, minlength=self.nlist)
+        bounds = np.concatenate([[0], np.cumsum(counts)])
+        for c in range(self.nlist):
+            sel = order[bounds[c]:bounds[c + 1]]
+            self._vecs[c] = vectors[sel].copy()
+            self._ids[c] = ids[sel].copy()
+            self._sizes[c] = len(sel)
+            for pos, i in enumerate(self._ids[c].tolist()):
+                self._where[i] = (c, pos)
+
+    def assign(self, vectors, chunk=65536):
+        """Nearest coarse cell for each (unit) vector."""
+        x = _normalize_rows(np.atleast_2d(vectors))
+        return np.concatenate([
+            np.argmax(x[s:s + chunk] @ self.centroids.T, axis=1)
+            for s in range(0, x.shape[0], chunk)
+        ]) if x.shape[0] else np.zeros(0, dtype=np.int64)
+
+    def add(self, ids, vectors, cells=None):
+        """Insert (or move) vectors under integer ids.
+
+        `cells` may carry a precomputed assignment (e.g. from assign())
+        to skip the coarse quantizer.
+        """
+        if not self.trained:
+            raise RuntimeError("IVFIndex.add() called before train()")
+        ids = np.atleast_1d(np.asarray(ids, dtype=np.int64))
+        x = _normalize_rows(np.atleast_2d(vectors))
+        cells = self.assign(x) if cells is None else np.atleast_1d(np.asarray(cells, dtype=np.int64))
+        if not self._where and len(np.unique(ids)) == len(ids):
+            self._fill(ids, x, cells)
+            return
+        for i, c, v in zip(ids.tolist(), cells.tolist(), x):
+            self._insert(i, c, v)
+
+    def remove(self, id_):
+        loc = self._where.pop(int(id_), None)
+        if loc is None:
+            return False
+        c, pos = loc
+        last = int(self._sizes[c]) - 1
+        if pos != last:
+            moved = int(self._ids[c][last])
+            self._vecs[c][pos] = self._vecs[c][last]
+            self._ids[c][pos] = moved
+            self._where[moved] = (c, pos)
+        self._sizes[c] = last
+        return True
+
+    def search(self, q, k=5, nprobe=None):
+        """Return (ids, scores) of the approximate top-k, best first."""
+        if not self.trained or not self._where:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        q = np.asarray(q, dtype=np.float32).ravel()
+        q = q / max(float(np.linalg.norm(q)), 1e-12)
+        nprobe = max(1, min(nprobe or self.nprobe, self.nlist))
+
+        coarse = self.centroids @ q
+        if nprobe < self.nlist:
+            cells = np.argpartition(-coarse, nprobe - 1)[:nprobe]
+        else:
+            cells = np.arange(self.nlist)
+
+        ids, scores = [], []
+        for c in cells:
+            size = self._sizes[c]
+            if size:
+                ids.append(self._ids[c][:size])
+                scores.append(self._vecs[c][:size] @ q)
+        if not ids:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        ids = np.concatenate(ids)
+        scores = np.concatenate(scores)
+
+        k = min(k, len(ids))
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(ids) else np.arange(len(ids))
+        top = top[np.argsort(-scores[top])]
+        return ids[top], scores[top]
+
+    # ---------- persistence ----------
+    def save(self, path):
+        """Persist the coarse quantizer (centroids + nprobe).
+
+        Cell assignments are not saved: the vectors may have changed by the
+        time the file is reused, and re-assigning is one matrix product
+        against the centroids, while k-means training is the expensive part.
+        """
+        tmp = f"{path}.{os.getpid()}.tmp.npz"  # workers may save concurrently
+        np.savez(tmp, centroids=self.centroids, nprobe=np.int64(self.nprobe))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """Load a saved quantizer; returns an index with empty cells."""
+        with np.load(path, allow_pickle=False) as f:
+            index = cls(nprobe=int(f["nprobe"]))
+            index.set_centroids(f["centroids"])
+        return index
@@ -1,68 +1,539 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, has_request_context
+import os
 import cv2
 import json
+import time
+import threading
+from contextlib import contextmanager
 import numpy as np
 import psycopg2
 import psycopg2.extras
-from insightface.app import FaceAnalysis
+from insightface.utils import face_align
+
+import embedding_codec as codec
+import metrics
+from batcher import MicroBatcher, QueueFull
+from face_models import load_face_models, model_fingerprint
+from ort_config import intra_op_threads, worker_count
+from db import (DB_CONFIG, EMBEDDING_FORMAT, configure_pool, connection, ensure_embedding_schema,
+                get_connection, pool_stats, PoolTimeout)
+from gallery import FaceGallery, assign_unique
+from embedding_cache import EmbeddingCache
+from upload_cache import UploadCache
+from sessions import SessionRegistry, SessionLimit
+from change_feed import ChangeFeed
+from headturn import HeadTurnTracker, yaw_from_kps
+from frame_stream import iter_frames
+from quality import QualityGate, FaceRejected
 
 app = Flask(__name__)
 
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
 # ============================================================
 # DATABASE CONFIG
 # ============================================================
-DB = {
-    "dbname": "Smart_curriculum",
-    "user": "postgres",
-    "password": "Dhana@2007",
-    "host": "localhost",
-    "port": 5433,
-}
+# DB_NAME / DB_USER / DB_PASS / DB_HOST / DB_PORT (db.DB_CONFIG), the same
+# settings migrate_embeddings.py and the bench scripts use.
+# Shared, thread-safe pool (per worker process); sized by DB_POOL_MIN/DB_POOL_MAX.
+configure_pool(DB_CONFIG)
 
 def db():
-    return psycopg2.connect(**DB)
+    """Pooled connection: `with db() as conn:` commits on success, rolls back on error."""
+    return connection()
 
 # ============================================================
 # LOAD INSIGHTFACE (ArcFace)
 # ============================================================
 print("⚙️ Loading ArcFace model...")
-app_face = FaceAnalysis(name="buffalo_l")
-app_face.prepare(ctx_id=-1, det_size=(640, 640))
-print("✅ ArcFace model ready.")
+det_model, rec_model = load_face_models(name="buffalo_l", det_size=(640, 640))
+print(f"✅ ArcFace model ready ({worker_count()} worker(s) × {intra_op_threads()} intra-op thread(s)).")
+
+# One detector run at a time per process: concurrent HTTP threads would
+# otherwise multiply the worker's intra-op thread budget.
+det_slots = threading.BoundedSemaphore(int(os.getenv("FACE_DET_CONCURRENCY", "1")))
+
+# Concurrent single-face requests are coalesced into one recognition-model
+# run per batch (bounded by FACE_BATCH_MAX crops and FACE_BATCH_WAIT_MS).
+FACE_BATCHING = os.getenv("FACE_BATCHING", "true").lower() == "true"
+rec_batcher = MicroBatcher(
+    lambda crops: rec_model.get_feat(crops),
+    max_batch=int(os.getenv("FACE_BATCH_MAX", "16")),
+    max_wait_ms=float(os.getenv("FACE_BATCH_WAIT_MS", "5")),
+    max_queue=int(os.getenv("FACE_BATCH_QUEUE", "256")),
+    name="arcface-batcher",
+)
+
+MATCH_THRESHOLD = 0.35
+DEFAULT_TOP_K = 5
+MAX_TOP_K = 50
+
+# Storage format for student_faces.embedding_bin: db.EMBEDDING_FORMAT
+# (FACE_EMBEDDING_FORMAT = float32 | float16 | int8), shared with register.py --db.
+
+# Resident gallery for legacy 1:N search, loaded lazily on first use.
+# FACE_INDEX=ivf switches the search to an approximate IVF index; nprobe is the
+# recall/latency knob (per request via ?nprobe=, ?exact=1 forces a full scan).
+FACE_INDEX = os.getenv("FACE_INDEX", "flat").lower()
+FACE_IVF_NLIST = int(os.getenv("FACE_IVF_NLIST", "0")) or None
+FACE_IVF_NPROBE = int(os.getenv("FACE_IVF_NPROBE", "8"))
+FACE_INDEX_PATH = os.getenv("FACE_INDEX_PATH", os.path.join(ROOT, "face_index.npz"))
+
+gallery = FaceGallery()
+# One load per process. Changes arriving while it runs (feed deltas,
+# register_mobile) are queued and replayed over the loaded snapshot, unless
+# the snapshot already holds that version of the row.
+_gallery_load_lock = threading.Lock()
+_gallery_pending_lock = threading.Lock()
+_gallery_pending = None             # [(name, emb or None, version or None)] during a load
+
+# Templates for targeted verification, keyed by student_name. Values are
+# embedding_codec blobs so int8 rows keep their integer scoring path.
+embedding_cache = EmbeddingCache(
+    max_entries=int(os.getenv("FACE_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("FACE_CACHE_TTL", "3600")),
+)
+
+# Roster-scoped sessions: a lecture's students pinned in their own matrix.
+SESSION_DEFAULT_TTL = float(os.getenv("FACE_SESSION_TTL", "7200"))
+SESSION_MAX_TTL = float(os.getenv("FACE_SESSION_MAX_TTL", "43200"))
+SESSION_MAX_ROSTER = int(os.getenv("FACE_SESSION_MAX_ROSTER", "2000"))
+SESSION_SCHEMA = os.path.join(ROOT, "migrations", "002_face_sessions.sql")
+sessions = SessionRegistry(
+    max_sessions=int(os.getenv("FACE_SESSION_MAX", "64")),
+    recheck=float(os.getenv("FACE_SESSION_RECHECK", "30")),
+)
+_sessions_schema_ready = threading.Event()
+
+# Every worker follows student_faces changes (migrations/003, 004) and applies them
+# to its gallery, template cache and sessions within FACE_FEED_POLL_S seconds
+# (usually milliseconds, via LISTEN/NOTIFY).
+FACE_CHANGE_FEED = os.getenv("FACE_CHANGE_FEED", "true").lower() == "true"
+MIGRATIONS = os.path.join(ROOT, "migrations")
+FEED_RETRY_S = 5.0
+# Probes and scrapes must answer while Postgres is down, so they never wait
+# for the feed connection (bounded anyway by DB_CONNECT_TIMEOUT).
+FEED_EXEMPT_PATHS = {"/health", "/ready", "/metrics"}
+_feed_retry_at = 0.0
+
+# Detection + embedding results keyed by a hash of the upload bytes, so client
+# retries and repeated "verify" taps on the same JPEG skip inference.
+UPLOAD_CACHE = os.getenv("FACE_UPLOAD_CACHE", "true").lower() == "true"
+upload_cache = UploadCache(
+    max_entries=int(os.getenv("FACE_UPLOAD_CACHE_SIZE", "2048")),
+    max_bytes=int(os.getenv("FACE_UPLOAD_CACHE_MB", "16")) << 20,
+    model_version=os.getenv("FACE_MODEL_VERSION") or model_fingerprint(det_model, rec_model),
+)
+
+# Blur / size / brightness / pose check on the detected face before it is
+# embedded; rejected uploads get the reason back instead of a wasted ArcFace run.
+QUALITY_GATE = os.getenv("FACE_QUALITY_GATE", "true").lower() == "true"
+quality_gate = QualityGate(
+    min_size=int(os.getenv("FACE_QUALITY_MIN_SIZE", "64")),
+    min_brightness=float(os.getenv("FACE_QUALITY_MIN_BRIGHTNESS", "40")),
+    max_brightness=float(os.getenv("FACE_QUALITY_MAX_BRIGHTNESS", "220")),
+    min_sharpness=float(os.getenv("FACE_QUALITY_MIN_SHARPNESS", "40")),
+    max_yaw=float(os.getenv("FACE_QUALITY_MAX_YAW", "0.35")),
+)
+
+# Server-side head-turn liveness (/face/liveness). Per analysed frame: one
+# decode and one SCRFD pass at a small input size (its 5 keypoints give the
+# yaw). Clips are subsampled to ~FACE_LIVENESS_FPS and capped at
+# FACE_LIVENESS_MAX_FRAMES analysed frames, so a 3 s clip costs at most ~15.
+# Clients that do not send ?fps are assumed to capture at
+# FACE_LIVENESS_CLIENT_FPS; analysing every frame would use up the cap on the
+# first half second, before the user has turned.
+_liveness_side = int(os.getenv("FACE_LIVENESS_DET_SIZE", "320")) // 32 * 32
+LIVENESS_DET_SIZE = (_liveness_side, _liveness_side)
+LIVENESS_FPS = float(os.getenv("FACE_LIVENESS_FPS", "5"))
+LIVENESS_CLIENT_FPS = float(os.getenv("FACE_LIVENESS_CLIENT_FPS", "30"))
+LIVENESS_MAX_FRAMES = int(os.getenv("FACE_LIVENESS_MAX_FRAMES", "15"))
+LIVENESS_MAX_RECEIVED = int(os.getenv("FACE_LIVENESS_MAX_RECEIVED", "150"))
+LIVENESS_FRAME_BYTES = int(os.getenv("FACE_LIVENESS_FRAME_KB", "2048")) << 10
+LIVENESS_YAW_THRESH = float(os.getenv("FACE_LIVENESS_YAW", "0.12"))
+LIVENESS_WINDOW = int(os.getenv("FACE_LIVENESS_WINDOW", "3"))
+
+# ============================================================
+# METRICS
+# ============================================================
+STAGE_SECONDS = metrics.Histogram(
+    "face_stage_seconds", "Time spent per pipeline stage.", ("stage", "endpoint", "mode"))
+REQUEST_SECONDS = metrics.Histogram(
+    "face_request_seconds", "End-to-end request latency.", ("endpoint", "mode"))
+REQUESTS = metrics.Counter(
+    "face_requests_total", "Requests served.", ("endpoint", "mode", "status"))
+LIVENESS_FRAMES = metrics.Histogram(
+    "face_liveness_frames", "Frames analysed per /face/liveness request.", ("live",),
+    buckets=(1, 2, 3, 5, 8, 10, 12, 15, 20, 30))
+
+metrics.Gauge("face_batcher_queue_depth", "Crops waiting for the ArcFace batcher.",
+              lambda: rec_batcher.stats()["queue_depth"])
+metrics.Gauge("face_batcher_avg_batch_size", "Mean ArcFace batch size since start.",
+              lambda: rec_batcher.stats()["avg_batch_size"])
+metrics.Gauge("face_batcher_batches_total", "ArcFace batches run.",
+              lambda: rec_batcher.stats()["batches"], kind="counter")
+metrics.Gauge("face_db_pool_connections", "DB pool connections by state.",
+              lambda: {k: v for k, v in pool_stats().items() if k in ("in_use", "idle", "size")}, labelname="state")
+metrics.Gauge("face_db_pool_utilization", "In-use / max DB pool connections.",
+              lambda: pool_stats()["utilization"])
+metrics.Gauge("face_db_pool_wait_p99_ms", "p99 DB pool checkout wait (recent window).",
+              lambda: pool_stats()["wait_ms_p99"])
+metrics.Gauge("face_cache_lookups_total", "Template cache lookups by result.",
+              lambda: {"hit": embedding_cache.hits, "miss": embedding_cache.misses}, labelname="result", kind="counter")
+metrics.Gauge("face_cache_entries", "Templates held in the cache.", lambda: len(embedding_cache))
+metrics.Gauge("face_upload_cache_lookups_total", "Upload result cache lookups by result.",
+              lambda: {"hit": upload_cache.hits, "miss": upload_cache.misses}, labelname="result", kind="counter")
+metrics.Gauge("face_upload_cache_entries", "Uploads held in the result cache.", lambda: len(upload_cache))
+metrics.Gauge("face_upload_cache_bytes", "Approximate memory held by the upload result cache.",
+              lambda: upload_cache.nbytes)
+metrics.Gauge("face_quality_checks_total", "Faces run through the quality gate.",
+              lambda: quality_gate.checked, kind="counter")
+metrics.Gauge("face_quality_rejections_total", "Faces rejected by the quality gate, by reason.",
+              lambda: dict(quality_gate.rejected), labelname="reason", kind="counter")
+metrics.Gauge("face_sessions_open", "Open roster sessions in this worker.", lambda: len(sessions))
+metrics.Gauge("face_change_feed_version", "Last student_faces version applied by this worker.",
+              lambda: change_feed.version or 0)
+metrics.Gauge("face_change_feed_applied_total", "student_faces changes applied from the feed.",
+              lambda: change_feed.applied, kind="counter")
+metrics.Gauge("face_gallery_size", "Faces in the resident 1:N gallery.", lambda: len(gallery))
+
+def set_mode(mode):
+    """Label the current request's metrics (targeted, legacy, group, ...)."""
+    g.mode = mode
+
+@contextmanager
+def timed(stage, timings=None):
+    """Time a stage into face_stage_seconds (and `timings` as <stage>_ms)."""
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        dt = time.perf_counter() - t
+        if has_request_context():
+            endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+            STAGE_SECONDS.observe(dt, stage=stage, endpoint=endpoint, mode=g.get("mode", "default"))
+        if timings is not None:
+            timings[f"{stage}_ms"] = dt * 1000
+
+@app.before_request
+def _start_timer():
+    g.started = time.perf_counter()
+    if FACE_CHANGE_FEED and request.path not in FEED_EXEMPT_PATHS:
+        _start_change_feed()
+
+@app.after_request
+def _record_request(response):
+    if request.url_rule is not None and request.url_rule.rule != "/metrics":
+        endpoint, mode = request.url_rule.rule, g.get("mode", "default")
+        REQUEST_SECONDS.observe(time.perf_counter() - g.started, endpoint=endpoint, mode=mode)
+        REQUESTS.inc(endpoint=endpoint, mode=mode, status=response.status_code)
+    return response
 
 # ============================================================
 # HELPERS
 # ============================================================
-def cosine(a, b):
-    """Compute cosine similarity between two embeddings."""
-    return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b) + 1e-12))
+def apply_to_gallery(name, emb, version=None):
+    """Upsert (or remove, if `emb` is None) one student; queued during a load."""
+    with _gallery_pending_lock:
+        if _gallery_pending is not None:
+            _gallery_pending.append((name, emb, version))
+        elif emb is None:
+            gallery.remove(name)
+        elif gallery.loaded:
+            gallery.upsert(name, emb)
+
+def ensure_gallery_loaded():
+    """Populate the resident gallery from student_faces once per process."""
+    global _gallery_pending
+    if gallery.loaded:
+        return
+    with _gallery_load_lock:
+        if gallery.loaded:
+            return  # loaded by a concurrent first request
+        ensure_embedding_schema()
+        # the feed has applied migrations/003 (student_faces.version) once it is open
+        versioned = FACE_CHANGE_FEED and change_feed.version is not None
+        with _gallery_pending_lock:
+            _gallery_pending = []
+        try:
+            with timed("db_gallery_load"), db() as conn, conn.cursor() as cur:
+                cur.execute("SELECT student_name, embedding_bin, embedding, "
+                            + ("version" if versioned else "NULL") + " FROM student_faces")
+                rows = cur.fetchall()
+            faces = [(name, codec.from_row(emb_bin, emb)) for name, emb_bin, emb, _ in rows]
+            loaded_versions = {name: version for name, _, _, version in rows if version is not None}
+        except BaseException:
+            with _gallery_pending_lock:
+                _gallery_pending = None
+            raise
+
+        with _gallery_pending_lock:
+            gallery.load(faces)
+            replayed = 0
+            for name, emb, version in _gallery_pending:
+                if version is not None and loaded_versions.get(name, -1) >= version:
+                    continue  # committed before the SELECT: already in the snapshot
+                if emb is None:
+                    gallery.remove(name)
+                else:
+                    gallery.upsert(name, emb)
+                replayed += 1
+            _gallery_pending = None
+        print(f"📚 Gallery loaded: {len(gallery)} faces ({replayed} change(s) replayed)")
+
+    if FACE_INDEX == "ivf":
+        index = gallery.build_index(nlist=FACE_IVF_NLIST, nprobe=FACE_IVF_NPROBE, path=FACE_INDEX_PATH)
+        if index is not None:
+            print(f"🗂️ IVF index ready: nlist={index.nlist}, nprobe={index.nprobe}")
+
+def row_template(emb_bin, emb_json):
+    """Cacheable template for a student_faces row (legacy JSON is re-encoded once)."""
+    if emb_bin is not None:
+        return bytes(emb_bin)
+    return codec.encode(codec.from_row(None, emb_json), "float32")
+
+def fetch_templates(names):
+    """Load templates for `names` from the DB in one query and cache them."""
+    names = list(dict.fromkeys(names))
+    if not names:
+        return {}
+    ensure_embedding_schema()
+    with embedding_cache.fetching() as generation:
+        with timed("db_fetch"), db() as conn, conn.cursor() as cur:
+            cur.execute(
+                "SELECT student_name, embedding_bin, embedding FROM student_faces WHERE student_name = ANY(%s)",
+                (names,),
+            )
+            rows = cur.fetchall()
+        found = {name: row_template(emb_bin, emb) for name, emb_bin, emb in rows}
+        embedding_cache.put_many(found.items(), generation=generation)
+    return found
+
+def get_template(name):
+    """Cached template for one student, or None if not enrolled."""
+    template = embedding_cache.get(name)
+    if template is None:
+        template = fetch_templates([name]).get(name)
+    return template
+
+def decode_image(data):
+    """Decode JPEG/PNG bytes as an OpenCV image (None if undecodable)."""
+    return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+
+def roster_vectors(names):
+    """{name: embedding} for the enrolled members of a roster (cache first)."""
+    found = fetch_templates(embedding_cache.missing(names))
+    out = {}
+    for name in names:
+        template = found.get(name) or embedding_cache.get(name)
+        if template is not None:
+            out[name] = codec.decode(template)
+    return out
+
+def ensure_sessions_schema():
+    if _sessions_schema_ready.is_set():
+        return
+    with open(SESSION_SCHEMA, encoding="utf-8") as f, db() as conn, conn.cursor() as cur:
+        cur.execute(f.read())
+    _sessions_schema_ready.set()
+
+def resolve_session(session_id):
+    """Pinned session for `session_id`, rebuilt from face_sessions if this worker lacks it."""
+    session = sessions.get(session_id)
+    if session is not None and not sessions.needs_recheck(session):
+        return session
+
+    ensure_sessions_schema()
+    with timed("db_session"), db() as conn, conn.cursor() as cur:
+        cur.execute(
+            "SELECT roster, EXTRACT(EPOCH FROM expires_at) FROM face_sessions "
+            "WHERE session_id = %s AND expires_at > now()",
+            (session_id,),
+        )
+        row = cur.fetchone()
+    if row is None:
+        sessions.close(session_id)  # closed or expired on another worker
+        return None
+    roster, expires_at = row
+    if session is not None:
+        sessions.mark_checked(session, expires_at)
+        return session
+    with timed("session_load"):
+        return sessions.create(session_id, roster, roster_vectors(roster), expires_at)
+
+def apply_face_changes(changes):
+    """Change-feed callback: bring this worker's in-memory copies up to date."""
+    for name, emb, version in changes:
+        embedding_cache.invalidate(name)
+        apply_to_gallery(name, emb, version)
+        if emb is None:
+            sessions.remove(name)
+        else:
+            sessions.update(name, emb)
+
+def _start_change_feed():
+    """Start this worker's feed before it serves anything; retried while the DB is down."""
+    global _feed_retry_at
+    if time.monotonic() < _feed_retry_at:
+        return
+    try:
+        change_feed.ensure_started()
+    except psycopg2.Error as e:
+        _feed_retry_at = time.monotonic() + FEED_RETRY_S
+        print(f"⚠️ Change feed not started: {e!r}")
 
 def read_upload(fs):
     """Read uploaded file as OpenCV image."""
-    npimg = np.frombuffer(fs.read(), np.uint8)
-    return cv2.imdecode(npimg, cv2.IMREAD_COLOR)
+    return decode_image(fs.read())
 
-def detect_and_crop_face(img):
-    """Detect face and return both cropped image and embedding directly."""
-    rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-    faces = app_face.get(rgb)
-    if not faces:
+def detect_faces(rgb, max_num=0, det_size=None):
+    """Run the detector once; returns (bboxes[N, 5], kpss[N, 5, 2]), best first."""
+    with det_slots:
+        return det_model.detect(rgb, input_size=det_size, max_num=max_num, metric="default")
+
+def embed_faces(rgb, kpss, timings=None):
+    """Align every face and embed them all in a single recognition-model call."""
+    if len(kpss) == 0:
+        return np.zeros((0, 512), dtype=np.float32)
+    size = rec_model.input_size[0]
+    with timed("align", timings):
+        aligned = [face_align.norm_crop(rgb, landmark=kps, image_size=size) for kps in kpss]
+    with timed("embed", timings):
+        if FACE_BATCHING and len(aligned) == 1:
+            # single crops share a model run with other in-flight requests
+            embs = np.stack([rec_batcher.submit(aligned[0])]).astype(np.float32)
+        else:
+            embs = rec_model.get_feat(aligned).astype(np.float32)
+    embs /= np.linalg.norm(embs, axis=1, keepdims=True) + 1e-12
+    return embs
+
+def tight_det_size(h, w):
+    """Detector input for an upload that is already a tight face crop.
+
+    The face fills the frame, so a small input (multiple of 32, 128–320 px)
+    finds it at a fraction of the 640x640 cost.
+    """
+    side = int(np.ceil(max(h, w) / 32.0)) * 32
+    side = max(128, min(320, side))
+    return (side, side)
+
+def check_quality(rgb, bbox=None, kps=None, timings=None):
+    """Raise FaceRejected if the face fails the quality gate (when enabled)."""
+    if not QUALITY_GATE:
+        return
+    with timed("quality", timings):
+        verdict = quality_gate.check(rgb, bbox, kps, rgb=True)
+    if not verdict["ok"]:
+        print(f"🚫 Face rejected by quality gate: {verdict['reason']}")
+        raise FaceRejected(verdict)
+
+def locate_face(img, crop_mode=None, timings=None):
+    """Detect the main face; returns (bbox [x1, y1, x2, y2], embedding) or (None, None).
+
+    Raises FaceRejected, before anything is embedded, if the face fails the
+    quality gate.
+
+    crop_mode (declared by the client):
+      None     — full image, full-size detection
+      "tight"  — tight crop around one face: small detector input sized from the image
+      "aligned"— already an aligned face crop: skip the detector, embed directly
+    """
+    with timed("color", timings):
+        rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+    if crop_mode == "aligned":
+        check_quality(rgb, timings=timings)
+        with timed("embed", timings):
+            size = rec_model.input_size[0]
+            face = cv2.resize(rgb, (size, size)) if rgb.shape[:2] != (size, size) else rgb
+            emb = np.asarray(rec_batcher.submit(face) if FACE_BATCHING else rec_model.get_feat([face])[0], dtype=np.float32).ravel()
+            emb /= np.linalg.norm(emb) + 1e-12
+        return np.array([0, 0, img.shape[1], img.shape[0]], dtype=np.float32), emb
+
+    with timed("detect", timings):
+        if crop_mode == "tight":
+            bboxes, kpss = detect_faces(rgb, max_num=1, det_size=tight_det_size(*rgb.shape[:2]))
+            if len(bboxes) == 0:
+                bboxes, kpss = detect_faces(rgb)  # client was wrong about the crop
+        else:
+            bboxes, kpss = detect_faces(rgb)
+    if len(bboxes) == 0:
         print("⚠️ No faces detected in image.")
         return None, None
 
-    face = faces[0]
-    x1, y1, x2, y2 = face.bbox.astype(int)
+    check_quality(rgb, bboxes[0], kpss[0], timings=timings)
+    emb = embed_faces(rgb, kpss[:1], timings=timings)[0]
+    print("✅ Embedding extracted from initial detection.")
+    return bboxes[0][:4].astype(np.float32), emb
+
+def detect_and_crop_face(img, crop_mode=None, timings=None):
+    """Detect face and return both cropped image and embedding directly."""
+    bbox, emb = locate_face(img, crop_mode=crop_mode, timings=timings)
+    if emb is None:
+        return None, None
+    if crop_mode == "aligned":
+        return img, emb
+
+    x1, y1, x2, y2 = bbox.astype(int)
     pad = int(0.1 * (x2 - x1))
     x1, y1 = max(0, x1 - pad), max(0, y1 - pad)
     x2, y2 = min(img.shape[1], x2 + pad), min(img.shape[0], y2 + pad)
     crop = img[y1:y2, x1:x2]
     print(f"🖼️ Cropped region: {crop.shape}")
-
-    emb = face.embedding.astype(np.float32)
-    emb /= np.linalg.norm(emb) + 1e-12
-    print("✅ Embedding extracted from initial detection.")
     return crop, emb
 
+def face_from_upload(fs, crop_mode=None, timings=None):
+    """(bbox, emb, cached) for an uploaded file; byte-identical repeats skip inference.
+
+    bbox/emb are None when no face was found (that outcome is cached too).
+    Raises ValueError if the upload is not a decodable image, FaceRejected if
+    the face fails the quality gate (not cached: the gate is cheap).
+    """
+    data = fs.read()
+    key = None
+    if UPLOAD_CACHE:
+        with timed("upload_cache", timings):
+            key = upload_cache.key(data, crop_mode)
+            hit = upload_cache.get(key)
+        if hit is not None:
+            return hit[0], hit[1], True
+
+    with timed("decode", timings):
+        img = decode_image(data)
+    if img is None:
+        raise ValueError("Invalid image")
+    bbox, emb = locate_face(img, crop_mode=crop_mode, timings=timings)
+    if key is not None:
+        upload_cache.put(key, bbox, emb)
+    return bbox, emb, False
+
+def parse_names(raw):
+    """Accept a roster as a JSON list or a comma-separated string."""
+    if not raw:
+        return None
+    raw = raw.strip()
+    if raw.startswith("["):
+        names = json.loads(raw)
+        if not isinstance(names, list):
+            raise ValueError("roster must be a list")
+    else:
+        names = raw.split(",")
+    return [str(n).strip() for n in names if str(n).strip()]
+
+def request_roster(body):
+    """Roster from a JSON object's "names" (a list of strings), else from the
+    `roster` form/query field; ValueError for any other shape."""
+    if body is None:
+        body = {}
+    if not isinstance(body, dict):
+        raise ValueError("JSON body must be an object")
+    names = body.get("names")
+    if names is None:
+        return parse_names(request.form.get("roster") or request.args.get("roster"))
+    if not isinstance(names, list) or not all(isinstance(n, str) for n in names):
+        raise ValueError("names must be a list of strings")
+    return [n.strip() for n in names if n.strip()]
+
 # ============================================================
 # NEW — CHECK IF FACE EMBEDDING EXISTS
 # ============================================================
@@ -72,12 +543,9 @@ def face_exists():
     if not name:
         return jsonify({"ok": False, "exists": False, "error": "Missing ?name"}), 400
 
-    conn = db()
-    cur = conn.cursor()
-    cur.execute("SELECT 1 FROM student_faces WHERE student_name = %s", (name,))
-    found = cur.fetchone()
-    cur.close()
-    conn.close()
+    with timed("db_exists"), db() as conn, conn.cursor() as cur:
+        cur.execute("SELECT 1 FROM student_faces WHERE student_name = %s", (name,))
+        found = cur.fetchone()
 
     return jsonify({"ok": True, "exists": found is not None})
 
@@ -88,31 +556,37 @@ def face_exists():
 
 @app.post("/face/register-mobile")
 def register_mobile():
+    set_mode("register")
     f = request.files.get("file")
     name = request.form.get("name")
 
     if not f or not name:
         return jsonify({"ok": False, "error": "Missing file or name"}), 400
 
-    img = read_upload(f)
-    crop, emb = detect_and_crop_face(img)
+    try:
+        _, emb, _ = face_from_upload(f)
+    except ValueError:
+        return jsonify({"ok": False, "error": "Invalid image"}), 400
+    except FaceRejected as e:
+        return jsonify({"ok": False, "error": f"Face rejected: {e}", "quality": e.verdict}), 400
     if emb is None:
         return jsonify({"ok": False, "error": "No face detected"}), 400
 
-    conn = db()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        INSERT INTO student_faces (student_name, embedding)
-        VALUES (%s, %s)
-        ON CONFLICT (student_name)
-        DO UPDATE SET embedding = EXCLUDED.embedding;
-    """,
-        (name, json.dumps(emb.tolist())),
-    )
-    conn.commit()
-    cur.close()
-    conn.close()
+    ensure_embedding_schema()
+    with timed("db_upsert"), db() as conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            INSERT INTO student_faces (student_name, embedding_bin, embedding)
+            VALUES (%s, %s, NULL)
+            ON CONFLICT (student_name)
+            DO UPDATE SET embedding_bin = EXCLUDED.embedding_bin, embedding = NULL;
+        """,
+            (name, psycopg2.Binary(codec.encode(emb, EMBEDDING_FORMAT))),
+        )
+
+    embedding_cache.invalidate(name)
+    apply_to_gallery(name, emb)
+    sessions.update(name, emb)
 
     print(f"🆕 Registered face for {name}")
     return jsonify({"ok": True, "msg": f"Face registered for {name}."})
@@ -121,96 +595,454 @@ def register_mobile():
 @app.post("/face/recognize")
 def recognize_face():
     target_name = request.args.get("name")
+    session_id = None if target_name else (request.args.get("session") or request.form.get("session"))
+    set_mode("targeted" if target_name else ("session" if session_id else "legacy"))
+    crop_mode = request.args.get("crop") or request.form.get("crop")
+    if crop_mode not in (None, "", "tight", "aligned"):
+        return jsonify({"ok": False, "error": "Invalid crop mode (tight|aligned)"}), 400
 
     f = request.files.get("file")
     if not f:
         return jsonify({"ok": False, "error": "Missing file"}), 400
 
-    img = read_upload(f)
-    crop, emb = detect_and_crop_face(img)
-    if emb is None:
-        return jsonify({"ok": True, "recognized": False, "name": None, "score": 0.0})
+    if crop_mode:
+        set_mode(f"{g.mode}-{crop_mode}")
 
-    conn = db()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    timings = {}
+    try:
+        _, emb, cached = face_from_upload(f, crop_mode=crop_mode or None, timings=timings)
+    except ValueError:
+        return jsonify({"ok": False, "error": "Invalid image"}), 400
+    except FaceRejected as e:
+        return jsonify({"ok": True, "recognized": False, "name": None, "score": 0.0,
+                        "quality": e.verdict, "timings_ms": timings})
+    if cached:
+        set_mode(f"{g.mode}-cached")
+
+    if emb is None:
+        return jsonify({"ok": True, "recognized": False, "name": None, "score": 0.0, "timings_ms": timings})
 
     # --------------------------------------------------------
     # MODE 1: Targeted recognition (Flutter app)
     # --------------------------------------------------------
     if target_name:
         print(f"🎯 Targeted recognition for: {target_name}")
-        cur.execute(
-            "SELECT student_name, embedding FROM student_faces WHERE student_name = %s",
-            (target_name,),
-        )
-        row = cur.fetchone()
-        cur.close()
-        conn.close()
+        with timed("template_lookup", timings):
+            template = get_template(target_name)
 
-        if not row:
+        if template is None:
             return jsonify({
                 "ok": True,
                 "recognized": False,
                 "name": None,
-                "score": 0.0
+                "score": 0.0,
+                "timings_ms": timings,
             })
 
-        emb_data = row["embedding"]
-        if isinstance(emb_data, str):
-            dbv = np.array(json.loads(emb_data), dtype=np.float32)
-        else:
-            dbv = np.array(emb_data, dtype=np.float32)
-
-        score = cosine(emb, dbv)
-        recognized = score >= 0.35
+        with timed("match", timings):
+            score = codec.score(emb, template)
+        recognized = score >= MATCH_THRESHOLD
 
         return jsonify({
             "ok": True,
             "recognized": recognized,
             "name": target_name if recognized else None,
-            "score": float(score)
+            "score": float(score),
+            "timings_ms": timings,
         })
 
     # --------------------------------------------------------
-    # MODE 2: Legacy recognition (other websites)
+    # MODE 2: Legacy recognition (other websites), or only the
+    # roster of an open session when ?session= is given
     # --------------------------------------------------------
-    cur.execute("SELECT student_name, embedding FROM student_faces")
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
+    try:
+        k = int(request.args.get("k", DEFAULT_TOP_K))
+        nprobe = int(request.args["nprobe"]) if "nprobe" in request.args else None
+    except ValueError:
+        return jsonify({"ok": False, "error": "Invalid ?k or ?nprobe"}), 400
+    k = max(1, min(k, MAX_TOP_K))
+    exact = request.args.get("exact") in ("1", "true")
 
-    if not rows:
+    if session_id:
+        session = resolve_session(session_id)
+        if session is None:
+            return jsonify({"ok": False, "error": "Unknown or expired session"}), 404
+        search_gallery = session.gallery
+    else:
+        with timed("gallery", timings):
+            ensure_gallery_loaded()
+        search_gallery = gallery
+    with timed("match", timings):
+        candidates = search_gallery.search(emb, k=max(k, 2), nprobe=nprobe, exact=exact)
+    if not candidates:
         return jsonify({"ok": False, "error": "No registered faces."}), 404
 
-    best_name, best_score = None, -1.0
-    for row in rows:
-        emb_data = row["embedding"]
-        if isinstance(emb_data, str):
-            dbv = np.array(json.loads(emb_data), dtype=np.float32)
-        else:
-            dbv = np.array(emb_data, dtype=np.float32)
-
-        s = cosine(emb, dbv)
-        if s > best_score:
-            best_name, best_score = row["student_name"], s
-
-    recognized = best_score >= 0.35
+    best_name, best_score = candidates[0]
+    runner_up = candidates[1][1] if len(candidates) > 1 else None
+    recognized = best_score >= MATCH_THRESHOLD
 
     return jsonify({
         "ok": True,
         "recognized": recognized,
         "name": best_name if recognized else None,
-        "score": float(best_score)
+        "score": float(best_score),
+        "candidates": [{"name": n, "score": s} for n, s in candidates[:k]],
+        "margin": None if runner_up is None else float(best_score - runner_up),
+        "timings_ms": timings,
     })
 
 
+@app.post("/face/liveness")
+def liveness():
+    """Head-turn liveness over a short clip, then verification against ?name.
+
+    Frames stream in as multipart parts or length-prefixed bytes (frame_stream)
+    and are analysed as they arrive; reading stops on the frame where both a
+    left and a right turn have been seen, and that frame is verified with
+    ArcFace (if it fails the quality gate, the next analysed frame that passes
+    is used instead). Pass ?fps= (the client's capture rate, default
+    FACE_LIVENESS_CLIENT_FPS) so only ~FACE_LIVENESS_FPS frames per second are
+    decoded; the rest are skipped without decoding.
+    """
+    set_mode("liveness")
+    name = request.args.get("name")
+    if not name:
+        return jsonify({"ok": False, "error": "Missing ?name"}), 400
+    try:
+        fps = float(request.args.get("fps", LIVENESS_CLIENT_FPS))
+    except ValueError:
+        return jsonify({"ok": False, "error": "Invalid ?fps"}), 400
+    if not fps > 0:
+        return jsonify({"ok": False, "error": "Invalid ?fps"}), 400
+    stride = max(1, round(fps / LIVENESS_FPS))
+
+    timings = {}
+    with timed("template_lookup", timings):
+        template = get_template(name)
+    if template is None:
+        return jsonify({"ok": False, "error": f"No registered face for {name}"}), 404
+
+    tracker = HeadTurnTracker(thresh=LIVENESS_YAW_THRESH, window=LIVENESS_WINDOW)
+    received = analysed = with_face = 0
+    passing = None   # (rgb, kps) of the first frame after the turn that is good enough to verify
+    rejected = None  # last quality verdict that kept a live frame from being verified
+    t = time.perf_counter()
+    try:
+        for data in iter_frames(request, LIVENESS_FRAME_BYTES):
+            received += 1
+            if received > LIVENESS_MAX_RECEIVED:
+                break
+            if (received - 1) % stride:
+                continue
+            analysed += 1
+            with timed("decode"):
+                img = decode_image(data)
+            if img is None:
+                return jsonify({"ok": False, "error": f"Invalid image (frame {received})"}), 400
+            with timed("color"):
+                rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+            with timed("detect"):
+                bboxes, kpss = detect_faces(rgb, max_num=1, det_size=LIVENESS_DET_SIZE)
+            if len(bboxes):
+                with_face += 1
+                tracker.update(yaw_from_kps(kpss[0]))
+                if tracker.passed:
+                    try:
+                        check_quality(rgb, bboxes[0], kpss[0])
+                    except FaceRejected as e:
+                        rejected = e.verdict  # retry on the next analysed frame
+                    else:
+                        passing = (rgb, kpss[0])
+                        break
+            if analysed >= LIVENESS_MAX_FRAMES:
+                break
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    timings["frames_ms"] = (time.perf_counter() - t) * 1000
+    LIVENESS_FRAMES.observe(analysed, live=str(tracker.passed).lower())
+
+    response = {
+        "ok": True,
+        "live": tracker.passed,
+        **tracker.state(),
+        "recognized": False,
+        "name": None,
+        "score": 0.0,
+        "frames_received": received,
+        "frames_analysed": analysed,
+        "frames_with_face": with_face,
+        "timings_ms": timings,
+    }
+    if passing is None:
+        if rejected is not None:
+            response["quality"] = rejected
+        return jsonify(response)
+
+    rgb, kps = passing
+    emb = embed_faces(rgb, kps[None], timings=timings)[0]
+    with timed("match", timings):
+        score = codec.score(emb, template)
+    recognized = score >= MATCH_THRESHOLD
+    response.update(recognized=recognized, name=name if recognized else None, score=float(score))
+    print(f"🌀 Liveness for {name}: passed after {analysed} frame(s), score {score:.3f}")
+    return jsonify(response)
+
+
+@app.post("/face/prefetch")
+def prefetch_roster():
+    """Warm the template cache for a class roster before the session starts."""
+    try:
+        names = request_roster(request.get_json(silent=True))
+    except ValueError:
+        return jsonify({"ok": False, "error": "Invalid roster"}), 400
+    if not names:
+        return jsonify({"ok": False, "error": "Missing names"}), 400
+
+    missing = embedding_cache.missing(names)
+    found = fetch_templates(missing)
+    return jsonify({
+        "ok": True,
+        "requested": len(names),
+        "already_cached": len(names) - len(missing),
+        "loaded": len(found),
+        "not_enrolled": [n for n in missing if n not in found],
+    })
+
+
+@app.post("/face/sessions")
+def open_session():
+    """Open a recognition session pinned to a roster: {"names": [...], "ttl": seconds}."""
+    body = request.get_json(silent=True)
+    try:
+        names = request_roster(body)
+        ttl = float((body or {}).get("ttl") or request.args.get("ttl") or SESSION_DEFAULT_TTL)
+    except (TypeError, ValueError):
+        return jsonify({"ok": False, "error": "Invalid roster or ttl"}), 400
+    if not names:
+        return jsonify({"ok": False, "error": "Missing names"}), 400
+    names = list(dict.fromkeys(names))
+    if len(names) > SESSION_MAX_ROSTER:
+        return jsonify({"ok": False, "error": f"Roster larger than {SESSION_MAX_ROSTER}"}), 400
+    ttl = max(1.0, min(ttl, SESSION_MAX_TTL))
+
+    ensure_sessions_schema()
+    session_id = sessions.new_id()
+    with timed("db_session"), db() as conn, conn.cursor() as cur:
+        cur.execute(
+            "INSERT INTO face_sessions (session_id, roster, expires_at) "
+            "VALUES (%s, %s, now() + make_interval(secs => %s)) RETURNING EXTRACT(EPOCH FROM expires_at)",
+            (session_id, names, ttl),
+        )
+        expires_at = cur.fetchone()[0]
+        cur.execute("DELETE FROM face_sessions WHERE expires_at < now() - interval '1 day'")
+    with timed("session_load"):
+        session = sessions.create(session_id, names, roster_vectors(names), expires_at)
+    print(f"📋 Session {session_id} opened: {len(session.gallery)}/{len(names)} enrolled")
+    return jsonify({"ok": True, **session.info()})
+
+
+@app.get("/face/sessions/<session_id>")
+def session_info(session_id):
+    session = resolve_session(session_id)
+    if session is None:
+        return jsonify({"ok": False, "error": "Unknown or expired session"}), 404
+    return jsonify({"ok": True, **session.info()})
+
+
+@app.delete("/face/sessions/<session_id>")
+def close_session(session_id):
+    ensure_sessions_schema()
+    with timed("db_session"), db() as conn, conn.cursor() as cur:
+        cur.execute("DELETE FROM face_sessions WHERE session_id = %s", (session_id,))
+        deleted = cur.rowcount
+    sessions.close(session_id)
+    if not deleted:
+        return jsonify({"ok": False, "error": "Unknown session"}), 404
+    return jsonify({"ok": True, "closed": session_id})
+
+
+@app.get("/face/sessions")
+def session_stats():
+    return jsonify({"ok": True, **sessions.stats()})
+
+
+@app.get("/face/feed")
+def change_feed_stats():
+    return jsonify({"ok": True, "enabled": FACE_CHANGE_FEED, **change_feed.stats()})
+
+
+@app.get("/face/cache")
+def cache_stats():
+    return jsonify({"ok": True, **embedding_cache.stats(), "uploads": {"enabled": UPLOAD_CACHE, **upload_cache.stats()}})
+
+
+@app.get("/face/quality")
+def quality_stats():
+    return jsonify({"ok": True, "enabled": QUALITY_GATE, **quality_gate.stats()})
+
+
+@app.post("/face/recognize-group")
+def recognize_group():
+    """Mark a whole class from one photo: detect once, embed once, match once."""
+    session_id = request.args.get("session") or request.form.get("session")
+    if session_id:
+        set_mode("session")
+    else:
+        set_mode("roster" if (request.form.get("roster") or request.args.get("roster")) else "gallery")
+    f = request.files.get("file")
+    if not f:
+        return jsonify({"ok": False, "error": "Missing file"}), 400
+
+    session = None
+    if session_id:
+        session = resolve_session(session_id)
+        if session is None:
+            return jsonify({"ok": False, "error": "Unknown or expired session"}), 404
+        roster = session.names
+    else:
+        try:
+            roster = parse_names(request.form.get("roster") or request.args.get("roster"))
+        except ValueError:
+            return jsonify({"ok": False, "error": "Invalid roster"}), 400
+
+    det_size = None
+    if request.args.get("det_size"):
+        try:
+            side = int(request.args["det_size"])
+        except ValueError:
+            return jsonify({"ok": False, "error": "Invalid ?det_size"}), 400
+        side = max(160, min(1280, side // 32 * 32))
+        det_size = (side, side)
+
+    with timed("decode"):
+        img = read_upload(f)
+    if img is None:
+        return jsonify({"ok": False, "error": "Invalid image"}), 400
+    with timed("color"):
+        rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    with timed("detect"):
+        bboxes, kpss = detect_faces(rgb, det_size=det_size)
+    embs = embed_faces(rgb, kpss)
+    print(f"👥 Group photo: {len(bboxes)} faces detected")
+
+    if session is not None:
+        search_gallery = session.gallery
+    else:
+        with timed("gallery"):
+            ensure_gallery_loaded()
+        search_gallery = gallery
+    with timed("match"):
+        names, scores = search_gallery.score_matrix(embs, names=roster)
+        assignment = assign_unique(scores, MATCH_THRESHOLD)
+
+    faces = []
+    for i, bbox in enumerate(bboxes):
+        col = int(assignment[i])
+        best = float(scores[i].max()) if scores.shape[1] else 0.0
+        faces.append({
+            "bbox": [int(v) for v in bbox[:4]],
+            "det_score": float(bbox[4]),
+            "recognized": col >= 0,
+            "name": names[col] if col >= 0 else None,
+            "score": float(scores[i, col]) if col >= 0 else best,
+        })
+
+    present = [face["name"] for face in faces if face["recognized"]]
+    response = {"ok": True, "count": len(faces), "faces": faces, "present": present}
+    if roster is not None:
+        enrolled = set(names)
+        response["absent"] = [n for n in dict.fromkeys(roster) if n in enrolled and n not in present]
+        response["not_enrolled"] = [n for n in dict.fromkeys(roster) if n not in enrolled]
+    return jsonify(response)
+
+
+@app.get("/face/batcher")
+def batcher_stats():
+    return jsonify({"ok": True, "enabled": FACE_BATCHING, **rec_batcher.stats()})
+
+
+@app.get("/face/pool")
+def db_pool_stats():
+    return jsonify({"ok": True, **pool_stats()})
+
+
+@app.errorhandler(QueueFull)
+@app.errorhandler(PoolTimeout)
+@app.errorhandler(SessionLimit)
+def overloaded(e):
+    return jsonify({"ok": False, "error": "Server busy, retry shortly"}), 503
+
+
+@app.get("/metrics")
+def prometheus_metrics():
+    return metrics.render(), 200, {"Content-Type": metrics.CONTENT_TYPE}
+
+
 @app.get("/health")
 def health():
     return jsonify({"ok": True})
 
 
+@app.get("/ready")
+def ready():
+    """Readiness: 200 only once both models have run a warm-up inference."""
+    body = {
+        "ok": WARMED_UP.is_set(),
+        "ready": WARMED_UP.is_set(),
+        "pid": os.getpid(),
+        "workers": worker_count(),
+        "intra_op_threads": intra_op_threads(),
+    }
+    return jsonify(body), (200 if WARMED_UP.is_set() else 503)
+
+
+# ============================================================
+# CHANGE FEED
+# ============================================================
+FEED_LAG = metrics.Histogram(
+    "face_change_feed_lag_seconds", "Time from a student_faces commit to this worker applying it.")
+
+change_feed = ChangeFeed(
+    connect=get_connection,
+    apply=apply_face_changes,
+    schema_dir=MIGRATIONS,
+    poll_interval=float(os.getenv("FACE_FEED_POLL_S", "2")),
+    listen=os.getenv("FACE_FEED_LISTEN", "true").lower() == "true",
+    on_lag=FEED_LAG.observe,
+)
+
+
+# ============================================================
+# WARM-UP
+# ============================================================
+WARMED_UP = threading.Event()
+
+def warm_up():
+    """Run one dummy detection and embedding so the first request pays no
+    lazy-initialization cost (kernel selection, arena allocation)."""
+    t = time.perf_counter()
+    blank = np.zeros((640, 640, 3), dtype=np.uint8)
+    det_model.detect(blank, max_num=0, metric="default")
+    size = rec_model.input_size[0]
+    rec_model.get_feat([np.zeros((size, size, 3), dtype=np.uint8)])
+    WARMED_UP.set()
+    print(f"🔥 Warm-up done in {(time.perf_counter() - t) * 1000:.0f} ms")
+
+# Runs at import: under the prefork server (gunicorn.conf.py) this happens
+# once in the master, before the workers fork.
+warm_up()
+
+
 # ============================================================
 # MAIN
 # ============================================================
+# Development server only; production runs the prefork server:
+#   gunicorn -c gunicorn.conf.py app:app
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    app.run(
+        host="0.0.0.0",
+        port=5000,
+        debug=os.getenv("FLASK_DEBUG", "false").lower() == "true",
+        use_reloader=False,
+        threaded=True,
+    )
@@ -0,0 +1,129 @@
+# batcher.py — dynamic micro-batching for recognition-model inference
+#
+# Concurrent requests submit aligned face crops; a single scheduler thread
+# drains the queue into batches bounded by `max_batch` and `max_wait_ms`
+# (measured from the first item of the batch), runs one model call per batch
+# and fans the rows back to the waiting callers.
+
+import os
+import time
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class QueueFull(RuntimeError):
+    """Raised when the batcher's queue is at max depth (shed load upstream)."""
+
+
+class MicroBatcher:
+    def __init__(self, run_batch, max_batch=16, max_wait_ms=5.0, max_queue=256, name="batcher"):
+        self.run_batch = run_batch          # list[item] -> array-like with one row per item
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.name = name
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._pid = None
+        self._thread = None
+
+        # metrics
+        self._batches = 0
+        self._items = 0
+        self._rejected = 0
+        self._max_depth = 0
+        self._size_hist = np.zeros(self.max_batch + 1, dtype=np.int64)
+        self._waits = deque(maxlen=2048)       # per-item queue wait (s)
+        self._run_times = deque(maxlen=512)    # per-batch model time (s)
+
+    # ---------- scheduling ----------
+    def _ensure_started(self):
+        # started lazily, and again after a fork: threads do not survive fork()
+        if self._pid == os.getpid() and self._thread is not None:
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None:
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+            self._thread.start()
+
+    def _loop(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._run(batch)
+
+    def _run(self, batch):
+        started = time.perf_counter()
+        try:
+            out = self.run_batch([item for item, _, _ in batch])
+        except Exception as e:  # fan the failure out instead of killing the thread
+            for _, fut, _ in batch:
+                fut.set_exception(e)
+            return
+        done = time.perf_counter()
+
+        with self._lock:
+            self._batches += 1
+            self._items += len(batch)
+            self._size_hist[len(batch)] += 1
+            self._run_times.append(done - started)
+            self._waits.extend(started - enq for _, _, enq in batch)
+
+        for i, (_, fut, _) in enumerate(batch):
+            fut.set_result(out[i])
+
+    # ---------- API ----------
+    def submit_async(self, item):
+        self._ensure_started()
+        fut = Future()
+        try:
+            self._queue.put_nowait((item, fut, time.perf_counter()))
+        except queue.Full:
+            with self._lock:
+                self._rejected += 1
+            raise QueueFull(f"{self.name} queue is full ({self._queue.maxsize})")
+        depth = self._queue.qsize()
+        if depth > self._max_depth:
+            self._max_depth = depth
+        return fut
+
+    def submit(self, item, timeout=None):
+        """Blocking: enqueue one item and return its row of the batch output."""
+        return self.submit_async(item).result(timeout=timeout)
+
+    def submit_many(self, items, timeout=None):
+        futs = [self.submit_async(it) for it in items]
+        return [f.result(timeout=timeout) for f in futs]
+
+    def stats(self):
+        with self._lock:
+            waits = np.array(self._waits, dtype=np.float64) * 1000
+            runs = np.array(self._run_times, dtype=np.float64) * 1000
+            hist = {int(size): int(n) for size, n in enumerate(self._size_hist) if n}
+            return {
+                "max_batch": self.max_batch,
+                "max_wait_ms": self.max_wait * 1000,
+                "queue_depth": self._queue.qsize(),
+                "queue_max_depth": self._max_depth,
+                "queue_capacity": self._queue.maxsize,
+                "batches": self._batches,
+                "items": self._items,
+                "rejected": self._rejected,
+                "avg_batch_size": self._items / self._batches if self._batches else 0.0,
+                "batch_size_hist": hist,
+                "wait_ms_p50": float(np.percentile(waits, 50)) if waits.size else 0.0,
+                "wait_ms_p99": float(np.percentile(waits, 99)) if waits.size else 0.0,
+                "run_ms_p50": float(np.percentile(runs, 50)) if runs.size else 0.0,
+                "run_ms_p99": float(np.percentile(runs, 99)) if runs.size else 0.0,
+            }
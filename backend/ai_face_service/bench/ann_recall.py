@@ -0,0 +1,119 @@
+# bench/ann_recall.py — recall@1 and latency of the IVF index vs exact search
+#
+# Synthetic 512-d galleries: identities are drawn around a set of latent
+# cluster centres (real ArcFace galleries are not uniform on the sphere), and
+# queries are noisy re-captures of enrolled identities.
+#
+#   python bench/ann_recall.py --sizes 10000,100000,1000000 --nprobe 4,8,16,32
+
+import os
+import sys
+import time
+import json
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ann_index import IVFIndex  # noqa: E402
+
+
+def unit_rows(x):
+    return x / np.maximum(np.linalg.norm(x, axis=1, keepdims=True), 1e-12)
+
+
+def make_gallery(n, dim, clusters, spread, rng, chunk=100000):
+    centres = unit_rows(rng.standard_normal((clusters, dim)).astype(np.float32))
+    out = np.empty((n, dim), dtype=np.float32)
+    for s in range(0, n, chunk):
+        m = min(chunk, n - s)
+        noise = rng.standard_normal((m, dim)).astype(np.float32) * (spread / np.sqrt(dim))
+        out[s:s + m] = unit_rows(centres[rng.integers(0, clusters, m)] + noise)
+    return out
+
+
+def make_queries(gallery, n, noise, rng):
+    idx = rng.integers(0, gallery.shape[0], n)
+    q = gallery[idx] + rng.standard_normal((n, gallery.shape[1])).astype(np.float32) * (noise / np.sqrt(gallery.shape[1]))
+    return unit_rows(q)
+
+
+def exact_top1(gallery, queries, chunk=100000):
+    best = np.full(queries.shape[0], -np.inf, dtype=np.float32)
+    arg = np.zeros(queries.shape[0], dtype=np.int64)
+    for s in range(0, gallery.shape[0], chunk):
+        sc = queries @ gallery[s:s + chunk].T
+        i = np.argmax(sc, axis=1)
+        v = sc[np.arange(len(i)), i]
+        better = v > best
+        best[better] = v[better]
+        arg[better] = i[better] + s
+    return arg
+
+
+def bench_size(n, args, rng):
+    print(f"\n=== N={n:,} ===")
+    gallery = make_gallery(n, args.dim, args.clusters, args.spread, rng)
+    queries = make_queries(gallery, args.queries, args.noise, rng)
+
+    truth = exact_top1(gallery, queries)
+    # per-query latency of the flat scan, the same shape of work as /face/recognize
+    sample = queries[:min(50, len(queries))]
+    t = time.perf_counter()
+    for q in sample:
+        np.argmax(gallery @ q)
+    exact_ms = (time.perf_counter() - t) * 1000 / len(sample)
+
+    index = IVFIndex(nlist=args.nlist or None)
+    t = time.perf_counter()
+    index.train(gallery)
+    train_s = time.perf_counter() - t
+    t = time.perf_counter()
+    index.add(np.arange(n), gallery)
+    add_s = time.perf_counter() - t
+    print(f"exact: {exact_ms:.2f} ms/query | nlist={index.nlist} train={train_s:.1f}s add={add_s:.1f}s")
+
+    rows = []
+    for nprobe in args.nprobe:
+        hits = 0
+        t = time.perf_counter()
+        for q, want in zip(queries, truth):
+            ids, _ = index.search(q, k=1, nprobe=nprobe)
+            hits += int(len(ids) and ids[0] == want)
+        ms = (time.perf_counter() - t) * 1000 / len(queries)
+        recall = hits / len(queries)
+        print(f"nprobe={nprobe:4d}  recall@1={recall:.4f}  {ms:.3f} ms/query  ({exact_ms / ms:.1f}x)")
+        rows.append({"nprobe": nprobe, "recall_at_1": recall, "ms_per_query": ms})
+
+    return {
+        "n": n, "dim": args.dim, "nlist": index.nlist,
+        "exact_ms_per_query": exact_ms, "train_s": train_s, "add_s": add_s,
+        "ivf": rows,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="IVF recall/latency benchmark")
+    ap.add_argument("--sizes", default="10000,100000,1000000")
+    ap.add_argument("--dim", type=int, default=512)
+    ap.add_argument("--queries", type=int, default=500)
+    ap.add_argument("--nlist", type=int, default=0, help="0 = 4*sqrt(N)")
+    ap.add_argument("--nprobe", default="1,4,8,16,32,64")
+    ap.add_argument("--clusters", type=int, default=1000)
+    ap.add_argument("--spread", type=float, default=1.0, help="identity spread around a cluster centre")
+    ap.add_argument("--noise", type=float, default=0.6, help="re-capture noise of a query")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", help="write results as JSON")
+    args = ap.parse_args()
+    args.nprobe = [int(x) for x in args.nprobe.split(",")]
+
+    rng = np.random.default_rng(args.seed)
+    results = [bench_size(int(n), args, rng) for n in args.sizes.split(",")]
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n📝 Results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+# bench/feed_lag.py — propagation delay of the student_faces change feed
+#
+# Runs a ChangeFeed in this process (as a worker would), commits upserts of
+# bench_feed_* rows from a second connection, and measures the time from
+# commit to the feed applying each change. Needs a scratch Postgres named by
+# the DB_* env vars; applies migrations 001/003/004 if missing and removes
+# its rows afterwards. Exits non-zero if any change is lost or misses
+# --max-lag-ms.
+#
+# --writers 2 commits each round from two connections in reverse order of
+# their writes: the first writer draws the lower version but commits last,
+# --commit-gap-ms after the second, so the feed has usually applied the
+# higher version already — the case a "version > last applied" feed loses.
+#
+#   python bench/feed_lag.py --changes 200               # LISTEN/NOTIFY
+#   python bench/feed_lag.py --no-listen --poll 0.5      # polling only
+#   python bench/feed_lag.py --writers 2                 # out-of-order commits
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import psycopg2  # noqa: E402
+import embedding_codec as codec  # noqa: E402
+from db import get_connection  # noqa: E402
+from change_feed import ChangeFeed  # noqa: E402
+
+PREFIX = "bench_feed_"
+
+
+def ensure_schema(conn):
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS student_faces (
+                id SERIAL PRIMARY KEY,
+                student_name VARCHAR(255) UNIQUE NOT NULL,
+                embedding TEXT
+            );
+        """)
+        with open(os.path.join(ROOT, "migrations", "001_embedding_bin.sql"), encoding="utf-8") as f:
+            cur.execute(f.read())
+    conn.commit()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Change feed propagation delay")
+    ap.add_argument("--changes", type=int, default=100)
+    ap.add_argument("--interval-ms", type=float, default=20, help="pause between commits")
+    ap.add_argument("--poll", type=float, default=2.0, help="feed poll interval (s)")
+    ap.add_argument("--no-listen", action="store_true", help="polling only, no LISTEN/NOTIFY")
+    ap.add_argument("--writers", type=int, default=1, help="concurrent writer connections per round")
+    ap.add_argument("--commit-gap-ms", type=float, default=50, help="pause between the writers' commits")
+    ap.add_argument("--max-lag-ms", type=float, default=0, help="fail if any change is slower (0 = poll bound)")
+    ap.add_argument("--out", help="write results as JSON")
+    args = ap.parse_args()
+
+    writers = [get_connection() for _ in range(max(1, args.writers))]
+    ensure_schema(writers[0])
+
+    seen = {}
+    seen_cond = threading.Condition()
+
+    def apply(changes):
+        now = time.perf_counter()
+        with seen_cond:
+            for name, _, _ in changes:
+                if name.startswith(PREFIX):
+                    seen.setdefault(name, now)
+            seen_cond.notify_all()
+
+    feed = ChangeFeed(
+        connect=get_connection, apply=apply,
+        schema_dir=os.path.join(ROOT, "migrations"),
+        poll_interval=args.poll, listen=not args.no_listen,
+    )
+    feed.ensure_started()
+
+    rng = np.random.default_rng(0)
+    lags, lost = [], []
+    cursors = [w.cursor() for w in writers]
+    try:
+        for i in range(args.changes):
+            names = [f"{PREFIX}{i:05d}_{w}" for w in range(len(writers))]
+            for name, cur in zip(names, cursors):  # versions drawn in writer order
+                blob = psycopg2.Binary(codec.encode(rng.standard_normal(512).astype(np.float32), "float16"))
+                cur.execute("""
+                    INSERT INTO student_faces (student_name, embedding_bin) VALUES (%s, %s)
+                    ON CONFLICT (student_name) DO UPDATE SET embedding_bin = EXCLUDED.embedding_bin
+                """, (name, blob))
+            committed = {}
+            for k, (name, conn) in enumerate(reversed(list(zip(names, writers)))):  # committed in reverse
+                if k:
+                    time.sleep(args.commit_gap_ms / 1000)
+                committed[name] = time.perf_counter()
+                conn.commit()
+            with seen_cond:
+                seen_cond.wait_for(lambda: all(n in seen for n in names), timeout=args.poll * 3 + 5)
+            for name in names:
+                if name not in seen:
+                    print(f"❌ {name} never arrived")
+                    lost.append(name)
+                    continue
+                lags.append((seen[name] - committed[name]) * 1000)
+            time.sleep(args.interval_ms / 1000)
+    finally:
+        cur, writer = cursors[0], writers[0]
+        for conn in writers[1:]:
+            conn.rollback()
+            conn.close()
+        cur.execute("DELETE FROM student_faces WHERE student_name LIKE %s", (PREFIX + "%",))
+        writer.commit()
+        cur.execute("DELETE FROM student_face_deletions WHERE student_name LIKE %s", (PREFIX + "%",))
+        writer.commit()
+        writer.close()
+
+    lat = np.array(lags) if lags else np.zeros(1)
+    bound = args.max_lag_ms or (args.poll * 1000 + 250)
+    summary = {
+        "mode": "poll" if args.no_listen else "listen",
+        "poll_interval_s": args.poll,
+        "writers": len(writers),
+        "changes": len(lags) + len(lost),
+        "lost": len(lost),
+        "lag_ms": {q: float(np.percentile(lat, int(q[1:]))) for q in ("p50", "p95", "p99")},
+        "max_ms": float(lat.max()) if lat.size else 0.0,
+        "bound_ms": bound,
+        "feed": feed.stats(),
+    }
+    print(json.dumps(summary, indent=2))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+    if lost:
+        print(f"❌ {len(lost)} change(s) never reached the feed")
+        return 1
+    if summary["max_ms"] > bound:
+        print(f"❌ Max propagation delay {summary['max_ms']:.1f} ms exceeds {bound:.0f} ms")
+        return 1
+    print(f"✅ All {len(lags)} changes propagated within {bound:.0f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
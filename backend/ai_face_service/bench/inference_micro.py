@@ -0,0 +1,99 @@
+# bench/inference_micro.py — per-frame cost of the old script helpers vs inference.py
+#
+# The old register/liveness helpers built a CascadeClassifier per
+# find_face_box call, asked the session for its input name per embedding and
+# (register_from_frame) created an InferenceSession per registration. This
+# times each of those against the shared singletons on a real frame.
+# The ArcFace rows are skipped when onnxruntime or the model is unavailable.
+#
+#   python bench/inference_micro.py --image captured.jpg --iters 50
+
+import os
+import sys
+import time
+import json
+import argparse
+
+import cv2
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import inference  # noqa: E402
+
+
+def timeit(fn, iters):
+    fn()  # warm
+    t = time.perf_counter()
+    for _ in range(iters):
+        fn()
+    return (time.perf_counter() - t) / iters * 1000
+
+
+def old_find_face_box(img):
+    cascade = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    faces = cascade.detectMultiScale(gray, scaleFactor=1.2, minNeighbors=5, minSize=(80, 80))
+    return faces[0] if len(faces) else None
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Shared inference helpers micro-benchmark")
+    ap.add_argument("--image", default=os.path.join(ROOT, "captured.jpg"))
+    ap.add_argument("--iters", type=int, default=50)
+    ap.add_argument("--out", help="write results as JSON")
+    args = ap.parse_args()
+
+    frame = cv2.imread(args.image, cv2.IMREAD_COLOR)
+    if frame is None:
+        print(f"❌ Cannot read {args.image}")
+        return 1
+
+    rows = {}
+    rows["cascade_load_ms"] = timeit(lambda: cv2.CascadeClassifier(inference.HAAR_CASCADE), args.iters)
+    rows["find_face_box_old_ms"] = timeit(lambda: old_find_face_box(frame), args.iters)
+    rows["find_face_box_shared_ms"] = timeit(lambda: inference.find_face_box(frame), args.iters)
+
+    box = inference.find_face_box(frame)
+    face = frame[box[1]:box[3], box[0]:box[2]] if box else cv2.resize(frame, (112, 112))
+    try:
+        import onnxruntime as ort
+        model = inference.find_arcface_model()
+    except (ImportError, FileNotFoundError) as e:
+        print(f"⚠️ Skipping ArcFace rows: {e}")
+    else:
+        sess, _ = inference.arcface_session()
+        rows["session_create_ms"] = timeit(
+            lambda: ort.InferenceSession(model, providers=["CPUExecutionProvider"]), max(1, args.iters // 10))
+        rows["get_inputs_ms"] = timeit(lambda: sess.get_inputs()[0].name, args.iters)
+
+        def old_embedding():
+            x = inference.preprocess_arcface(face)
+            sess.run(None, {sess.get_inputs()[0].name: x})
+
+        rows["embedding_old_ms"] = timeit(old_embedding, args.iters)
+        rows["embedding_shared_ms"] = timeit(lambda: inference.get_embedding(face), args.iters)
+        # register_from_frame: new session + 10 × (box + embedding)
+        rows["register_from_frame_old_ms"] = rows["session_create_ms"] + 10 * (
+            rows["find_face_box_old_ms"] + rows["embedding_old_ms"])
+        rows["register_from_frame_shared_ms"] = 10 * (
+            rows["find_face_box_shared_ms"] + rows["embedding_shared_ms"])
+        # multi-view: one box + a single batched call over the augmented views
+        from register import augment_views
+        views = augment_views(face)
+        rows["register_from_frame_batched_ms"] = rows["find_face_box_shared_ms"] + timeit(
+            lambda: inference.get_embeddings(views), args.iters)
+
+    # liveness loop after the turn: two old find_face_box calls vs one shared
+    rows["liveness_frame_box_old_ms"] = 2 * rows["find_face_box_old_ms"]
+    rows["liveness_frame_box_shared_ms"] = rows["find_face_box_shared_ms"]
+
+    for k, v in rows.items():
+        print(f"{k:32s} {v:9.3f}")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"image": args.image, "frame": list(frame.shape), "iters": args.iters, "ms": rows}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+# bench/quality_gate.py — CPU the face-quality gate saves on a recorded corpus
+#
+# Replays a recording (anything camera_stream.open_source accepts: a video, an
+# image directory, synthetic:...), detects the face in each frame, runs the
+# quality gate and — for every face, so the cost of the rejected ones is
+# known — the ArcFace embedding. CPU is process time (all ORT threads).
+#
+#   saved = Σ embed CPU of rejected faces − Σ gate CPU of all faces
+#
+# --detector haar uses the script path (inference.py: Haar box, no keypoints,
+# so no pose check); --detector scrfd uses the service path (SCRFD box + 5
+# keypoints, aligned ArcFace crop).
+#
+#   python bench/quality_gate.py --source recordings/class_a.mp4 --detector scrfd
+
+import os
+import sys
+import json
+import time
+import argparse
+
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from camera_stream import open_source  # noqa: E402
+from quality import QualityGate  # noqa: E402
+
+
+def haar_pipeline():
+    import inference
+    inference.arcface_session()
+
+    def detect(frame):
+        box = inference.find_face_box(frame)
+        return (box, None) if box else (None, None)
+
+    def embed(frame, box, kps):
+        x0, y0, x1, y1 = box
+        return inference.get_embedding(frame[y0:y1, x0:x1])
+
+    return detect, embed
+
+
+def scrfd_pipeline():
+    from insightface.utils import face_align
+    from face_models import load_face_models
+    det_model, rec_model = load_face_models(name="buffalo_l", det_size=(640, 640))
+    size = rec_model.input_size[0]
+
+    def detect(frame):
+        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)  # as app.detect_faces gets it
+        bboxes, kpss = det_model.detect(rgb, max_num=1, metric="default")
+        return (bboxes[0][:4], kpss[0]) if len(bboxes) else (None, None)
+
+    def embed(frame, box, kps):
+        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        return rec_model.get_feat([face_align.norm_crop(rgb, landmark=kps, image_size=size)])
+
+    return detect, embed
+
+
+def cpu_ms(fn, *args):
+    t = time.process_time()
+    out = fn(*args)
+    return out, (time.process_time() - t) * 1000
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Face-quality gate CPU savings on a recording")
+    ap.add_argument("--source", required=True, help="video file, image directory or synthetic[:WxH[:frames[:image]]]")
+    ap.add_argument("--detector", choices=("haar", "scrfd"), default="scrfd")
+    ap.add_argument("--max-frames", type=int, default=0)
+    ap.add_argument("--min-sharpness", type=float, default=40.0)
+    ap.add_argument("--min-size", type=int, default=64)
+    ap.add_argument("--out", help="write results as JSON")
+    args = ap.parse_args()
+
+    detect, embed = scrfd_pipeline() if args.detector == "scrfd" else haar_pipeline()
+    gate = QualityGate(min_size=args.min_size, min_sharpness=args.min_sharpness)
+    source = open_source(args.source)
+
+    frames = faces = 0
+    gate_ms, embed_ok_ms, embed_rejected_ms = [], [], []
+    try:
+        while not args.max_frames or frames < args.max_frames:
+            ok, frame = source.read()
+            if not ok:
+                break
+            frames += 1
+            box, kps = detect(frame)
+            if box is None:
+                continue
+            faces += 1
+            verdict, ms = cpu_ms(gate.check, frame, box, kps)
+            gate_ms.append(ms)
+            _, ms = cpu_ms(embed, frame, box, kps)
+            (embed_ok_ms if verdict["ok"] else embed_rejected_ms).append(ms)
+    finally:
+        source.release()
+
+    if not faces:
+        print("❌ No faces found in the corpus")
+        return 1
+
+    gate_ms = np.array(gate_ms)
+    embed_all = np.array(embed_ok_ms + embed_rejected_ms)
+    saved = float(np.sum(embed_rejected_ms) - gate_ms.sum())
+    summary = {
+        "source": args.source,
+        "detector": args.detector,
+        "frames": frames,
+        "faces": faces,
+        "quality": gate.stats(),
+        "gate_cpu_ms": {"mean": float(gate_ms.mean()), "p99": float(np.percentile(gate_ms, 99))},
+        "embed_cpu_ms": {"mean": float(embed_all.mean()), "p99": float(np.percentile(embed_all, 99))},
+        "embed_cpu_total_ms": float(embed_all.sum()),
+        "cpu_saved_ms": saved,
+        "cpu_saved_pct": 100.0 * saved / float(embed_all.sum()) if embed_all.sum() > 0 else 0.0,
+    }
+    print(json.dumps(summary, indent=2))
+    print(f"✅ Gate {summary['gate_cpu_ms']['mean']:.3f} ms/face, rejected "
+          f"{summary['quality']['rejected']}/{faces} faces, saved {saved:.0f} ms CPU "
+          f"({summary['cpu_saved_pct']:.1f}% of embedding time)")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
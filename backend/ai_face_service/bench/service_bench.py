@@ -0,0 +1,340 @@
+# bench/service_bench.py — throughput / latency benchmark for the face service
+#
+# 1. Seeds a synthetic gallery into student_faces of the database named by the
+#    DB_* env vars (point them at a scratch Postgres, never production). The
+#    service reads the same DB_* vars, so start it with the same environment;
+#    the bench checks via /face/exists that the service sees the seeded rows.
+# 2. Generates synthetic face uploads by perturbing a seed photo (lighting,
+#    scale, rotation, flip, JPEG quality). Each request also gets a unique
+#    JPEG comment, so the service's upload result cache (keyed on the bytes)
+#    never hits and every request pays detection + embedding; --reuse-uploads
+#    sends the pool as-is to measure the cache-hit path instead. Whether the
+#    service's cache is enabled, and its hits/misses, go into the results.
+# 3. Drives /face/recognize (targeted + legacy), /face/register-mobile and
+#    /face/exists at the requested concurrency against a running service.
+# 4. Reports throughput, p50/p95/p99 and a per-stage breakdown (from the
+#    service's /metrics), and writes everything to a JSON file so releases
+#    can be compared.
+#
+#   python bench/service_bench.py --url http://localhost:5000 --gallery 5000 \
+#       --concurrency 16 --requests 500 --out bench_results.json
+
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import platform
+import subprocess
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import embedding_codec as codec  # noqa: E402
+
+BENCH_PREFIX = "bench_student_"
+SCENARIOS = ("recognize-targeted", "recognize-legacy", "register-mobile", "exists")
+
+
+# ---------- synthetic data ----------
+def synthetic_uploads(seed_path, count, rng, quality=(70, 95)):
+    """Distinct JPEGs derived from one face photo."""
+    base = cv2.imread(seed_path, cv2.IMREAD_COLOR)
+    if base is None:
+        raise FileNotFoundError(f"Seed image not readable: {seed_path}")
+    h, w = base.shape[:2]
+    out = []
+    for _ in range(count):
+        angle = rng.uniform(-8, 8)
+        scale = rng.uniform(0.9, 1.1)
+        m = cv2.getRotationMatrix2D((w / 2, h / 2), angle, scale)
+        m[:, 2] += rng.uniform(-0.03, 0.03, size=2) * (w, h)
+        img = cv2.warpAffine(base, m, (w, h), borderMode=cv2.BORDER_REFLECT)
+        img = cv2.convertScaleAbs(img, alpha=rng.uniform(0.8, 1.2), beta=rng.uniform(-20, 20))
+        if rng.random() < 0.5:
+            img = cv2.flip(img, 1)
+        ok, buf = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, int(rng.integers(*quality))])
+        out.append(buf.tobytes())
+    return out
+
+
+def unique_jpeg(data):
+    """Same image, different bytes: a random COM segment right after SOI."""
+    comment = uuid.uuid4().hex.encode()
+    return data[:2] + b"\xff\xfe" + (len(comment) + 2).to_bytes(2, "big") + comment + data[2:]
+
+
+def seed_gallery(size, fmt, rng, batch=1000):
+    """Insert `size` random unit embeddings as bench_student_* rows."""
+    from db import get_connection
+    import psycopg2
+    import psycopg2.extras
+
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS student_faces (
+            id SERIAL PRIMARY KEY,
+            student_name VARCHAR(255) UNIQUE NOT NULL,
+            embedding TEXT
+        );
+    """)
+    with open(os.path.join(ROOT, "migrations", "001_embedding_bin.sql"), encoding="utf-8") as f:
+        cur.execute(f.read())
+    conn.commit()
+
+    for s in range(0, size, batch):
+        n = min(batch, size - s)
+        vecs = rng.standard_normal((n, 512)).astype(np.float32)
+        rows = [(f"{BENCH_PREFIX}{s + i:07d}", psycopg2.Binary(codec.encode(v, fmt))) for i, v in enumerate(vecs)]
+        psycopg2.extras.execute_values(
+            cur,
+            """
+            INSERT INTO student_faces (student_name, embedding_bin) VALUES %s
+            ON CONFLICT (student_name) DO UPDATE SET embedding_bin = EXCLUDED.embedding_bin, embedding = NULL
+            """,
+            rows,
+        )
+        conn.commit()
+    cur.close()
+    conn.close()
+    print(f"🌱 Seeded {size} synthetic faces ({fmt})")
+
+
+def db_target():
+    """Where the gallery was seeded (no credentials), for the report."""
+    from db import DB_CONFIG
+    return {k: DB_CONFIG[k] for k in ("host", "port", "dbname")}
+
+
+def cleanup_gallery():
+    from db import get_connection
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("DELETE FROM student_faces WHERE student_name LIKE %s OR student_name LIKE %s",
+                (BENCH_PREFIX + "%", "bench_reg_%"))
+    print(f"🧹 Removed {cur.rowcount} benchmark rows")
+    conn.commit()
+    cur.close()
+    conn.close()
+
+
+# ---------- HTTP ----------
+def multipart(fields, files):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for k, v in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{k}"\r\n\r\n{v}\r\n'.encode())
+    for k, (filename, data) in files.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{k}"; filename="{filename}"\r\n'
+            f"Content-Type: image/jpeg\r\n\r\n".encode() + data + b"\r\n"
+        )
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+def call(method, url, body=None, content_type=None, timeout=60):
+    req = urllib.request.Request(url, data=body, method=method)
+    if content_type:
+        req.add_header("Content-Type", content_type)
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            payload = resp.read()
+            status = resp.status
+    except urllib.error.HTTPError as e:
+        payload, status = e.read(), e.code
+    except (urllib.error.URLError, OSError):
+        payload, status = b"", 0
+    return status, (time.perf_counter() - started) * 1000, payload
+
+
+def make_request(scenario, base, uploads, gallery_size, rng_py, unique=True):
+    upload = uploads[rng_py.randrange(len(uploads))]
+    if unique:
+        upload = unique_jpeg(upload)
+    if scenario == "recognize-targeted":
+        name = f"{BENCH_PREFIX}{rng_py.randrange(max(gallery_size, 1)):07d}"
+        body, ct = multipart({}, {"file": ("face.jpg", upload)})
+        return call("POST", f"{base}/face/recognize?name={name}", body, ct)
+    if scenario == "recognize-legacy":
+        body, ct = multipart({}, {"file": ("face.jpg", upload)})
+        return call("POST", f"{base}/face/recognize", body, ct)
+    if scenario == "register-mobile":
+        body, ct = multipart({"name": f"bench_reg_{rng_py.randrange(1000):04d}"}, {"file": ("face.jpg", upload)})
+        return call("POST", f"{base}/face/register-mobile", body, ct)
+    if scenario == "exists":
+        name = f"{BENCH_PREFIX}{rng_py.randrange(max(gallery_size, 1)):07d}"
+        return call("GET", f"{base}/face/exists?name={name}")
+    raise ValueError(scenario)
+
+
+# ---------- /metrics parsing ----------
+STAGE_RE = re.compile(r'^face_stage_seconds_(sum|count)\{([^}]*)\} ([0-9.eE+-]+)$')
+
+
+def scrape_stages(base):
+    status, _, payload = call("GET", f"{base}/metrics")
+    out = {}
+    if status != 200:
+        return out
+    for line in payload.decode().splitlines():
+        m = STAGE_RE.match(line)
+        if not m:
+            continue
+        labels = dict(kv.split("=", 1) for kv in m.group(2).split(","))
+        key = (labels["endpoint"].strip('"'), labels["stage"].strip('"'))
+        out.setdefault(key, {"sum": 0.0, "count": 0.0})[m.group(1)] += float(m.group(3))
+    return out
+
+
+def stage_breakdown(before, after):
+    rows = {}
+    for key, a in after.items():
+        b = before.get(key, {"sum": 0.0, "count": 0.0})
+        n = a["count"] - b["count"]
+        if n > 0:
+            endpoint, stage = key
+            rows.setdefault(endpoint, {})[stage] = {"mean_ms": (a["sum"] - b["sum"]) / n * 1000, "count": int(n)}
+    return rows
+
+
+def upload_cache_stats(base):
+    """The service's upload result cache state (one worker's, under prefork)."""
+    status, _, payload = call("GET", f"{base}/face/cache")
+    if status != 200:
+        return {}
+    return json.loads(payload).get("uploads", {})
+
+
+def check_same_db(base, gallery_size):
+    """True if the service finds a seeded row, i.e. it uses the DB we seeded."""
+    name = f"{BENCH_PREFIX}{gallery_size - 1:07d}"
+    status, _, payload = call("GET", f"{base}/face/exists?name={name}")
+    return status == 200 and json.loads(payload).get("exists", False)
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if len(values) else 0.0
+
+
+def run_scenario(scenario, args, uploads):
+    rng_py = random.Random(args.seed)
+    before = scrape_stages(args.url)
+    cache_before = upload_cache_stats(args.url)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(
+            lambda _: make_request(scenario, args.url, uploads, args.gallery, rng_py,
+                                   unique=not args.reuse_uploads),
+            range(args.requests),
+        ))
+    wall = time.perf_counter() - started
+    after = scrape_stages(args.url)
+    cache_after = upload_cache_stats(args.url)
+
+    lat = np.array([ms for status, ms, _ in results if 200 <= status < 300])
+    errors = sum(1 for status, _, _ in results if not 200 <= status < 300)
+    summary = {
+        "scenario": scenario,
+        "requests": len(results),
+        "errors": errors,
+        "concurrency": args.concurrency,
+        "wall_s": wall,
+        "throughput_rps": len(lat) / wall if wall else 0.0,
+        "latency_ms": {
+            "p50": percentile(lat, 50), "p95": percentile(lat, 95),
+            "p99": percentile(lat, 99), "max": float(lat.max()) if lat.size else 0.0,
+        },
+        # summed over workers when the service runs with FACE_METRICS_DIR
+        "stages": stage_breakdown(before, after),
+        "upload_cache": {k: cache_after.get(k, 0) - cache_before.get(k, 0) for k in ("hits", "misses")},
+    }
+    print(f"{scenario:20s} {summary['throughput_rps']:8.1f} req/s  "
+          f"p50={summary['latency_ms']['p50']:.1f}  p95={summary['latency_ms']['p95']:.1f}  "
+          f"p99={summary['latency_ms']['p99']:.1f} ms  errors={errors}")
+    return summary
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Face service throughput benchmark")
+    ap.add_argument("--url", default="http://localhost:5000")
+    ap.add_argument("--scenarios", default=",".join(SCENARIOS))
+    ap.add_argument("--gallery", type=int, default=1000, help="synthetic gallery size (0 = reuse existing)")
+    ap.add_argument("--gallery-format", default="float16", choices=sorted(codec.FORMATS))
+    ap.add_argument("--skip-seed", action="store_true", help="gallery already seeded")
+    ap.add_argument("--cleanup", action="store_true", help="delete benchmark rows afterwards")
+    ap.add_argument("--seed-image", default=os.path.join(ROOT, "captured.jpg"))
+    ap.add_argument("--uploads", type=int, default=64, help="distinct synthetic JPEGs")
+    ap.add_argument("--reuse-uploads", action="store_true",
+                    help="send the JPEGs unchanged, so repeats hit the service's upload cache")
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    ap.add_argument("--warmup", type=int, default=10)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", default="bench_results.json")
+    args = ap.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    if args.gallery and not args.skip_seed:
+        seed_gallery(args.gallery, args.gallery_format, rng)
+    uploads = synthetic_uploads(args.seed_image, args.uploads, rng)
+    print(f"🖼️ {len(uploads)} synthetic uploads, mean {np.mean([len(u) for u in uploads]) / 1024:.0f} KB")
+
+    status, _, _ = call("GET", f"{args.url}/ready")
+    if status != 200:
+        print(f"❌ Service not ready at {args.url} (status {status})")
+        return 1
+
+    if args.gallery and not check_same_db(args.url, args.gallery):
+        print("❌ The service does not see the seeded gallery: start it with the same DB_* env vars")
+        return 1
+
+    upload_cache = upload_cache_stats(args.url)
+    print(f"🗃️ Service upload cache {'enabled' if upload_cache.get('enabled') else 'disabled'}, "
+          f"{'reused' if args.reuse_uploads else 'unique'} uploads")
+
+    rng_py = random.Random(args.seed)
+    for _ in range(args.warmup):
+        make_request("recognize-targeted", args.url, uploads, args.gallery, rng_py,
+                     unique=not args.reuse_uploads)
+
+    results = [run_scenario(s, args, uploads) for s in args.scenarios.split(",") if s]
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_revision": git_revision(),
+        "host": {"platform": platform.platform(), "cpus": os.cpu_count(), "python": platform.python_version()},
+        "config": {k: v for k, v in vars(args).items() if k != "out"},
+        "service": {"upload_cache_enabled": upload_cache.get("enabled")},
+        "db": db_target() if args.gallery else None,
+        "results": results,
+    }
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"📝 Results written to {args.out}")
+
+    if args.cleanup:
+        cleanup_gallery()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,38 +1,280 @@
+import os
 import cv2
+import sys
+import glob
+import time
 import threading
+from collections import deque
+
+import numpy as np
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+# ---------- capture sources ----------
+# A source has read() -> (ok, frame), release(), `fps` (native rate or None)
+# and `finite` (True when it can run out of frames).
+
+class WebcamSource:
+    finite = False
+
+    def __init__(self, index=0):
+        api = cv2.CAP_DSHOW if sys.platform == "win32" else cv2.CAP_ANY
+        self.cap = cv2.VideoCapture(index, api)
+        self.fps = None  # the device paces itself
+
+    def read(self, buf=None):
+        return self.cap.read(buf)
+
+    def release(self):
+        self.cap.release()
+
+
+class VideoFileSource:
+    finite = True
+
+    def __init__(self, path, loop=False):
+        self.path, self.loop = path, loop
+        self.cap = cv2.VideoCapture(path)
+        if not self.cap.isOpened():
+            raise FileNotFoundError(f"Cannot open video {path}")
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 30.0
+
+    def read(self, buf=None):
+        ok, frame = self.cap.read(buf)
+        if not ok and self.loop:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, frame = self.cap.read(buf)
+        return ok, frame
+
+    def release(self):
+        self.cap.release()
+
+
+class ImageDirSource:
+    finite = True
+
+    def __init__(self, path, loop=False, fps=30.0):
+        self.files = sorted(f for f in glob.glob(os.path.join(path, "*")) if f.lower().endswith(IMAGE_EXTS))
+        if not self.files:
+            raise FileNotFoundError(f"No images in {path}")
+        self.loop, self.fps, self._i = loop, fps, 0
+
+    def read(self, buf=None):
+        if self._i >= len(self.files):
+            if not self.loop:
+                return False, None
+            self._i = 0
+        frame = cv2.imread(self.files[self._i], cv2.IMREAD_COLOR)
+        self._i += 1
+        return frame is not None, frame
+
+    def release(self):
+        pass
+
+
+class SyntheticSource:
+    """Generated frames: a seed image (or a gradient) panned left/right, so
+    pipelines can be exercised without any recording."""
+    finite = True
+
+    def __init__(self, width=640, height=480, frames=300, image=None, fps=30.0):
+        if image is not None:
+            base = cv2.imread(image, cv2.IMREAD_COLOR)
+            if base is None:
+                raise FileNotFoundError(f"Cannot read {image}")
+            base = cv2.resize(base, (width, height))
+        else:
+            x = np.linspace(0, 255, width, dtype=np.float32)
+            y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+            base = np.dstack([np.broadcast_to(x, (height, width)), np.broadcast_to(y, (height, width)),
+                              np.full((height, width), 128, np.float32)]).astype(np.uint8)
+        self.base, self.frames, self.fps, self._i = base, frames, fps, 0
+        self.finite = frames is not None
+
+    def read(self, buf=None):
+        if self.frames is not None and self._i >= self.frames:
+            return False, None
+        h, w = self.base.shape[:2]
+        shift = 0.08 * w * np.sin(2 * np.pi * self._i / 90.0)   # slow head-turn-like pan
+        m = np.float32([[1, 0, shift], [0, 1, 0]])
+        frame = cv2.warpAffine(self.base, m, (w, h), dst=buf, borderMode=cv2.BORDER_REFLECT)
+        self._i += 1
+        return True, frame
+
+    def release(self):
+        pass
+
+
+def open_source(spec=None, loop=False):
+    """Source from a spec: None/"webcam"/"webcam:N"/"N", a video file, an image
+    directory, or "synthetic[:WxH[:frames[:image]]]"."""
+    spec = "webcam" if spec in (None, "") else str(spec)
+    if spec.isdigit():
+        return WebcamSource(int(spec))
+    if spec.startswith("webcam"):
+        return WebcamSource(int(spec.split(":", 1)[1]) if ":" in spec else 0)
+    if spec.startswith("synthetic"):
+        parts = spec.split(":", 3)
+        w, h = (int(v) for v in parts[1].split("x")) if len(parts) > 1 and parts[1] else (640, 480)
+        frames = int(parts[2]) if len(parts) > 2 and parts[2] else 300
+        return SyntheticSource(w, h, frames=frames, image=parts[3] if len(parts) > 3 else None)
+    if os.path.isdir(spec):
+        return ImageDirSource(spec, loop=loop)
+    return VideoFileSource(spec, loop=loop)
+
 
 class CameraStream:
-    def __init__(self):
+    """Background capture into a preallocated ring of `slots` frames.
+
+    Every captured frame gets the next sequence number (1, 2, ...). Readers get
+    read-only views into the ring instead of copies; a view stays valid until
+    `slots - 1` newer frames have been captured, so copy it if you need to
+    keep it longer (see `is_valid`).
+
+    `source` is anything open_source() accepts (default: the webcam). `fps`
+    paces the capture: None = the source's own rate, 0 = as fast as possible,
+    N = fixed rate. With `backpressure`, capture waits until the previous frame
+    was read, so an offline run processes every frame of a recording.
+    """
+
+    def __init__(self, slots=4, source=None, fps=None, mirror=True, backpressure=False, loop=False):
+        self.slots = max(2, int(slots))
+        self.source_spec = source
+        self.fps = fps
+        self.mirror = mirror
+        self.backpressure = backpressure
+        self.loop = loop
         self.cap = None
-        self.frame = None
         self.running = False
+        self.finished = False                   # a finite source ran out
         self.lock = threading.Lock()
+        self._cond = threading.Condition(self.lock)
+        self._ring = None                       # (slots, h, w, 3) uint8
+        self._captured_at = [0.0] * self.slots  # perf_counter per slot
+        self._scratch = None
+        self.seq = 0                            # last written frame, 0 = none yet
+        self._read_seq = 0                      # newest frame handed to a reader
+
+        # counters
+        self.read_failures = 0
+        self.dropped = 0                        # frames a waiting reader skipped over
+        self._latency = deque(maxlen=512)       # capture -> handed to a reader (s)
+        self._intervals = deque(maxlen=512)     # between captured frames (s)
 
     def start(self):
         if self.running:
             return
-        
-        self.cap = cv2.VideoCapture(0, cv2.CAP_DSHOW)
+
+        self.cap = open_source(self.source_spec, loop=self.loop)
+        if isinstance(self.cap, WebcamSource) and not self.cap.cap.isOpened():
+            raise RuntimeError("Cannot open camera")
         self.running = True
+        self.finished = False
+        fps = self.cap.fps if self.fps is None else self.fps
+        period = 1.0 / fps if fps else 0.0
 
         def run():
+            next_at = time.perf_counter()
             while self.running:
-                ret, frame = self.cap.read()
-                if ret:
-                    frame = cv2.flip(frame, 1)
-                    with self.lock:
-                        self.frame = frame
+                ret, frame = self.cap.read(self._scratch)
+                if not ret:
+                    if self.cap.finite:
+                        break
+                    self.read_failures += 1
+                    time.sleep(0.005)  # camera hiccup: don't spin
+                    continue
+                self._scratch = frame
+                if period:
+                    next_at += period
+                    delay = next_at - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                    else:
+                        next_at = time.perf_counter()  # fell behind: don't burst to catch up
+                self._publish(frame, time.perf_counter())
+            with self._cond:
+                self.finished = True
+                self._cond.notify_all()
 
         threading.Thread(target=run, daemon=True).start()
 
+    def _publish(self, frame, captured_at):
+        with self._cond:
+            if self.backpressure:
+                self._cond.wait_for(lambda: self._read_seq >= self.seq or not self.running)
+            if self._ring is None or self._ring.shape[1:] != frame.shape:
+                self._ring = np.empty((self.slots,) + frame.shape, dtype=frame.dtype)
+            slot = (self.seq + 1) % self.slots
+            # mirror (or copy) straight into the ring slot: no per-frame allocation
+            if self.mirror:
+                cv2.flip(frame, 1, dst=self._ring[slot])
+            else:
+                np.copyto(self._ring[slot], frame)
+            if self.seq:
+                self._intervals.append(captured_at - self._captured_at[self.seq % self.slots])
+            self._captured_at[slot] = captured_at
+            self.seq += 1
+            self._cond.notify_all()
+
     def stop(self):
-        self.running = False
+        with self._cond:
+            self.running = False
+            self._cond.notify_all()
         if self.cap:
             self.cap.release()
 
+    # ---------- readers ----------
+    def _view_locked(self, seq):
+        slot = seq % self.slots
+        view = self._ring[slot].view()
+        view.flags.writeable = False
+        self._latency.append(time.perf_counter() - self._captured_at[slot])
+        if seq > self._read_seq:
+            self._read_seq = seq
+            self._cond.notify_all()
+        return view
+
+    def read(self):
+        """(seq, read-only view) of the latest frame, or (0, None) before the first one."""
+        with self._cond:
+            if self.seq == 0:
+                return 0, None
+            return self.seq, self._view_locked(self.seq)
+
     def get_frame(self):
-        with self.lock:
-            return None if self.frame is None else self.frame.copy()
+        return self.read()[1]
+
+    def wait_for_frame(self, after_seq=0, timeout=None):
+        """Block until a frame newer than `after_seq` exists; (seq, view), or
+        (None, None) on timeout or once a finite source is exhausted."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.seq > after_seq or self.finished, timeout):
+                return None, None
+            if self.seq <= after_seq:
+                return None, None
+            if after_seq and self.seq > after_seq + 1:
+                self.dropped += self.seq - after_seq - 1
+            return self.seq, self._view_locked(self.seq)
+
+    def is_valid(self, seq):
+        """True while the ring slot of frame `seq` has not been overwritten."""
+        return 0 < seq and self.seq - seq < self.slots - 1
+
+    def stats(self):
+        with self._cond:
+            lat = np.array(self._latency, dtype=np.float64) * 1000
+            iv = np.array(self._intervals, dtype=np.float64)
+            return {
+                "seq": self.seq,
+                "finished": self.finished,
+                "slots": self.slots,
+                "read_failures": self.read_failures,
+                "dropped": self.dropped,
+                "capture_fps": float(1.0 / iv.mean()) if iv.size and iv.mean() > 0 else 0.0,
+                "latency_ms_p50": float(np.percentile(lat, 50)) if lat.size else 0.0,
+                "latency_ms_p99": float(np.percentile(lat, 99)) if lat.size else 0.0,
+            }
 
 
 camera_stream = CameraStream()
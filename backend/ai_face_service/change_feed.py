@@ -0,0 +1,212 @@
+# change_feed.py — propagate student_faces changes to every worker's memory
+#
+# migrations/003_change_feed.sql stamps each row with a monotonically
+# increasing version, keeps versioned tombstones for deletes and sends
+# NOTIFY student_faces_changed on every change. Each worker runs one
+# ChangeFeed thread on a dedicated (unpooled) connection: it LISTENs, and on
+# a notification — or at the latest every `poll_interval` seconds, in case a
+# notification was missed across a reconnect — fetches what changed and
+# hands it to `apply`.
+#
+# "Version greater than the last one applied" is not enough: versions are
+# drawn when the statement runs, so a transaction holding version 10 can
+# commit after one holding 11. Changes therefore also carry their writer's
+# transaction id (migrations/004). Every poll first reads the xmin of the
+# current snapshot — every transaction not finished by then has txid >= xmin —
+# and the next poll re-reads all changes with txid >= that xmin, skipping
+# (name, version) pairs already applied. A late committer is picked up by the
+# first poll after its commit, so the lag stays bounded by `poll_interval`.
+
+import os
+import time
+import select
+import threading
+from collections import deque
+
+import numpy as np
+import psycopg2
+import psycopg2.extensions
+
+import embedding_codec as codec
+from db import EMBEDDING_COLUMN_SQL
+
+CHANNEL = "student_faces_changed"
+
+# applied in order by _open() when their probe says they are missing
+SCHEMA = (
+    (EMBEDDING_COLUMN_SQL, "001_embedding_bin.sql"),
+    ("SELECT to_regclass('student_face_deletions') IS NOT NULL", "003_change_feed.sql"),
+    ("SELECT EXISTS (SELECT 1 FROM information_schema.columns "
+     "WHERE table_name = 'student_faces' AND column_name = 'txid')", "004_change_feed_txid.sql"),
+)
+
+XMIN_SQL = "SELECT txid_snapshot_xmin(txid_current_snapshot())"
+
+DELTA_SQL = """
+    SELECT student_name, embedding_bin, embedding, version, txid, FALSE,
+           EXTRACT(EPOCH FROM clock_timestamp() - updated_at)
+      FROM student_faces WHERE txid >= %(since)s AND version > %(after)s
+    UNION ALL
+    SELECT student_name, NULL, NULL, version, txid, TRUE,
+           EXTRACT(EPOCH FROM clock_timestamp() - deleted_at)
+      FROM student_face_deletions WHERE txid >= %(since)s AND version > %(after)s
+    ORDER BY 4
+    LIMIT %(limit)s
+"""
+
+HEAD_SQL = """
+    SELECT GREATEST(
+        (SELECT COALESCE(MAX(version), 0) FROM student_faces),
+        (SELECT COALESCE(MAX(version), 0) FROM student_face_deletions))
+"""
+
+
+class ChangeFeed:
+    def __init__(self, connect, apply, schema_dir=None, poll_interval=2.0, listen=True,
+                 batch=1000, on_lag=None, name="change-feed"):
+        self.connect = connect              # () -> new psycopg2 connection
+        self.apply = apply                  # list[(name, vector | None, version)] -> None
+        self.schema_dir = schema_dir
+        self.poll_interval = float(poll_interval)
+        self.listen = listen
+        self.batch = int(batch)
+        self.on_lag = on_lag                # seconds from commit to applied, per change
+        self.name = name
+        self.version = None                 # highest version applied
+        self._since = None                  # re-read changes with txid >= this
+        self._seen = {}                     # name -> (version, txid) applied in the window
+        self._cond = threading.Condition()
+        self._pid = None
+        self._thread = None
+
+        # metrics
+        self.applied = 0
+        self.notifications = 0
+        self.polls = 0
+        self.errors = 0
+        self.last_poll = None
+        self._lags = deque(maxlen=1024)
+
+    # ---------- lifecycle ----------
+    def _open(self):
+        conn = self.connect()
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cur:
+            for probe, fname in SCHEMA if self.schema_dir else ():
+                cur.execute(probe)
+                if not cur.fetchone()[0]:
+                    with open(os.path.join(self.schema_dir, fname), encoding="utf-8") as f:
+                        cur.execute("BEGIN; " + f.read() + "; COMMIT;")
+            if self.listen:
+                cur.execute(f"LISTEN {CHANNEL}")
+            if self.version is None:
+                cur.execute(XMIN_SQL)
+                self._since = int(cur.fetchone()[0])
+                cur.execute(HEAD_SQL)
+                self.version = int(cur.fetchone()[0])
+        return conn
+
+    def ensure_started(self):
+        """Start the feed thread (again after a fork). The first call fixes the
+        start version synchronously, so anything loaded afterwards is covered."""
+        if self._pid == os.getpid() and self._thread is not None:
+            return
+        with self._cond:
+            if self._pid == os.getpid() and self._thread is not None:
+                return
+            conn = self._open()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._loop, args=(conn,), name=self.name, daemon=True)
+            self._thread.start()
+
+    def _loop(self, conn):
+        backoff = 0.5
+        while True:
+            try:
+                if conn is None:
+                    conn = self._open()
+                    backoff = 0.5
+                if self.listen:
+                    ready, _, _ = select.select([conn], [], [], self.poll_interval)
+                    if ready:
+                        conn.poll()
+                        if conn.notifies:
+                            self.notifications += len(conn.notifies)
+                            conn.notifies.clear()
+                else:
+                    time.sleep(self.poll_interval)
+                self.catch_up(conn)
+            except (psycopg2.Error, OSError) as e:
+                self.errors += 1
+                print(f"⚠️ Change feed: {e!r}; reconnecting in {backoff:.1f}s")
+                try:
+                    if conn is not None:
+                        conn.close()
+                except psycopg2.Error:
+                    pass
+                conn = None
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+
+    # ---------- deltas ----------
+    def catch_up(self, conn):
+        """Fetch and apply everything committed since the previous poll."""
+        self.polls += 1
+        with conn.cursor() as cur:
+            cur.execute(XMIN_SQL)
+            next_since = int(cur.fetchone()[0])
+        after = 0
+        while True:
+            with conn.cursor() as cur:
+                cur.execute(DELTA_SQL, {"since": self._since, "after": after, "limit": self.batch})
+                rows = cur.fetchall()
+            changes, seen, lags = [], {}, []
+            for name, emb_bin, emb_json, version, txid, deleted, lag in rows:
+                version = int(version)
+                after = version
+                prev = seen.get(name) or self._seen.get(name)
+                if prev is not None and prev[0] >= version:
+                    continue  # applied by an earlier poll of this window
+                seen[name] = (version, int(txid))
+                changes.append((name, None if deleted else codec.from_row(emb_bin, emb_json), version))
+                if lag is not None:
+                    lags.append(float(lag))
+            if changes:
+                self.apply(changes)
+                self._seen.update(seen)
+                with self._cond:
+                    self.version = max(self.version or 0, max(v for *_, v in changes))
+                    self.applied += len(changes)
+                    self._lags.extend(lags)
+                    self._cond.notify_all()
+                if self.on_lag is not None:
+                    for lag in lags:
+                        self.on_lag(lag)
+            if len(rows) < self.batch:
+                break
+        # everything below next_since has now been read for good
+        self._since = next_since
+        self._seen = {name: vt for name, vt in self._seen.items() if vt[1] >= next_since}
+        self.last_poll = time.time()
+
+    def wait_for(self, version, timeout=None):
+        """Block until `version` has been applied in this process."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self.version is not None and self.version >= version, timeout)
+
+    def stats(self):
+        with self._cond:
+            lags = np.array(self._lags, dtype=np.float64) * 1000
+            return {
+                "running": self._thread is not None and self._thread.is_alive() and self._pid == os.getpid(),
+                "listen": self.listen,
+                "poll_interval_s": self.poll_interval,
+                "version": self.version,
+                "applied": self.applied,
+                "notifications": self.notifications,
+                "polls": self.polls,
+                "errors": self.errors,
+                "since_last_poll_s": None if self.last_poll is None else time.time() - self.last_poll,
+                "lag_ms_p50": float(np.percentile(lags, 50)) if lags.size else 0.0,
+                "lag_ms_p99": float(np.percentile(lags, 99)) if lags.size else 0.0,
+            }
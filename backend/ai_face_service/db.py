@@ -1,48 +1,275 @@
+import os
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+
 import psycopg2
+import psycopg2.extensions
 import psycopg2.extras
 import numpy as np
 
+import embedding_codec as codec
+
 DB_CONFIG = {
-    "dbname": "Smart_curriculum",
-    "user": "postgres",
-    "password": "YOUR_PASSWORD",
-    "host": "localhost",
-    "port": 5433
+    "dbname": os.getenv("DB_NAME", "Smart_curriculum"),
+    "user": os.getenv("DB_USER", "postgres"),
+    "password": os.getenv("DB_PASS", "YOUR_PASSWORD"),
+    "host": os.getenv("DB_HOST", "localhost"),
+    "port": int(os.getenv("DB_PORT", "5433")),
+    # seconds; a down or unreachable server fails fast instead of hanging requests
+    "connect_timeout": int(os.getenv("DB_CONNECT_TIMEOUT", "5")),
 }
 
+EMBEDDING_SCHEMA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations", "001_embedding_bin.sql")
+EMBEDDING_COLUMN_SQL = (
+    "SELECT EXISTS (SELECT 1 FROM information_schema.columns "
+    "WHERE table_name = 'student_faces' AND column_name = 'embedding_bin')"
+)
+_embedding_schema_ready = threading.Event()
+
+# Storage format for student_faces.embedding_bin: float32 | float16 | int8
+EMBEDDING_FORMAT = os.getenv("FACE_EMBEDDING_FORMAT", "float16").lower()
+
 def get_connection():
+    """Dedicated, unpooled connection (migrations, LISTEN, long-running tools)."""
     return psycopg2.connect(**DB_CONFIG)
 
-# ===== INSERT EMBEDDING =====
-def save_face_embedding(student_name: str, emb: np.ndarray):
-    conn = get_connection()
-    cur = conn.cursor()
 
-    # Convert numpy → python list
-    vector_list = emb.tolist()
+# ===== CONNECTION POOL =====
+class PoolTimeout(RuntimeError):
+    """No connection became available within the checkout timeout."""
 
-    cur.execute("""
-        INSERT INTO student_faces (student_name, embedding)
-        VALUES (%s, %s)
-        ON CONFLICT (student_name)
-        DO UPDATE SET embedding = EXCLUDED.embedding;
-    """, (student_name, vector_list))
 
-    conn.commit()
-    cur.close()
-    conn.close()
+class ConnectionPool:
+    """Thread-safe psycopg2 pool with blocking checkout and health checks.
 
+    Connections idle for longer than `health_check_after` seconds are probed
+    with `SELECT 1` on checkout and replaced if dead. Idle connections beyond
+    `minconn` are closed after `max_idle` seconds. The pool is per process:
+    after a fork the inherited sockets are abandoned (never closed, they
+    belong to the parent) and the pool refills lazily.
+    """
 
-# ===== LOAD ALL EMBEDDINGS =====
-def load_all_embeddings():
-    conn = get_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    def __init__(self, config, minconn=1, maxconn=8, timeout=5.0, health_check_after=30.0, max_idle=300.0):
+        self.config = dict(config)
+        self.minconn = max(0, minconn)
+        self.maxconn = max(1, maxconn)
+        self.timeout = timeout
+        self.health_check_after = health_check_after
+        self.max_idle = max_idle
+        self._cond = threading.Condition()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = deque()        # (conn, returned_at)
+        self._size = 0              # open connections, idle + checked out
+        self._in_use = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._health_failures = 0
+        self._wait_ms = deque(maxlen=1024)
+
+    def _connect(self):
+        return psycopg2.connect(**self.config)
+
+    def _healthy(self, conn, idle_for):
+        if conn.closed:
+            return False
+        if idle_for < self.health_check_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def getconn(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        started = time.perf_counter()
+        with self._cond:
+            if self._pid != os.getpid():
+                self._reset()
+            waited = False
+            while True:
+                if self._idle:
+                    conn, returned_at = self._idle.pop()
+                    break
+                if self._size < self.maxconn:
+                    self._size += 1
+                    conn, returned_at = None, None
+                    break
+                waited = True
+                remaining = timeout - (time.perf_counter() - started)
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(f"No DB connection available within {timeout:.1f}s")
+                self._cond.wait(remaining)
+            self._in_use += 1
+            self._checkouts += 1
+            if waited:
+                self._waits += 1
+            self._wait_ms.append((time.perf_counter() - started) * 1000)
+
+        # connect / health-check outside the lock
+        try:
+            if conn is not None and not self._healthy(conn, time.monotonic() - returned_at):
+                with self._cond:
+                    self._health_failures += 1
+                self._discard(conn)
+                conn = None
+            if conn is None:
+                conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        return conn
+
+    def putconn(self, conn, broken=False):
+        with self._cond:
+            if self._pid != os.getpid():
+                return  # checked out before a fork; not ours to recycle
+        if not broken and not conn.closed:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                broken = True
+        if broken or conn.closed:
+            self._discard(conn)
+        now = time.monotonic()
+        stale = []
+        with self._cond:
+            self._in_use -= 1
+            if broken or conn.closed:
+                self._size -= 1
+            else:
+                self._idle.append((conn, now))
+            # the left end holds the longest-idle connections
+            while len(self._idle) > self.minconn and now - self._idle[0][1] > self.max_idle:
+                stale.append(self._idle.popleft()[0])
+                self._size -= 1
+            self._cond.notify()
+        for old in stale:
+            self._discard(old)
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection; commit on success, roll back on error."""
+        conn = self.getconn()
+        broken = False
+        try:
+            yield conn
+            conn.commit()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        except Exception:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+            raise
+        finally:
+            self.putconn(conn, broken=broken)
+
+    def stats(self):
+        with self._cond:
+            waits = np.array(self._wait_ms, dtype=np.float64)
+            return {
+                "size": self._size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "min": self.minconn,
+                "max": self.maxconn,
+                "utilization": self._in_use / self.maxconn,
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "timeouts": self._timeouts,
+                "health_failures": self._health_failures,
+                "wait_ms_p50": float(np.percentile(waits, 50)) if waits.size else 0.0,
+                "wait_ms_p99": float(np.percentile(waits, 99)) if waits.size else 0.0,
+            }
 
-    cur.execute("SELECT student_name, embedding FROM student_faces")
 
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
+_pool = None
+_pool_lock = threading.Lock()
+
+def configure_pool(config=None, minconn=None, maxconn=None, timeout=None):
+    """(Re)create the process-wide pool; defaults come from DB_CONFIG and env."""
+    global _pool
+    with _pool_lock:
+        _pool = ConnectionPool(
+            config or DB_CONFIG,
+            minconn=int(os.getenv("DB_POOL_MIN", "1")) if minconn is None else minconn,
+            maxconn=int(os.getenv("DB_POOL_MAX", "8")) if maxconn is None else maxconn,
+            timeout=float(os.getenv("DB_POOL_TIMEOUT", "5")) if timeout is None else timeout,
+        )
+        return _pool
+
+def get_pool():
+    if _pool is None:
+        return configure_pool()
+    return _pool
+
+def connection():
+    """Pooled connection context manager: `with connection() as conn: ...`"""
+    return get_pool().connection()
+
+def pool_stats():
+    return get_pool().stats()
+
+
+# ===== SCHEMA =====
+def ensure_embedding_schema():
+    """Add student_faces.embedding_bin (migrations/001) if this DB predates it.
+
+    Probes the catalog first: the migration's ALTER TABLE takes an ACCESS
+    EXCLUSIVE lock on student_faces, which must not happen on every worker boot.
+    """
+    if _embedding_schema_ready.is_set():
+        return
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute(EMBEDDING_COLUMN_SQL)
+        if not cur.fetchone()[0]:
+            with open(EMBEDDING_SCHEMA, encoding="utf-8") as f:
+                cur.execute(f.read())
+    _embedding_schema_ready.set()
+
+
+# ===== INSERT EMBEDDING =====
+def save_face_embedding(student_name: str, emb: np.ndarray, fmt: str = None):
+    # numpy → compact tagged blob (see embedding_codec), in the service's format by default
+    blob = psycopg2.Binary(codec.encode(emb, fmt or EMBEDDING_FORMAT))
+
+    ensure_embedding_schema()
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute("""
+            INSERT INTO student_faces (student_name, embedding_bin, embedding)
+            VALUES (%s, %s, NULL)
+            ON CONFLICT (student_name)
+            DO UPDATE SET embedding_bin = EXCLUDED.embedding_bin, embedding = NULL;
+        """, (student_name, blob))
+
+
+# ===== LOAD ALL EMBEDDINGS =====
+def load_all_embeddings():
+    with connection() as conn, conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+        cur.execute("SELECT student_name, embedding_bin, embedding FROM student_faces")
+        rows = cur.fetchall()
 
-    # Convert list → numpy array
-    return {row["student_name"]: np.array(row["embedding"], dtype=np.float32) for row in rows}
+    # Binary blob (or legacy JSON/array) → numpy array
+    return {row["student_name"]: codec.from_row(row["embedding_bin"], row["embedding"]) for row in rows}
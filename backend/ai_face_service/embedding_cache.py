@@ -0,0 +1,129 @@
+# embedding_cache.py — in-process LRU + TTL cache of enrolled face templates
+#
+# Targeted verification (/face/recognize?name=...) hits the same few hundred
+# students all day; keeping their templates in memory means the steady state
+# needs no DB round-trip. Entries expire after `ttl` seconds, the least
+# recently used entry is evicted past `max_entries`, and register_mobile
+# replaces a student's entry explicitly.
+#
+# A DB read can race a re-registration: the read sees the old row, the new
+# row commits and invalidates the entry, then the read caches the old
+# template. Readers therefore query inside `with cache.fetching() as gen:` and
+# pass `gen` to put_many(), which skips names invalidated since. Invalidations
+# are only remembered while a fetch older than them is in flight, so the
+# bookkeeping stays proportional to concurrent fetches, not to all students.
+
+import time
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
+
+
+class EmbeddingCache:
+    def __init__(self, max_entries=10000, ttl=3600.0):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = float(ttl)
+        self._data = OrderedDict()   # name -> (template, expires_at)
+        self._lock = threading.Lock()
+        self._generation = 0         # bumped by every invalidate() / clear()
+        self._invalidated = {}       # name -> generation of its last invalidate(), while needed
+        self._in_flight = {}         # generation -> fetches started at it
+        self._cleared = 0            # generation of the last clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, name):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(name)
+            if entry is None:
+                self.misses += 1
+                return None
+            template, expires_at = entry
+            if expires_at <= now:
+                del self._data[name]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(name)
+            self.hits += 1
+            return template
+
+    def put(self, name, template):
+        self.put_many([(name, template)])
+
+    @contextmanager
+    def fetching(self):
+        """Wrap a DB read of templates; yields the generation to pass to put_many()."""
+        with self._lock:
+            gen = self._generation
+            self._in_flight[gen] = self._in_flight.get(gen, 0) + 1
+        try:
+            yield gen
+        finally:
+            with self._lock:
+                if self._in_flight[gen] == 1:
+                    del self._in_flight[gen]
+                else:
+                    self._in_flight[gen] -= 1
+                self._prune()
+
+    def _prune(self):
+        # invalidations at or before the oldest in-flight fetch can no longer reject anything
+        if not self._in_flight:
+            self._invalidated.clear()
+        elif self._invalidated:
+            oldest = min(self._in_flight)
+            self._invalidated = {n: g for n, g in self._invalidated.items() if g > oldest}
+
+    def put_many(self, items, generation=None):
+        """Cache templates; with `generation`, skip names invalidated after it was taken."""
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            for name, template in items:
+                if generation is not None and max(self._cleared, self._invalidated.get(name, 0)) > generation:
+                    continue  # changed while the caller was reading it
+                self._data[name] = (template, expires_at)
+                self._data.move_to_end(name)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, name):
+        with self._lock:
+            self._generation += 1
+            if self._in_flight:
+                self._invalidated[name] = self._generation
+            return self._data.pop(name, None) is not None
+
+    def missing(self, names):
+        """Names that are not cached (or have expired)."""
+        now = time.monotonic()
+        with self._lock:
+            return [n for n in names if n not in self._data or self._data[n][1] <= now]
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._cleared = self._generation
+            self._invalidated.clear()
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "max_entries": self.max_entries,
+                "ttl_s": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
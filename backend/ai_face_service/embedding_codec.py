@@ -0,0 +1,95 @@
+# embedding_codec.py — compact binary storage for face embeddings
+#
+# student_faces.embedding_bin (BYTEA) holds one tagged blob per student:
+#
+#   b"\x01" + float32[dim]                       (2 KB for 512-d)
+#   b"\x02" + float16[dim]                       (1 KB)
+#   b"\x03" + float32 scale + int8[dim]          (~0.5 KB, symmetric per-vector scale)
+#
+# instead of ~10 KB of json.dumps() text. Decoding is np.frombuffer, no parsing.
+# Vectors are L2-normalized before encoding, so a dot product is a cosine.
+
+import json
+import numpy as np
+
+FLOAT32, FLOAT16, INT8 = 1, 2, 3
+FORMATS = {"float32": FLOAT32, "float16": FLOAT16, "int8": INT8}
+
+
+def _unit(v):
+    v = np.asarray(v, dtype=np.float32).ravel()
+    return v / max(float(np.linalg.norm(v)), 1e-12)
+
+
+def quantize_int8(v):
+    """Symmetric per-vector int8 quantization; returns (codes, scale)."""
+    v = np.asarray(v, dtype=np.float32).ravel()
+    scale = max(float(np.abs(v).max()), 1e-12) / 127.0
+    codes = np.clip(np.rint(v / scale), -127, 127).astype(np.int8)
+    return codes, np.float32(scale)
+
+
+def encode(emb, fmt="float16"):
+    """Encode an embedding as a tagged bytes blob."""
+    tag = FORMATS[fmt] if isinstance(fmt, str) else fmt
+    v = _unit(emb)
+    if tag == FLOAT32:
+        return bytes([FLOAT32]) + v.astype("<f4").tobytes()
+    if tag == FLOAT16:
+        return bytes([FLOAT16]) + v.astype("<f2").tobytes()
+    if tag == INT8:
+        codes, scale = quantize_int8(v)
+        return bytes([INT8]) + np.float32(scale).astype("<f4").tobytes() + codes.tobytes()
+    raise ValueError(f"Unknown embedding format: {fmt}")
+
+
+def decode_int8(blob):
+    """Return (codes int8[dim], scale) of an int8 blob without dequantizing."""
+    buf = memoryview(blob)
+    if buf[0] != INT8:
+        raise ValueError("Not an int8 embedding blob")
+    scale = np.frombuffer(buf, dtype="<f4", count=1, offset=1)[0]
+    return np.frombuffer(buf, dtype=np.int8, offset=5), float(scale)
+
+
+def decode(blob):
+    """Decode any tagged blob to a float32 vector."""
+    buf = memoryview(blob)
+    tag = buf[0]
+    if tag == FLOAT32:
+        return np.frombuffer(buf, dtype="<f4", offset=1).astype(np.float32)
+    if tag == FLOAT16:
+        return np.frombuffer(buf, dtype="<f2", offset=1).astype(np.float32)
+    if tag == INT8:
+        codes, scale = decode_int8(buf)
+        return codes.astype(np.float32) * scale
+    raise ValueError(f"Unknown embedding blob tag: {tag}")
+
+
+def int8_scores(query, codes, scales):
+    """Cosine scores of a float query against int8 rows.
+
+    The dot products run on int8 codes with an int32 accumulator; only the
+    final (n,) result is rescaled to float.
+    """
+    q_codes, q_scale = quantize_int8(_unit(query))
+    codes = np.atleast_2d(codes)
+    acc = codes.astype(np.int32) @ q_codes.astype(np.int32)
+    return acc.astype(np.float32) * (np.asarray(scales, dtype=np.float32) * q_scale)
+
+
+def score(query, blob):
+    """Cosine between a query vector and one stored blob, int8 kept integer."""
+    if memoryview(blob)[0] == INT8:
+        codes, scale = decode_int8(blob)
+        return float(int8_scores(query, codes, [scale])[0])
+    return float(np.dot(_unit(query), _unit(decode(blob))))
+
+
+def from_row(emb_bin, emb_json):
+    """Decode a student_faces row, preferring the binary column over legacy JSON."""
+    if emb_bin is not None:
+        return decode(emb_bin)
+    if isinstance(emb_json, str):
+        return np.array(json.loads(emb_json), dtype=np.float32)
+    return np.array(emb_json, dtype=np.float32)
@@ -0,0 +1,50 @@
+# face_models.py — load the buffalo_l detector + ArcFace recognizer with our own ORT sessions
+#
+# insightface's FaceAnalysis builds its sessions with default options (all
+# cores per session) and also loads the landmark and gender/age models we
+# never run. Building SCRFD / ArcFaceONNX directly lets every session use the
+# worker's thread budget from ort_config.
+
+import os
+import glob
+
+from insightface.utils import ensure_available
+from insightface.model_zoo.scrfd import SCRFD
+from insightface.model_zoo.arcface_onnx import ArcFaceONNX
+
+from ort_config import create_session
+
+DET_PATTERNS = ["det_*.onnx", "scrfd*.onnx"]
+REC_PATTERNS = ["w600k_r50.onnx", "glintr100.onnx", "arcface_r100_v1.onnx", "w600k*.onnx"]
+
+
+def find_model(model_dir, patterns):
+    for pattern in patterns:
+        found = sorted(glob.glob(os.path.join(model_dir, pattern)))
+        if found:
+            return found[0]
+    raise FileNotFoundError(f"No model matching {patterns} in {model_dir}")
+
+
+def load_face_models(name="buffalo_l", root="~/.insightface", det_size=(640, 640), det_thresh=0.5):
+    """Return (det_model, rec_model) ready for inference on CPU."""
+    model_dir = ensure_available("models", name, root=root)
+
+    det_path = find_model(model_dir, DET_PATTERNS)
+    det_model = SCRFD(model_file=det_path, session=create_session(det_path))
+    det_model.prepare(-1, input_size=det_size, det_thresh=det_thresh)
+
+    rec_path = find_model(model_dir, REC_PATTERNS)
+    rec_model = ArcFaceONNX(model_file=rec_path, session=create_session(rec_path))
+    rec_model.prepare(-1)
+
+    return det_model, rec_model
+
+
+def model_fingerprint(*models):
+    """Short version string for the loaded model files (name, size, mtime)."""
+    parts = []
+    for model in models:
+        st = os.stat(model.model_file)
+        parts.append(f"{os.path.basename(model.model_file)}:{st.st_size}:{int(st.st_mtime)}")
+    return "|".join(parts)
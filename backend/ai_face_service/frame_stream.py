@@ -0,0 +1,89 @@
+# frame_stream.py — read a clip of encoded frames from a request body as it arrives
+#
+# Two wire formats, both consumed incrementally so a handler can stop reading
+# (and stop paying for decode) as soon as it has its answer:
+#
+#   multipart/form-data        one file part per frame (field "frames", "frame"
+#                              or "file"), parsed part by part off the socket
+#   application/octet-stream   repeated [4-byte big-endian length][JPEG/PNG
+#                              bytes]; a zero length ends the clip early.
+#                              Works with Transfer-Encoding: chunked.
+
+import struct
+
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+
+CHUNK = 64 * 1024
+FRAME_FIELDS = ("frames", "frame", "file")
+
+
+def _read_exact(stream, n):
+    """Up to n bytes; fewer only at the end of the body."""
+    parts, got = [], 0
+    while got < n:
+        chunk = stream.read(n - got)
+        if not chunk:
+            break
+        parts.append(chunk)
+        got += len(chunk)
+    return b"".join(parts)
+
+
+def iter_length_prefixed(stream, max_frame_bytes):
+    """Yield frame payloads from a length-prefixed body; ValueError if malformed."""
+    while True:
+        head = _read_exact(stream, 4)
+        if not head:
+            return
+        if len(head) < 4:
+            raise ValueError("Truncated frame header")
+        (size,) = struct.unpack(">I", head)
+        if size == 0:
+            return
+        if size > max_frame_bytes:
+            raise ValueError("Frame too large")
+        data = _read_exact(stream, size)
+        if len(data) < size:
+            raise ValueError("Truncated frame")
+        yield data
+
+
+def iter_multipart(stream, boundary, max_frame_bytes, fields=FRAME_FIELDS):
+    """Yield the file parts named in `fields` from a multipart body, one per frame."""
+    decoder = MultipartDecoder(boundary.encode("latin-1"))
+    is_frame, parts, size, eof = False, [], 0, False
+    while True:
+        event = decoder.next_event()
+        if isinstance(event, NeedData):
+            if eof:
+                raise ValueError("Truncated multipart body")
+            chunk = stream.read(CHUNK)
+            eof = not chunk
+            decoder.receive_data(chunk or None)
+        elif isinstance(event, (Field, File)):
+            is_frame = isinstance(event, File) and event.name in fields
+            parts, size = [], 0
+        elif isinstance(event, Data):
+            if not is_frame:
+                continue
+            parts.append(event.data)
+            size += len(event.data)
+            if size > max_frame_bytes:
+                raise ValueError("Frame too large")
+            if not event.more_data:
+                yield b"".join(parts)
+        elif isinstance(event, Epilogue):
+            return
+
+
+def iter_frames(req, max_frame_bytes):
+    """Frame payloads from a Flask request body, read lazily; ValueError for an
+    unsupported content type."""
+    if req.mimetype == "multipart/form-data":
+        boundary = req.mimetype_params.get("boundary")
+        if not boundary:
+            raise ValueError("Missing multipart boundary")
+        return iter_multipart(req.stream, boundary, max_frame_bytes)
+    if req.mimetype == "application/octet-stream":
+        return iter_length_prefixed(req.stream, max_frame_bytes)
+    raise ValueError("Expected multipart/form-data or application/octet-stream")
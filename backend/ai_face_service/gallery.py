@@ -0,0 +1,201 @@
+# gallery.py — resident in-memory face gallery for 1:N search
+#
+# All enrolled embeddings live in one contiguous, L2-normalized float32 matrix
+# with a parallel name array, so a search is a single matrix-vector product
+# followed by a top-k selection instead of a Python loop over DB rows.
+
+import os
+import zipfile
+import threading
+import numpy as np
+
+from ann_index import IVFIndex
+
+
+def l2_normalize(v):
+    v = np.asarray(v, dtype=np.float32)
+    return v / max(float(np.linalg.norm(v)), 1e-12)
+
+
+def assign_unique(scores, threshold):
+    """One-to-one assignment of query rows to gallery columns.
+
+    Greedy on the global score order: the best remaining (face, student) pair
+    is taken first, then both its row and column are retired, so two faces can
+    never claim the same student. Returns one column index (or -1) per row.
+    """
+    n_rows, n_cols = scores.shape
+    out = np.full(n_rows, -1, dtype=np.int64)
+    if n_rows == 0 or n_cols == 0:
+        return out
+    flat = np.argsort(-scores, axis=None)
+    used_cols = np.zeros(n_cols, dtype=bool)
+    remaining = min(n_rows, n_cols)
+    for r, c in zip(*np.unravel_index(flat, scores.shape)):
+        if scores[r, c] < threshold or remaining == 0:
+            break
+        if out[r] >= 0 or used_cols[c]:
+            continue
+        out[r] = c
+        used_cols[c] = True
+        remaining -= 1
+    return out
+
+
+class FaceGallery:
+    def __init__(self, capacity=1024):
+        self._capacity = capacity
+        self._matrix = None          # (capacity, dim) float32, rows [0, n) are live
+        self._names = []             # row -> student_name
+        self._rows = {}              # student_name -> row
+        self._lock = threading.RLock()
+        self.index = None            # optional IVFIndex over row ids
+        self.loaded = False
+
+    def __len__(self):
+        return len(self._names)
+
+    def __contains__(self, name):
+        return name in self._rows
+
+    @property
+    def dim(self):
+        return None if self._matrix is None else self._matrix.shape[1]
+
+    def _ensure_capacity(self, dim, needed):
+        if self._matrix is None:
+            cap = max(self._capacity, needed)
+            self._matrix = np.zeros((cap, dim), dtype=np.float32)
+            return
+        if self._matrix.shape[1] != dim:
+            raise ValueError(f"Embedding dim {dim} does not match gallery dim {self._matrix.shape[1]}")
+        if needed > self._matrix.shape[0]:
+            cap = max(needed, 2 * self._matrix.shape[0])
+            grown = np.zeros((cap, dim), dtype=np.float32)
+            grown[:len(self._names)] = self._matrix[:len(self._names)]
+            self._matrix = grown
+
+    def load(self, rows):
+        """Replace the gallery contents with (name, vector) pairs."""
+        names, vecs = [], []
+        for name, vec in rows:
+            names.append(name)
+            vecs.append(np.asarray(vec, dtype=np.float32).ravel())
+
+        with self._lock:
+            self._matrix, self._names, self._rows = None, [], {}
+            if vecs:
+                mat = np.stack(vecs)
+                mat /= np.maximum(np.linalg.norm(mat, axis=1, keepdims=True), 1e-12)
+                self._ensure_capacity(mat.shape[1], len(names))
+                self._matrix[:len(names)] = mat
+                self._names = names
+                self._rows = {n: i for i, n in enumerate(names)}
+            self.index = None
+            self.loaded = True
+
+    def upsert(self, name, emb):
+        """Insert or overwrite one student's embedding in place."""
+        vec = l2_normalize(np.ravel(emb))
+        with self._lock:
+            row = self._rows.get(name)
+            if row is None:
+                row = len(self._names)
+                self._ensure_capacity(vec.shape[0], row + 1)
+                self._names.append(name)
+                self._rows[name] = row
+            self._matrix[row] = vec
+            if self.index is not None:
+                self.index.add([row], vec[None, :])
+            return row
+
+    def remove(self, name):
+        """Drop a student by moving the last row into its slot."""
+        with self._lock:
+            row = self._rows.pop(name, None)
+            if row is None:
+                return False
+            last = len(self._names) - 1
+            if self.index is not None:
+                self.index.remove(row)
+                self.index.remove(last)
+            if row != last:
+                moved = self._names[last]
+                self._matrix[row] = self._matrix[last]
+                self._names[row] = moved
+                self._rows[moved] = row
+                if self.index is not None:
+                    self.index.add([row], self._matrix[row][None, :])
+            self._names.pop()
+            return True
+
+    def get(self, name):
+        with self._lock:
+            row = self._rows.get(name)
+            return None if row is None else self._matrix[row].copy()
+
+    def score_matrix(self, embs, names=None):
+        """Score many queries at once: one (q, n) matrix multiply.
+
+        Restricts the columns to `names` (e.g. a class roster) when given;
+        returns (column names, scores).
+        """
+        q = np.atleast_2d(np.asarray(embs, dtype=np.float32))
+        q = q / np.maximum(np.linalg.norm(q, axis=1, keepdims=True), 1e-12)
+        with self._lock:
+            if names is None:
+                cols = list(self._names)
+                mat = self._matrix[:len(cols)] if cols else np.zeros((0, q.shape[1]), np.float32)
+            else:
+                cols = [n for n in dict.fromkeys(names) if n in self._rows]
+                mat = self._matrix[[self._rows[n] for n in cols]] if cols else np.zeros((0, q.shape[1]), np.float32)
+            return cols, q @ mat.T
+
+    def build_index(self, nlist=None, nprobe=8, path=None):
+        """Attach an IVF index; reuse the coarse quantizer saved at `path` if any."""
+        with self._lock:
+            n = len(self._names)
+            if n == 0:
+                self.index = None
+                return None
+            mat = self._matrix[:n]
+            index = None
+            if path and os.path.exists(path):
+                try:
+                    index = IVFIndex.load(path)
+                except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+                    print(f"⚠️ Cannot load IVF index {path}: {e!r}; retraining")
+                if index is not None and index.centroids.shape[1] != mat.shape[1]:
+                    index = None
+            trained = index is None
+            if trained:
+                index = IVFIndex(nlist=nlist, nprobe=nprobe)
+                index.train(mat)
+            index.nprobe = nprobe
+            index.add(np.arange(n), mat)  # always assigned from the current vectors
+            self.index = index
+            if path and trained:
+                index.save(path)
+            return index
+
+    def search(self, emb, k=5, nprobe=None, exact=False):
+        """Return the top-k (name, cosine score) pairs, best first.
+
+        Uses the IVF index when one is attached, unless `exact` is set.
+        """
+        q = l2_normalize(np.ravel(emb))
+        with self._lock:
+            n = len(self._names)
+            if n == 0:
+                return []
+            if self.index is not None and not exact:
+                ids, scores = self.index.search(q, k=k, nprobe=nprobe)
+                return [(self._names[i], float(s)) for i, s in zip(ids.tolist(), scores.tolist())]
+            scores = self._matrix[:n] @ q
+            k = max(1, min(k, n))
+            if k < n:
+                top = np.argpartition(-scores, k - 1)[:k]
+            else:
+                top = np.arange(n)
+            top = top[np.argsort(-scores[top])]
+            return [(self._names[i], float(scores[i])) for i in top]
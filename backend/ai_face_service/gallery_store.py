@@ -0,0 +1,277 @@
+# gallery_store.py — memory-mapped on-disk face gallery (replaces face_db.pkl)
+#
+# Layout of a gallery directory:
+#   embeddings.<gen>.npy  contiguous float32 (capacity, dim) matrix, preallocated
+#   index.json            {"matrix", "dim", "capacity", "count", "names", ...}
+#
+# Rows are append-only: an insert writes row `count` into the matrix, flushes
+# it, then atomically replaces index.json, which is the commit point. A
+# re-enrollment appends a new row and tombstones the old one (its name becomes
+# null); a delete only tombstones. Compaction copies the live rows into the
+# next generation's file and swaps the index over with os.replace.
+#
+# Readers map the matrix read-only, so every process (liveness, registration,
+# ...) shares one page-cached copy and "loading" is just parsing the index.
+# Writers serialize on a lock file in the directory.
+
+import os
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+INDEX_FILE = "index.json"
+LOCK_FILE = ".lock"
+MIN_CAPACITY = 1024
+
+
+def l2_normalize(v):
+    v = np.asarray(v, dtype=np.float32).ravel()
+    return v / max(float(np.linalg.norm(v)), 1e-12)
+
+
+class GalleryStore:
+    def __init__(self, path, dim=512, capacity=MIN_CAPACITY, compact_ratio=0.25, lock_timeout=10.0):
+        self.path = path
+        self.compact_ratio = compact_ratio
+        self.lock_timeout = lock_timeout
+        self._index_path = os.path.join(path, INDEX_FILE)
+        self._lock = threading.RLock()
+        self._stamp = None
+        self._matrix_name = None
+        self._mm = None
+        os.makedirs(path, exist_ok=True)
+        if not os.path.exists(self._index_path):
+            with self._writer(refresh=False):
+                if not os.path.exists(self._index_path):
+                    self._new_generation(0, dim, max(1, capacity), [], None)
+        self.refresh(force=True)
+
+    # ---------- reading ----------
+    def refresh(self, force=False):
+        """Pick up another process's writes; cheap (one stat) when nothing changed."""
+        with self._lock:
+            st = os.stat(self._index_path)
+            stamp = (st.st_ino, st.st_mtime_ns, st.st_size)   # os.replace gives a new inode
+            if not force and stamp == self._stamp:
+                return False
+            with open(self._index_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta["matrix"] != self._matrix_name:
+                self._mm = np.load(os.path.join(self.path, meta["matrix"]), mmap_mode="r")
+                self._matrix_name = meta["matrix"]
+            self._meta = meta
+            self._names = meta["names"]                      # row -> name (None = tombstone)
+            self._rows = {n: i for i, n in enumerate(self._names) if n is not None}
+            self._stamp = stamp
+            return True
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, name):
+        return name in self._rows
+
+    @property
+    def dim(self):
+        return self._meta["dim"]
+
+    @property
+    def tombstones(self):
+        return self._meta["count"] - len(self._rows)
+
+    def names(self):
+        with self._lock:
+            return list(self._rows)
+
+    def get(self, name):
+        with self._lock:
+            row = self._rows.get(name)
+            return None if row is None else np.array(self._mm[row])
+
+    def items(self):
+        """(name, vector) pairs — the old face_db.pkl dict view."""
+        with self._lock:
+            return [(n, np.array(self._mm[r])) for n, r in self._rows.items()]
+
+    def search(self, emb, k=1):
+        """Top-k (name, cosine) over live rows, best first."""
+        q = l2_normalize(emb)
+        with self._lock:
+            count = self._meta["count"]
+            if not self._rows:
+                return []
+            scores = np.asarray(self._mm[:count] @ q, dtype=np.float32)
+            if len(self._rows) < count:
+                scores[[i for i, n in enumerate(self._names) if n is None]] = -np.inf
+            k = max(1, min(k, len(self._rows)))
+            top = np.argpartition(-scores, k - 1)[:k] if k < count else np.arange(count)
+            top = top[np.argsort(-scores[top])][:k]
+            return [(self._names[i], float(scores[i])) for i in top]
+
+    # ---------- writing ----------
+    @contextmanager
+    def _writer(self, refresh=True):
+        lock_path = os.path.join(self.path, LOCK_FILE)
+        deadline = time.monotonic() + self.lock_timeout
+        while True:
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(lock_path) > 60:
+                        os.remove(lock_path)  # left behind by a crashed writer
+                        continue
+                except OSError:
+                    continue
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"Gallery {self.path} is locked by another writer")
+                time.sleep(0.01)
+        try:
+            with self._lock:
+                if refresh:
+                    self.refresh(force=True)
+                yield
+        finally:
+            os.close(fd)
+            os.remove(lock_path)
+
+    def _write_index(self, meta):
+        meta["version"] = meta.get("version", 0) + 1
+        tmp = self._index_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._index_path)
+        self.refresh(force=True)
+
+    def _new_generation(self, gen, dim, capacity, names, rows):
+        """Write live `rows` into a fresh matrix file and swap the index to it."""
+        fname = f"embeddings.{gen:06d}.npy"
+        mm = np.lib.format.open_memmap(os.path.join(self.path, fname), mode="w+", dtype=np.float32,
+                                       shape=(capacity, dim))
+        if rows is not None and len(names):
+            mm[:len(names)] = rows
+        mm.flush()
+        del mm
+        prev = getattr(self, "_meta", None) or {}
+        self._write_index({
+            "matrix": fname, "generation": gen, "dim": dim, "capacity": capacity,
+            "count": len(names), "names": list(names), "version": prev.get("version", 0),
+        })
+
+    def _append_locked(self, items):
+        meta = dict(self._meta)
+        names = list(self._names)
+        vecs = [l2_normalize(v) for _, v in items]
+        if meta["count"] + len(vecs) > meta["capacity"]:
+            self._compact_locked(min_capacity=len(self._rows) + len(vecs))
+            meta, names = dict(self._meta), list(self._names)
+        start = meta["count"]
+        mm = np.load(os.path.join(self.path, meta["matrix"]), mmap_mode="r+")
+        for i, ((name, _), vec) in enumerate(zip(items, vecs)):
+            if vec.shape[0] != meta["dim"]:
+                raise ValueError(f"Embedding dim {vec.shape[0]} does not match gallery dim {meta['dim']}")
+            mm[start + i] = vec
+        mm.flush()
+        del mm
+        rows = {n: i for i, n in enumerate(names) if n is not None}
+        for i, (name, _) in enumerate(items):
+            if name in rows:
+                names[rows[name]] = None        # tombstone the previous enrollment
+            rows[name] = start + i
+            names.append(name)
+        meta.update(count=len(names), names=names)
+        self._write_index(meta)
+
+    def add(self, name, emb):
+        self.add_many([(name, emb)])
+
+    def add_many(self, items):
+        items = list(items)
+        if not items:
+            return
+        with self._writer():
+            self._append_locked(items)
+            self._maybe_compact_locked()
+
+    def remove(self, name):
+        with self._writer():
+            row = self._rows.get(name)
+            if row is None:
+                return False
+            meta = dict(self._meta)
+            names = list(self._names)
+            names[row] = None
+            meta["names"] = names
+            self._write_index(meta)
+            self._maybe_compact_locked()
+            return True
+
+    def _maybe_compact_locked(self):
+        if self.tombstones > max(16, self.compact_ratio * self._meta["count"]):
+            self._compact_locked()
+
+    def _compact_locked(self, min_capacity=0):
+        old = self._meta["matrix"]
+        live = [(n, r) for n, r in self._rows.items()]
+        names = [n for n, _ in live]
+        rows = np.array(self._mm[[r for _, r in live]]) if live else None
+        capacity = max(MIN_CAPACITY, 2 * max(len(names), min_capacity))
+        self._new_generation(self._meta["generation"] + 1, self._meta["dim"], capacity, names, rows)
+        try:
+            os.remove(os.path.join(self.path, old))
+        except OSError:
+            pass  # still mapped by a reader on Windows; removed by a later compaction
+        for fname in os.listdir(self.path):
+            if fname.startswith("embeddings.") and fname not in (self._meta["matrix"], old):
+                try:
+                    os.remove(os.path.join(self.path, fname))
+                except OSError:
+                    pass
+
+    def compact(self):
+        with self._writer():
+            self._compact_locked()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "path": self.path,
+                "live": len(self._rows),
+                "tombstones": self.tombstones,
+                "count": self._meta["count"],
+                "capacity": self._meta["capacity"],
+                "generation": self._meta["generation"],
+                "dim": self._meta["dim"],
+            }
+
+
+def migrate_pickle(pkl_path, store):
+    """Import a legacy face_db.pkl {name: vector} dict into `store`."""
+    import pickle
+    with open(pkl_path, "rb") as f:
+        db = pickle.load(f)
+    store.add_many(db.items())
+    return len(db)
+
+
+if __name__ == "__main__":
+    # python gallery_store.py <gallery dir> [--migrate face_db.pkl] [--compact]
+    args = sys.argv[1:]
+    if not args:
+        print("usage: gallery_store.py <gallery dir> [--migrate face_db.pkl] [--compact]")
+        sys.exit(2)
+    store = GalleryStore(args[0])
+    if "--migrate" in args:
+        n = migrate_pickle(args[args.index("--migrate") + 1], store)
+        print(f"📦 Migrated {n} faces")
+    if "--compact" in args:
+        store.compact()
+        print("🧹 Compacted")
+    print(json.dumps(store.stats(), indent=2))
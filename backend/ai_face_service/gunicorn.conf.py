@@ -0,0 +1,63 @@
+# gunicorn.conf.py — production serving mode for the face service
+#
+#   gunicorn -c gunicorn.conf.py app:app
+#
+# Pre-forks FACE_WORKERS processes. With FACE_INTRA_OP_THREADS=1 (the default
+# when workers == cores) the ONNX models are loaded and warmed up once in the
+# master and the workers share the read-only weights copy-on-write. ONNX
+# Runtime intra-op thread pools do not survive fork(), so with a larger
+# per-worker thread budget each worker loads its own sessions instead.
+#
+# /metrics merges every worker's snapshot from FACE_METRICS_DIR (metrics.py);
+# the directory is emptied when the server starts.
+
+import os
+import glob
+import tempfile
+import multiprocessing
+
+cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else multiprocessing.cpu_count()
+
+workers = int(os.getenv("FACE_WORKERS", str(cores)))
+intra_op = int(os.getenv("FACE_INTRA_OP_THREADS", "0")) or max(1, cores // workers)
+
+# Visible to app.py / ort_config.py, which are imported after this file.
+os.environ["FACE_WORKERS"] = str(workers)
+os.environ["FACE_INTRA_OP_THREADS"] = str(intra_op)
+# NumPy/OpenCV must respect the same budget (gallery matmuls, resizes).
+for var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+    os.environ.setdefault(var, str(intra_op))
+metrics_dir = os.environ.setdefault("FACE_METRICS_DIR", os.path.join(tempfile.gettempdir(), "face_metrics"))
+
+bind = os.getenv("FACE_BIND", "0.0.0.0:5000")
+# A few HTTP threads per worker so concurrent requests can share ArcFace batches.
+worker_class = "gthread"
+threads = int(os.getenv("FACE_HTTP_THREADS", "4"))
+preload_app = intra_op == 1
+timeout = int(os.getenv("FACE_TIMEOUT", "60"))
+graceful_timeout = 30
+max_requests = int(os.getenv("FACE_MAX_REQUESTS", "0"))
+max_requests_jitter = 50 if max_requests else 0
+
+
+def on_starting(server):
+    os.makedirs(metrics_dir, exist_ok=True)
+    for path in glob.glob(os.path.join(metrics_dir, "*.json")):
+        os.remove(path)  # snapshots of a previous run
+
+
+def child_exit(server, worker):
+    import metrics
+    metrics.mark_process_dead(worker.pid)
+
+
+def post_fork(server, worker):
+    import cv2
+    cv2.setNumThreads(intra_op)
+
+
+def when_ready(server):
+    server.log.info(
+        "face service: %d workers × %d intra-op thread(s) on %d cores (preload=%s)",
+        workers, intra_op, cores, preload_app,
+    )
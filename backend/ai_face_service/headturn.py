@@ -0,0 +1,80 @@
+# headturn.py — yaw proxy and head-turn liveness state, shared by the desktop
+# liveness loop (FaceMesh landmarks) and the server endpoint (SCRFD keypoints)
+#
+# yaw ≈ (nose_x − mid-eye x) / inter-eye distance: negative when the head
+# turns to the (mirrored) left, positive to the right, ~0 when frontal.
+
+from collections import deque
+
+import numpy as np
+
+# FaceMesh indices: eye corners and nose tip (yaw) ...
+LEFT_EYE = (33, 133)
+RIGHT_EYE = (362, 263)
+NOSE_TIP = 1
+# ... and a ring of face-oval points (crop box): forehead, chin, cheeks, jaw
+FACE_OVAL = (10, 338, 297, 332, 284, 251, 389, 356, 454, 323, 361, 288, 397, 365, 379, 378, 400,
+             377, 152, 148, 176, 149, 150, 136, 172, 58, 132, 93, 234, 127, 162, 21, 54, 103, 67, 109)
+YAW_POINTS = LEFT_EYE + RIGHT_EYE + (NOSE_TIP,)
+MESH_POINTS = YAW_POINTS + FACE_OVAL
+
+
+def mesh_points(landmarks, w, h, idx=MESH_POINTS):
+    """Pixel coordinates of only the landmarks we use, shape (len(idx), 2)."""
+    lm = landmarks.landmark
+    return np.array([(lm[i].x * w, lm[i].y * h) for i in idx], dtype=np.float32)
+
+
+def yaw_from_x(left_eye_x, right_eye_x, nose_x):
+    mid = 0.5 * (left_eye_x + right_eye_x)
+    return float((nose_x - mid) / (right_eye_x - left_eye_x + 1e-6))
+
+
+def yaw_from_mesh(pts):
+    """Yaw from mesh_points() output (the first five rows are YAW_POINTS)."""
+    return yaw_from_x(pts[0:2, 0].mean(), pts[2:4, 0].mean(), pts[4, 0])
+
+
+def yaw_from_kps(kps):
+    """Yaw from SCRFD's 5 keypoints (left eye, right eye, nose, mouth corners)."""
+    return yaw_from_x(kps[0][0], kps[1][0], kps[2][0])
+
+
+def box_from_points(pts, w, h, pad=0.1):
+    """Square crop box (x0, y0, x1, y1) around the points with a margin, like the
+    Haar boxes the gallery was enrolled with; None if it falls outside the frame."""
+    x0, y0 = pts.min(axis=0)
+    x1, y1 = pts.max(axis=0)
+    side = max(x1 - x0, y1 - y0) * (1 + 2 * pad)
+    cx, cy = 0.5 * (x0 + x1), 0.5 * (y0 + y1)
+    bx0, by0 = int(max(0, cx - side / 2)), int(max(0, cy - side / 2))
+    bx1, by1 = int(min(w, cx + side / 2)), int(min(h, cy + side / 2))
+    if bx1 - bx0 < 16 or by1 - by0 < 16:
+        return None
+    return (bx0, by0, bx1, by1)
+
+
+class HeadTurnTracker:
+    """Smoothed yaw history; passes once both a left and a right turn were seen."""
+
+    def __init__(self, thresh=0.12, window=5):
+        self.thresh = thresh
+        self.history = deque(maxlen=window)
+        self.turned_left = False
+        self.turned_right = False
+
+    @property
+    def passed(self):
+        return self.turned_left and self.turned_right
+
+    def update(self, yaw):
+        self.history.append(yaw)
+        yaw_s = float(np.mean(self.history))
+        if yaw_s < -self.thresh:
+            self.turned_left = True
+        if yaw_s > self.thresh:
+            self.turned_right = True
+        return yaw_s
+
+    def state(self):
+        return {"turned_left": self.turned_left, "turned_right": self.turned_right, "passed": self.passed}
@@ -0,0 +1,133 @@
+# inference.py — shared ArcFace / face-box helpers for register.py and liveness_check.py
+#
+# One ONNX Runtime session, one Haar cascade and one cached input name per
+# process: the scripts used to re-parse the cascade XML on every
+# find_face_box call, query session.get_inputs() on every embedding and build
+# a fresh InferenceSession for every registration.
+
+import os
+import threading
+
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+MODEL_DIR = os.path.join(ROOT, "models", "buffalo_l")
+FACE_DB_PATH = os.path.join(ROOT, "face_db.pkl")
+FACE_GALLERY_PATH = os.getenv("FACE_GALLERY_PATH", os.path.join(ROOT, "face_gallery"))
+ARCFACE_NAMES = ["w600k_r50.onnx", "glintr100.onnx", "arcface_r100_v1.onnx"]
+ARCFACE_SIZE = (112, 112)
+HAAR_CASCADE = os.path.join(cv2.data.haarcascades, "haarcascade_frontalface_default.xml")
+
+_lock = threading.Lock()
+_arcface = None        # (session, input_name)
+_cascade = None
+_gallery = None
+
+
+def find_arcface_model(model_dir=MODEL_DIR):
+    """Path of the first ArcFace ONNX file of the buffalo_l pack found in `model_dir`."""
+    for fname in ARCFACE_NAMES:
+        p = os.path.join(model_dir, fname)
+        if os.path.exists(p):
+            return p
+    raise FileNotFoundError("ArcFace ONNX model not found in models/buffalo_l. "
+                            "Place buffalo_l ONNX there (e.g., w600k_r50.onnx).")
+
+
+def arcface_session():
+    """Process-wide ArcFace session and its input name, created on first use."""
+    global _arcface
+    if _arcface is None:
+        with _lock:
+            if _arcface is None:
+                from ort_config import create_session
+                sess = create_session(find_arcface_model())
+                _arcface = (sess, sess.get_inputs()[0].name)
+    return _arcface
+
+
+def face_cascade():
+    """Process-wide Haar cascade (the XML is parsed once)."""
+    global _cascade
+    if _cascade is None:
+        with _lock:
+            if _cascade is None:
+                _cascade = cv2.CascadeClassifier(HAAR_CASCADE)
+    return _cascade
+
+
+# ---------- math ----------
+def l2_normalize(v):
+    n = np.linalg.norm(v)
+    return v / max(n, 1e-12)
+
+
+# ---------- ArcFace ----------
+def preprocess_arcface(img_bgr, size=ARCFACE_SIZE):
+    # ArcFace expects RGB, 112x112, float32 normalized roughly to [-1,1]
+    img = cv2.resize(img_bgr, size)
+    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB).astype(np.float32)
+    img = (img - 127.5) / 128.0
+    img = np.transpose(img, (2, 0, 1))  # CHW
+    img = np.expand_dims(img, 0)        # NCHW
+    return img
+
+
+def preprocess_batch(faces_bgr, size=ARCFACE_SIZE):
+    """Stack face crops into one normalized NCHW float32 tensor."""
+    batch = np.stack([cv2.resize(f, size) for f in faces_bgr])[..., ::-1]  # BGR -> RGB
+    batch = (batch.astype(np.float32) - 127.5) / 128.0
+    return np.ascontiguousarray(batch.transpose(0, 3, 1, 2))
+
+
+def get_embedding(face_bgr):
+    sess, input_name = arcface_session()
+    out = sess.run(None, {input_name: preprocess_arcface(face_bgr)})[0][0]
+    return l2_normalize(out)
+
+
+def get_embeddings(faces_bgr):
+    """Embed many crops in a single ArcFace call; rows are L2-normalized."""
+    if len(faces_bgr) == 0:
+        return np.zeros((0, 512), dtype=np.float32)
+    sess, input_name = arcface_session()
+    out = sess.run(None, {input_name: preprocess_batch(faces_bgr)})[0].astype(np.float32)
+    return out / np.maximum(np.linalg.norm(out, axis=1, keepdims=True), 1e-12)
+
+
+# ---------- face box ----------
+def find_face_box(img, gray=None):
+    """Largest Haar face as (x0, y0, x1, y1) with a 10% margin, or None.
+
+    Pass `gray` when the caller already has the grayscale frame.
+    """
+    if gray is None:
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    faces = face_cascade().detectMultiScale(gray, scaleFactor=1.2, minNeighbors=5, minSize=(80, 80))
+    if len(faces) == 0:
+        return None
+    # take the largest face
+    (x, y, w, h) = max(faces, key=lambda r: r[2] * r[3])
+    # add a bit of margin
+    pad = int(0.1 * max(w, h))
+    x0 = max(0, x - pad); y0 = max(0, y - pad)
+    x1 = min(img.shape[1], x + w + pad); y1 = min(img.shape[0], y + h + pad)
+    return (int(x0), int(y0), int(x1), int(y1))
+
+
+# ---------- gallery ----------
+def open_gallery(path=FACE_GALLERY_PATH):
+    """Process-wide memory-mapped gallery; imports face_db.pkl the first time."""
+    global _gallery
+    if _gallery is None:
+        with _lock:
+            if _gallery is None:
+                from gallery_store import GalleryStore, migrate_pickle
+                store = GalleryStore(path)
+                if len(store) == 0 and os.path.exists(FACE_DB_PATH):
+                    n = migrate_pickle(FACE_DB_PATH, store)
+                    print(f"📦 Migrated {n} faces from face_db.pkl to {path}")
+                _gallery = store
+    _gallery.refresh()
+    return _gallery
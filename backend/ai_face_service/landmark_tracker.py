@@ -0,0 +1,125 @@
+# landmark_tracker.py — adaptive FaceMesh: downscaled inference + optical-flow tracking
+#
+# FaceMesh runs on a copy of the frame downscaled by `scale`; its landmarks
+# are normalized, so mapping them back to full resolution is just a multiply
+# by the full frame size. Between inferences the used landmarks (headturn.
+# MESH_POINTS) are carried forward with pyramidal Lucas-Kanade flow on the
+# downscaled grayscale frame, which costs a fraction of a FaceMesh pass.
+#
+# The inference stride adapts to the frame budget: with mesh time M, track
+# time T and budget B per frame, running FaceMesh every s frames averages
+# (M + (s−1)·T)/s, so s = ceil((M − T)/(B − T)), clamped to [1, max_stride].
+# A frame still yields points (and a yaw for the smoothing window) every time,
+# so the head-turn history keeps its per-frame meaning.
+
+import math
+import time
+
+import cv2
+import numpy as np
+
+from headturn import mesh_points, YAW_POINTS
+
+
+class AdaptiveLandmarker:
+    def __init__(self, mesh, scale=1.0, budget_ms=33.0, max_stride=6, adaptive=True):
+        self.mesh = mesh
+        self.scale = float(scale)
+        self.budget = budget_ms / 1000.0
+        self.max_stride = max(1, int(max_stride))
+        self.adaptive = adaptive
+        self.stride = 1
+        self._pts = None             # last points, full-resolution pixels
+        self._prev_gray = None
+        self._since = 0              # frames since the last inference
+        self._mesh_s = None          # EMA of one FaceMesh pass
+        self._track_s = None         # EMA of one tracking step
+
+        # counters
+        self.inferences = 0
+        self.tracked = 0
+        self.track_failures = 0
+
+    @staticmethod
+    def _ema(old, new, a=0.2):
+        return new if old is None else (1 - a) * old + a * new
+
+    def _small(self, frame):
+        if self.scale == 1.0:
+            return frame
+        return cv2.resize(frame, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+
+    def _infer(self, small, w, h):
+        res = self.mesh.process(cv2.cvtColor(small, cv2.COLOR_BGR2RGB))
+        if not res.multi_face_landmarks:
+            return None
+        return mesh_points(res.multi_face_landmarks[0], w, h)
+
+    def _track(self, gray):
+        p0 = (self._pts * self.scale).reshape(-1, 1, 2).astype(np.float32)
+        p1, status, _ = cv2.calcOpticalFlowPyrLK(self._prev_gray, gray, p0, None, winSize=(15, 15), maxLevel=2)
+        if p1 is None:
+            return None
+        ok = status.ravel() == 1
+        # the yaw points must all survive, and most of the oval
+        if not ok[:len(YAW_POINTS)].all() or ok.mean() < 0.7:
+            return None
+        pts = p1.reshape(-1, 2) / self.scale
+        if not ok.all():
+            shift = np.median(pts[ok] - self._pts[ok], axis=0)
+            pts[~ok] = self._pts[~ok] + shift
+        return pts
+
+    def _update_stride(self):
+        if self._mesh_s is None:
+            return
+        track = self._track_s or 0.0
+        if self.budget <= track:
+            self.stride = self.max_stride
+        else:
+            need = math.ceil(max(self._mesh_s - track, 0.0) / (self.budget - track))
+            self.stride = max(1, min(self.max_stride, need))
+
+    def process(self, frame):
+        """Landmark points (MESH_POINTS order, full-res pixels) or None; second
+        value is True when FaceMesh ran on this frame."""
+        h, w = frame.shape[:2]
+        small = self._small(frame)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if self.adaptive else None
+
+        pts = None
+        inferred = False
+        if self.adaptive and self._pts is not None and self._since + 1 < self.stride:
+            t = time.perf_counter()
+            pts = self._track(gray)
+            self._track_s = self._ema(self._track_s, time.perf_counter() - t)
+            if pts is None:
+                self.track_failures += 1
+            else:
+                self.tracked += 1
+                self._since += 1
+        if pts is None:
+            t = time.perf_counter()
+            pts = self._infer(small, w, h)
+            self._mesh_s = self._ema(self._mesh_s, time.perf_counter() - t)
+            self.inferences += 1
+            self._since = 0
+            inferred = True
+
+        self._pts = pts
+        self._prev_gray = gray
+        if self.adaptive:
+            self._update_stride()
+        return pts, inferred
+
+    def stats(self):
+        return {
+            "scale": self.scale,
+            "stride": self.stride,
+            "inferences": self.inferences,
+            "tracked": self.tracked,
+            "track_failures": self.track_failures,
+            "mesh_ms": (self._mesh_s or 0.0) * 1000,
+            "track_ms": (self._track_s or 0.0) * 1000,
+            "budget_ms": self.budget * 1000,
+        }
@@ -1,183 +1,226 @@
 # liveness_check.py — quick liveness (simple blink/head-turn cue) + ArcFace recognition via ONNX
 # Writes last_result.json if --write-json path is provided
+#
+# Staged pipeline, one thread per stage:
+#   capture (CameraStream ring) → landmarks + head-turn → recognition
+# with the window drawn on the main thread. Stages hand over through
+# drop-oldest queues, so a slow consumer (ArcFace, imshow) never stalls
+# its producer; the landmark stage always works on the newest frame.
 
-import os
 import sys
 import json
 import cv2
 import time
-import pickle
+import threading
 import numpy as np
-import onnxruntime as ort
 import mediapipe as mp
-from collections import deque
-
-ROOT = os.path.dirname(os.path.abspath(__file__))
-MODEL_DIR = os.path.join(ROOT, "models", "buffalo_l")
-FACE_DB_PATH = os.path.join(ROOT, "face_db.pkl")
-
-# pick an arcface onnx
-ARCFACE_ONNX = None
-for fname in ["w600k_r50.onnx", "glintr100.onnx", "arcface_r100_v1.onnx"]:
-    p = os.path.join(MODEL_DIR, fname)
-    if os.path.exists(p):
-        ARCFACE_ONNX = p
-        break
-if ARCFACE_ONNX is None:
-    raise FileNotFoundError("ArcFace ONNX model not found in models/buffalo_l")
+
+from inference import find_arcface_model, arcface_session, get_embedding, find_face_box, open_gallery
+from headturn import HeadTurnTracker, yaw_from_mesh, box_from_points, YAW_POINTS
+from landmark_tracker import AdaptiveLandmarker
+from camera_stream import CameraStream
+from pipeline_stats import PipelineStats
+from pipeline import DropOldestQueue, start_monitor
+
+# pick an arcface onnx (fails at import if missing)
+ARCFACE_ONNX = find_arcface_model()
 
 # thresholds
 RECOG_THRESHOLD = 0.45
 
-def l2_normalize(v):
-    n = np.linalg.norm(v)
-    return v / max(n, 1e-12)
-
-def preprocess_arcface(img_bgr, size=(112,112)):
-    img = cv2.resize(img_bgr, size)
-    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB).astype(np.float32)
-    img = (img - 127.5) / 128.0
-    img = np.transpose(img, (2,0,1))  # CHW
-    img = np.expand_dims(img, 0)      # NCHW
-    return img
-
-def get_embedding(session, face_bgr):
-    x = preprocess_arcface(face_bgr)
-    input_name = session.get_inputs()[0].name
-    out = session.run(None, {input_name: x})[0][0]
-    return l2_normalize(out)
-
-def cosine(a, b):
-    return float(np.dot(a, b) / max(np.linalg.norm(a) * np.linalg.norm(b), 1e-12))
-
-def load_face_db():
-    if os.path.exists(FACE_DB_PATH):
-        with open(FACE_DB_PATH, "rb") as f:
-            return pickle.load(f)
-    return {}
-
-def find_face_box(img):
-    cascade = cv2.CascadeClassifier(cv2.data.haarcascades +
-                                    "haarcascade_frontalface_default.xml")
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    faces = cascade.detectMultiScale(gray, scaleFactor=1.2, minNeighbors=5, minSize=(80,80))
-    if len(faces) == 0:
-        return None
-    faces = sorted(faces, key=lambda r: r[2]*r[3], reverse=True)
-    (x,y,w,h) = faces[0]
-    pad = int(0.1 * max(w,h))
-    x0 = max(0, x - pad); y0 = max(0, y - pad)
-    x1 = min(img.shape[1], x + w + pad); y1 = min(img.shape[0], y + h + pad)
-    return (x0,y0,x1,y1)
+def option(args, flag, default=None):
+    if flag in args:
+        i = args.index(flag)
+        if i + 1 < len(args):
+            return args[i+1]
+    return default
 
 def main():
-    # output json path
-    out_json = None
+    # --write-json PATH   result file
+    # --source SPEC       webcam (default) | video file | image dir | synthetic[:WxH[:frames[:image]]]
+    # --fps N             capture pacing: source rate by default, 0 = as fast as possible
+    # --headless          no window; run to the end of the recording
+    # --max-frames N      stop after N frames
+    # --legacy-haar       old per-frame Haar box + full landmark array (FPS comparison)
+    # --adaptive          FaceMesh on a downscaled frame + optical-flow tracking in between,
+    #                     inference stride sized to the frame budget
+    # --mesh-scale F      FaceMesh input scale in adaptive mode (default 0.5)
+    # --budget-ms N       per-frame budget in adaptive mode (default: the capture frame period)
+    # --log-every S       log queue depths and stage latencies every S seconds (default 2, 0 = off)
     args = sys.argv[1:]
-    if "--write-json" in args:
-        i = args.index("--write-json")
-        if i + 1 < len(args):
-            out_json = args[i+1]
+    out_json = option(args, "--write-json")
+    source = option(args, "--source")
+    fps = option(args, "--fps")
+    fps = None if fps is None else float(fps)
+    headless = "--headless" in args
+    max_frames = int(option(args, "--max-frames", "0"))
+    legacy_haar = "--legacy-haar" in args
+    adaptive = "--adaptive" in args and not legacy_haar
+    mesh_scale = float(option(args, "--mesh-scale", "0.5"))
+    budget_ms = option(args, "--budget-ms")
+    log_every = float(option(args, "--log-every", "2"))
 
     # init models
-    arc_sess = ort.InferenceSession(ARCFACE_ONNX, providers=["CPUExecutionProvider"])
-    db = load_face_db()
+    arcface_session()
+    gallery = open_gallery()
 
     # mediapipe facemesh for a simple head-turn cue as liveness
     mp_mesh = mp.solutions.face_mesh
     mesh = mp_mesh.FaceMesh(max_num_faces=1, refine_landmarks=True,
                             min_detection_confidence=0.6, min_tracking_confidence=0.6)
-    history = deque(maxlen=5)
-
-    cap = cv2.VideoCapture(0, cv2.CAP_DSHOW)
-    if not cap.isOpened():
-        print("❌ Cannot open camera")
+    tracker = HeadTurnTracker(thresh=0.12, window=5)
+
+    # recordings are replayed frame by frame (the capture waits for us)
+    offline = source is not None and not (source.isdigit() or source.startswith("webcam"))
+    stream = CameraStream(source=source, fps=fps, backpressure=offline)
+    try:
+        stream.start()
+    except (RuntimeError, FileNotFoundError) as e:
+        print(f"❌ Cannot open camera: {e}")
         result = {"ok": False, "error": "camera_open_failed"}
         if out_json:
             with open(out_json, "w", encoding="utf-8") as f:
                 json.dump(result, f)
         return
 
-    print("👀 Liveness: please slowly turn head LEFT then RIGHT… (ESC to cancel)")
+    if budget_ms is None:
+        budget_ms = 1000.0 / (fps if fps and fps > 0 else (stream.cap.fps or 30.0))
+    landmarker = AdaptiveLandmarker(mesh, scale=mesh_scale if adaptive else 1.0,
+                                    budget_ms=float(budget_ms), adaptive=adaptive)
 
-    turned_left = False
-    turned_right = False
-    yaw_thresh = 0.12
+    print("👀 Liveness: please slowly turn head LEFT then RIGHT… (ESC to cancel)")
 
-    def estimate_yaw(landmarks, w, h):
+    def legacy_points(landmarks, w, h):
+        # previous behaviour: all 478 landmarks converted, then six read
         pts = np.array([[p.x*w, p.y*h] for p in landmarks.landmark], dtype=np.float32)
-        # simple yaw proxy: nose x minus mid-eye x
-        L = np.mean(pts[[33,133], 0])   # left eye x
-        R = np.mean(pts[[362,263], 0])  # right eye x
-        mid = 0.5*(L+R)
-        nose_x = pts[1, 0]
-        return (nose_x - mid) / (R - L + 1e-6)
-
-    name_label = "Unknown"
-    score_val = 0.0
-    recognized = False
-
-    while True:
-        ret, frame = cap.read()
-        if not ret:
+        return pts[list(YAW_POINTS)]
+
+    stats = PipelineStats()
+    stop = threading.Event()
+    display_q = DropOldestQueue(2, "display")      # landmark stage → window
+    recog_q = DropOldestQueue(1, "recognize")      # landmark stage → ArcFace
+    outcome = {"recognized": False, "name": "Unknown", "score": 0.0}
+
+    def landmark_stage():
+        seq, last_frame = 0, time.perf_counter()
+        submitted = False
+        while not stop.is_set():
+            got, view = stream.wait_for_frame(seq, timeout=0.5)
+            if view is None:
+                if stream.finished or time.perf_counter() - last_frame > 10.0:
+                    break  # recording finished (or the camera stalled)
+                continue
+            # FaceMesh takes longer than a few capture intervals, so the ring
+            # slot would be rewritten under it: work on one private copy
+            frame = view.copy()
+            if not stream.is_valid(got):
+                continue  # overwritten while being copied
+            seq, last_frame = got, time.perf_counter()
+            h, w = frame.shape[:2]
+
+            # ---- one detection pass: FaceMesh (or tracked landmarks) give both the yaw and the crop box
+            box = None
+            if legacy_haar:
+                with stats.stage("mesh"):
+                    res = mesh.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+                if res.multi_face_landmarks:
+                    tracker.update(yaw_from_mesh(legacy_points(res.multi_face_landmarks[0], w, h)))
+                with stats.stage("face_box"):
+                    box = find_face_box(frame)
+            else:
+                t = time.perf_counter()
+                pts, inferred = landmarker.process(frame)
+                stats.add("mesh" if inferred else "track", time.perf_counter() - t)
+                if pts is not None:
+                    box = box_from_points(pts[len(YAW_POINTS):], w, h)
+                    tracker.update(yaw_from_mesh(pts))
+
+            # liveness passed: hand one crop to the recognition stage and keep going
+            if tracker.passed and not submitted and box:
+                x0, y0, x1, y1 = box
+                recog_q.put((frame[y0:y1, x0:x1].copy(), last_frame))  # the window draws on `frame`
+                submitted = True
+            if not headless:
+                display_q.put((frame, box, tracker.turned_left, tracker.turned_right, last_frame))
+            stats.add("landmark_stage", time.perf_counter() - last_frame)
+            stats.frame()
+            if max_frames and stats.frames >= max_frames:
+                break
+        recog_q.close()
+        display_q.close()
+
+    def recognition_stage():
+        item = recog_q.get()
+        if item is None:
+            return  # pipeline ended before liveness passed
+        face, t_in = item
+        with stats.stage("recognize"):
+            emb = get_embedding(face)
+            gallery.refresh()  # pick up enrollments made since start-up
+            top = gallery.search(emb, k=1)
+        best_name, best_score = top[0] if top else ("Unknown", -1.0)
+        outcome["name"] = best_name if best_score >= RECOG_THRESHOLD else "Unknown"
+        outcome["score"] = float(best_score)
+        outcome["recognized"] = True
+        stats.add("pass_to_result", time.perf_counter() - t_in)
+        stop.set()
+
+    stages = [threading.Thread(target=landmark_stage, name="landmarks", daemon=True),
+              threading.Thread(target=recognition_stage, name="recognition", daemon=True)]
+    for t in stages:
+        t.start()
+    if log_every > 0:
+        start_monitor([display_q, recog_q], stats, stop, interval=log_every,
+                      extra=lambda: f"capture dropped={stream.dropped}")
+
+    # ---- display on the main thread; it only ever takes the newest result
+    while not stop.is_set() and stages[0].is_alive():
+        if headless:
+            stop.wait(0.1)
             continue
-        frame = cv2.flip(frame, 1)
-        h, w = frame.shape[:2]
-
-        # ---- liveness via head turn
-        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        res = mesh.process(rgb)
-        if res.multi_face_landmarks:
-            lm = res.multi_face_landmarks[0]
-            yaw = estimate_yaw(lm, w, h)
-            history.append(yaw)
-            yaw_s = float(np.mean(history))
-            if yaw_s < -yaw_thresh:
-                turned_left = True
-            if yaw_s > yaw_thresh:
-                turned_right = True
-
+        item = display_q.get(timeout=0.1)
+        if item is None:
+            cv2.waitKey(1)  # keep the window responsive
+            continue
+        frame, box, turned_left, turned_right, t_in = item
+        t = time.perf_counter()
         cv2.putText(frame, f"Liveness: left={turned_left} right={turned_right}",
                     (10,30), cv2.FONT_HERSHEY_SIMPLEX, 0.8,
                     (0,255 if (turned_left or turned_right) else 0, 255 if turned_right else 0), 2)
 
-        # When liveness passes, run recognition once
-        if (turned_left and turned_right) and not recognized:
-            box = find_face_box(frame)
-            if box:
-                x0,y0,x1,y1 = box
-                face = frame[y0:y1, x0:x1].copy()
-                emb = get_embedding(arc_sess, face)
-
-                best_name = "Unknown"
-                best_score = -1.0
-                for k, v in db.items():
-                    sc = cosine(emb, v)
-                    if sc > best_score:
-                        best_score = sc
-                        best_name = k
-                name_label = best_name if best_score >= RECOG_THRESHOLD else "Unknown"
-                score_val = float(best_score)
-                recognized = True
-
         # draw face box
-        box = find_face_box(frame)
         if box:
             cv2.rectangle(frame, (box[0],box[1]), (box[2],box[3]), (0,255,0), 2)
 
-        cv2.putText(frame, f"Recognized: {name_label} ({score_val:.2f})",
+        cv2.putText(frame, f"Recognized: {outcome['name']} ({outcome['score']:.2f})",
                     (10,60), cv2.FONT_HERSHEY_SIMPLEX, 0.8,
-                    (0,255,0) if recognized else (0,200,255), 2)
+                    (0,255,0) if outcome["recognized"] else (0,200,255), 2)
 
         cv2.imshow("Liveness + Recognition (ONNX)", frame)
-        key = cv2.waitKey(1) & 0xFF
-        if key == 27 or recognized:
-            break
-
-    cap.release()
-    cv2.destroyAllWindows()
-
-    result = {"recognized": recognized, "name": name_label, "score": score_val}
+        if cv2.waitKey(1) & 0xFF == 27:
+            stop.set()
+        stats.add("display", time.perf_counter() - t)
+        stats.add("frame_to_screen", time.perf_counter() - t_in)
+
+    # an in-flight recognition finishes; ESC or the end of the stream stops the rest
+    stages[0].join()
+    stages[1].join()
+    stop.set()
+    stream.stop()
+    if not headless:
+        cv2.destroyAllWindows()
+    perf = stats.print_report("Liveness")
+    perf["landmarks"] = landmarker.stats()
+    perf["queues"] = {q.name: q.stats() for q in (display_q, recog_q)}
+    perf["capture"] = stream.stats()
+    for q in (display_q, recog_q):
+        qs = perf["queues"][q.name]
+        print(f"   queue {q.name:10s} max depth {qs['max_depth']}  put {qs['put']}  dropped {qs['dropped']}")
+    if adaptive:
+        print(f"   adaptive: {landmarker.inferences} FaceMesh passes, {landmarker.tracked} tracked frames, "
+              f"stride {landmarker.stride}")
+
+    result = {"recognized": outcome["recognized"], "name": outcome["name"], "score": outcome["score"], "perf": perf}
     if out_json:
         with open(out_json, "w", encoding="utf-8") as f:
             json.dump(result, f, ensure_ascii=False)
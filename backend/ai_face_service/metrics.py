@@ -0,0 +1,289 @@
+# metrics.py — minimal Prometheus text-format metrics for the face service
+#
+# Counters and histograms keyed by label tuples, guarded by one lock each;
+# an observation is a bisect plus a few integer adds, cheap enough to leave
+# on in production. Gauges are callbacks evaluated at scrape time.
+#
+# Metrics live in each process. Under the prefork server a scrape is answered
+# by whichever worker accepts it, so with FACE_METRICS_DIR set (gunicorn.conf.py
+# sets it) every worker also writes a snapshot to <dir>/<pid>.json, from a
+# background thread every FACE_METRICS_FLUSH_S seconds and on each scrape, and
+# render() merges the directory: counters and histograms are summed over all
+# workers (mark_process_dead() folds an exited worker's totals into dead.json,
+# so the sums never go backwards and recycled pids add no series), gauges are
+# exported per live worker with a `pid` label. Without FACE_METRICS_DIR,
+# render() reports this process only — right for `python app.py`, but under
+# prefork that is one worker's view.
+
+import os
+import json
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+# seconds; spans JPEG decode (~ms) up to a slow detector pass on a busy node
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+MULTIPROC_DIR = os.getenv("FACE_METRICS_DIR") or None
+FLUSH_INTERVAL = float(os.getenv("FACE_METRICS_FLUSH_S", "1"))
+DEAD_FILE = "dead.json"
+
+_registry = []
+_flusher_pid = None
+_flusher_lock = threading.Lock()
+
+
+def _fmt_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (list(extra.items()) if extra else [])
+    if not pairs:
+        return ""
+    body = ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in pairs)
+    return "{" + body + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, doc, labelnames=()):
+        self.name, self.doc, self.labelnames = name, doc, tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        _ensure_flusher()
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self):
+        with self._lock:
+            return dict(self._values)
+
+    @staticmethod
+    def merge(total, series):
+        for key, v in series.items():
+            total[key] = total.get(key, 0) + v
+
+    def render(self, extra=None, series=None):
+        series = self.collect() if series is None else series
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} counter"]
+        for key, v in sorted(series.items()):
+            lines.append(f"{self.name}{_fmt_labels(self.labelnames, key, extra)} {v}")
+        return lines
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, doc, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.doc, self.labelnames = name, doc, tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}   # key -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        i = bisect.bisect_left(self.buckets, value)
+        _ensure_flusher()
+        with self._lock:
+            s = self._series.get(key)
+            if s is None:
+                s = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            s[i] += 1
+            s[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t, **labels)
+
+    def collect(self):
+        with self._lock:
+            return {k: list(v) for k, v in self._series.items()}
+
+    @staticmethod
+    def merge(total, series):
+        for key, s in series.items():
+            t = total.get(key)
+            if t is None or len(t) != len(s):
+                total[key] = list(s)
+            else:
+                total[key] = [a + b for a, b in zip(t, s)]
+
+    def render(self, extra=None, series=None):
+        series = self.collect() if series is None else series
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} histogram"]
+        for key, s in sorted(series.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + ("+Inf",), s[:-1]):
+                cumulative += n
+                le = dict(extra or {}, le=bound if bound == "+Inf" else repr(float(bound)))
+                lines.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_fmt_labels(self.labelnames, key, extra)} {s[-1]}")
+            lines.append(f"{self.name}_count{_fmt_labels(self.labelnames, key, extra)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """Scrape-time callback returning a number or {label_value: number}.
+
+    `kind="counter"` exports a monotonic total kept by another component
+    (e.g. cache hits) with the right Prometheus type.
+    """
+
+    def __init__(self, name, doc, fn, labelname=None, kind="gauge"):
+        self.name, self.doc, self.fn, self.labelname, self.kind = name, doc, fn, labelname, kind
+        _registry.append(self)
+
+    def collect(self):
+        """{label tuple: value}; {} if the callback fails."""
+        try:
+            value = self.fn()
+        except Exception:
+            return {}
+        if isinstance(value, dict):
+            return {(str(lv),): float(v) for lv, v in value.items()}
+        return {(): float(value)}
+
+    def samples(self, series, extra=None):
+        return [f"{self.name}{_fmt_labels((self.labelname,) if key else (), key, extra)} {v}"
+                for key, v in sorted(series.items(), key=lambda kv: str(kv[0]))]
+
+    def render(self, extra=None, series=None):
+        series = self.collect() if series is None else series
+        if not series:
+            return []
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"] + self.samples(series, extra)
+
+
+# ---------- multiprocess export ----------
+# snapshot: {metric name: {"type": "counter" | "histogram" | "gauge", "series": [[labels, value], ...]}}
+# Counters and histograms merge by their stored type, so mark_process_dead()
+# works in a master that never imported the app (gunicorn without preload).
+MERGE = {"counter": Counter.merge, "histogram": Histogram.merge}
+
+
+def _encode(series):
+    return [[list(k), v] for k, v in series.items()]
+
+
+def _decode(rows):
+    return {tuple(k): v for k, v in rows}
+
+
+def _series(data, name):
+    entry = data.get(name)
+    return _decode(entry["series"]) if entry else {}
+
+
+def _write_json(path, data):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def _read_json(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None  # vanished (worker exited) or mid-replace on a non-POSIX fs
+
+
+def flush():
+    """Write this process's snapshot to FACE_METRICS_DIR (no-op without it)."""
+    if MULTIPROC_DIR is None:
+        return
+    data = {m.name: {"type": "gauge" if isinstance(m, Gauge) else m.kind, "series": _encode(m.collect())}
+            for m in _registry}
+    os.makedirs(MULTIPROC_DIR, exist_ok=True)
+    _write_json(os.path.join(MULTIPROC_DIR, f"{os.getpid()}.json"), data)
+
+
+def _flush_loop():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        try:
+            flush()
+        except OSError as e:
+            print(f"⚠️ Metrics snapshot not written: {e!r}")
+
+
+def _ensure_flusher():
+    """Start this process's snapshot thread (threads do not survive fork())."""
+    global _flusher_pid
+    if MULTIPROC_DIR is None or _flusher_pid == os.getpid():
+        return
+    with _flusher_lock:
+        if _flusher_pid != os.getpid():
+            _flusher_pid = os.getpid()
+            threading.Thread(target=_flush_loop, name="metrics-flush", daemon=True).start()
+
+
+def mark_process_dead(pid, directory=MULTIPROC_DIR):
+    """Fold an exited worker's counters and histograms into dead.json and
+    drop its snapshot (gunicorn child_exit hook; runs in the master)."""
+    if directory is None:
+        return
+    path = os.path.join(directory, f"{pid}.json")
+    data = _read_json(path)
+    if data is None:
+        return  # never flushed, or unreadable: keep whatever is there
+    dead_path = os.path.join(directory, DEAD_FILE)
+    dead = _read_json(dead_path) or {}
+    for name, entry in data.items():
+        merge = MERGE.get(entry.get("type"))
+        if merge is None:
+            continue  # gauges describe a live process only
+        total = _series(dead, name)
+        merge(total, _decode(entry["series"]))
+        dead[name] = {"type": entry["type"], "series": _encode(total)}
+    try:
+        _write_json(dead_path, dead)
+        os.remove(path)
+    except OSError as e:
+        print(f"⚠️ Metrics of worker {pid} not merged: {e!r}")
+
+
+def _render_merged():
+    flush()
+    snapshots = {}
+    for fname in os.listdir(MULTIPROC_DIR):
+        if fname.endswith(".json"):
+            data = _read_json(os.path.join(MULTIPROC_DIR, fname))
+            if data is not None:
+                snapshots[fname[:-len(".json")]] = data
+    lines = []
+    for m in _registry:
+        if isinstance(m, Gauge):  # per live worker; dead.json holds no gauges
+            samples = []
+            for pid, data in sorted(snapshots.items()):
+                samples.extend(m.samples(_series(data, m.name), {"pid": pid}))
+            if samples:
+                lines += [f"# HELP {m.name} {m.doc}", f"# TYPE {m.name} {m.kind}"] + samples
+            continue
+        total = {}
+        for data in snapshots.values():
+            m.merge(total, _series(data, m.name))
+        lines.extend(m.render(None, total))
+    return lines
+
+
+def render():
+    if MULTIPROC_DIR is not None:
+        lines = _render_merged()
+    else:
+        lines = []
+        for metric in _registry:
+            lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
@@ -0,0 +1,90 @@
+# migrate_embeddings.py — convert student_faces JSON embeddings to binary blobs
+#
+#   python migrate_embeddings.py --format float16 --batch 500 [--drop-json]
+#
+# Connects with the DB_* env vars (db.DB_CONFIG), like the service. Applies
+# migrations/001_embedding_bin.sql (idempotent; the service also applies it on
+# first use), then walks the table in student_name order, one transaction per
+# batch, so it can be stopped and re-run at any point: only rows with
+# embedding_bin IS NULL are touched.
+
+import os
+import sys
+import time
+import argparse
+import psycopg2
+import psycopg2.extras
+
+import embedding_codec as codec
+from db import get_connection
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SCHEMA_SQL = os.path.join(ROOT, "migrations", "001_embedding_bin.sql")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Migrate student_faces embeddings to embedding_bin")
+    ap.add_argument("--format", default="float16", choices=sorted(codec.FORMATS))
+    ap.add_argument("--batch", type=int, default=500)
+    ap.add_argument("--drop-json", action="store_true",
+                    help="set the legacy JSON column to NULL once converted")
+    args = ap.parse_args()
+
+    conn = get_connection()
+    cur = conn.cursor()
+    with open(SCHEMA_SQL, encoding="utf-8") as f:
+        cur.execute(f.read())
+    conn.commit()
+
+    done, json_bytes, bin_bytes = 0, 0, 0
+    last_name = ""
+    t0 = time.time()
+    while True:
+        cur.execute(
+            """
+            SELECT student_name, embedding FROM student_faces
+            WHERE embedding_bin IS NULL AND embedding IS NOT NULL AND student_name > %s
+            ORDER BY student_name
+            LIMIT %s
+        """,
+            (last_name, args.batch),
+        )
+        rows = cur.fetchall()
+        if not rows:
+            break
+
+        updates = []
+        for name, emb in rows:
+            blob = codec.encode(codec.from_row(None, emb), args.format)
+            json_bytes += len(emb) if isinstance(emb, str) else 0
+            bin_bytes += len(blob)
+            updates.append((psycopg2.Binary(blob), name))
+
+        set_json = ", embedding = NULL" if args.drop_json else ""
+        psycopg2.extras.execute_batch(
+            cur,
+            f"UPDATE student_faces SET embedding_bin = %s{set_json} WHERE student_name = %s",
+            updates,
+        )
+        conn.commit()
+
+        done += len(rows)
+        last_name = rows[-1][0]
+        print(f"🔁 Converted {done} rows…")
+
+    if args.drop_json:
+        # rows converted by an earlier run without --drop-json
+        cur.execute("UPDATE student_faces SET embedding = NULL WHERE embedding_bin IS NOT NULL AND embedding IS NOT NULL")
+        conn.commit()
+
+    cur.close()
+    conn.close()
+
+    ratio = f" ({json_bytes / bin_bytes:.1f}x smaller)" if bin_bytes else ""
+    print(f"✅ Migrated {done} embeddings to {args.format} in {time.time() - t0:.1f}s: "
+          f"{json_bytes} → {bin_bytes} bytes{ratio}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
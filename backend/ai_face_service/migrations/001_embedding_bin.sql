@@ -0,0 +1,7 @@
+-- migrations/001_embedding_bin.sql
+-- Compact binary embeddings (see embedding_codec.py). The legacy JSON TEXT
+-- column is kept nullable so unmigrated rows keep working; migrate_embeddings.py
+-- fills embedding_bin in batches and can clear the JSON afterwards.
+
+ALTER TABLE student_faces ADD COLUMN IF NOT EXISTS embedding_bin BYTEA;
+ALTER TABLE student_faces ALTER COLUMN embedding DROP NOT NULL;
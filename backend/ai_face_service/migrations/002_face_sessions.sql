@@ -0,0 +1,13 @@
+-- migrations/002_face_sessions.sql
+-- Roster-scoped recognition sessions (see sessions.py). Each worker pins the
+-- roster in memory; this table lets any worker rebuild a session it has not
+-- seen yet and tells it when a session was closed elsewhere. app.py applies
+-- this file on first use.
+
+CREATE TABLE IF NOT EXISTS face_sessions (
+    session_id TEXT PRIMARY KEY,
+    roster TEXT[] NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    expires_at TIMESTAMPTZ NOT NULL
+);
+CREATE INDEX IF NOT EXISTS face_sessions_expires_at ON face_sessions (expires_at);
@@ -0,0 +1,52 @@
+-- migrations/003_change_feed.sql
+-- Change feed for student_faces (see change_feed.py). Every insert/update
+-- stamps the row with a fresh version from a sequence, deletes leave a
+-- versioned tombstone, and each change sends NOTIFY student_faces_changed
+-- with the new version. Workers apply "changed since version X" deltas.
+
+SELECT pg_advisory_xact_lock(hashtext('student_faces_change_feed'));
+
+CREATE SEQUENCE IF NOT EXISTS student_faces_version_seq;
+ALTER TABLE student_faces
+    ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT nextval('student_faces_version_seq'),
+    ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT clock_timestamp();
+CREATE INDEX IF NOT EXISTS student_faces_version ON student_faces (version);
+
+CREATE TABLE IF NOT EXISTS student_face_deletions (
+    student_name TEXT PRIMARY KEY,
+    version BIGINT NOT NULL,
+    deleted_at TIMESTAMPTZ NOT NULL DEFAULT clock_timestamp()
+);
+CREATE INDEX IF NOT EXISTS student_face_deletions_version ON student_face_deletions (version);
+
+CREATE OR REPLACE FUNCTION student_faces_stamp() RETURNS trigger AS $$
+BEGIN
+    NEW.version := nextval('student_faces_version_seq');
+    NEW.updated_at := clock_timestamp();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION student_faces_notify() RETURNS trigger AS $$
+DECLARE
+    v BIGINT;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        v := nextval('student_faces_version_seq');
+        INSERT INTO student_face_deletions (student_name, version) VALUES (OLD.student_name, v)
+        ON CONFLICT (student_name) DO UPDATE SET version = EXCLUDED.version, deleted_at = clock_timestamp();
+    ELSE
+        v := NEW.version;
+    END IF;
+    PERFORM pg_notify('student_faces_changed', v::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS student_faces_stamp ON student_faces;
+CREATE TRIGGER student_faces_stamp BEFORE INSERT OR UPDATE ON student_faces
+    FOR EACH ROW EXECUTE FUNCTION student_faces_stamp();
+
+DROP TRIGGER IF EXISTS student_faces_notify ON student_faces;
+CREATE TRIGGER student_faces_notify AFTER INSERT OR UPDATE OR DELETE ON student_faces
+    FOR EACH ROW EXECUTE FUNCTION student_faces_notify();
@@ -0,0 +1,40 @@
+-- migrations/004_change_feed_txid.sql
+-- Commit-order safety for the change feed (see change_feed.py). Versions are
+-- drawn when a statement runs, not when its transaction commits, so a
+-- transaction holding version 10 can become visible after one holding 11.
+-- Each change now also records its writer's transaction id; workers re-read
+-- everything written by transactions not yet finished at their previous
+-- poll (txid >= that snapshot's xmin) and skip versions they already applied.
+
+SELECT pg_advisory_xact_lock(hashtext('student_faces_change_feed'));
+
+ALTER TABLE student_faces ADD COLUMN IF NOT EXISTS txid BIGINT NOT NULL DEFAULT txid_current();
+CREATE INDEX IF NOT EXISTS student_faces_txid ON student_faces (txid);
+ALTER TABLE student_face_deletions ADD COLUMN IF NOT EXISTS txid BIGINT NOT NULL DEFAULT txid_current();
+CREATE INDEX IF NOT EXISTS student_face_deletions_txid ON student_face_deletions (txid);
+
+CREATE OR REPLACE FUNCTION student_faces_stamp() RETURNS trigger AS $$
+BEGIN
+    NEW.version := nextval('student_faces_version_seq');
+    NEW.txid := txid_current();
+    NEW.updated_at := clock_timestamp();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION student_faces_notify() RETURNS trigger AS $$
+DECLARE
+    v BIGINT;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        v := nextval('student_faces_version_seq');
+        INSERT INTO student_face_deletions (student_name, version, txid) VALUES (OLD.student_name, v, txid_current())
+        ON CONFLICT (student_name) DO UPDATE
+            SET version = EXCLUDED.version, txid = EXCLUDED.txid, deleted_at = clock_timestamp();
+    ELSE
+        v := NEW.version;
+    END IF;
+    PERFORM pg_notify('student_faces_changed', v::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
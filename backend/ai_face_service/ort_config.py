@@ -0,0 +1,96 @@
+# ort_config.py — ONNX Runtime session settings shared by every model the service loads
+#
+# Each worker process gets an explicit intra-op thread budget so that
+# FACE_WORKERS × FACE_INTRA_OP_THREADS never exceeds the cores we are pinned to.
+#
+# When ort_tuning.py has profiled this host, create_session() applies the
+# winning settings for the model and loads its pre-optimized graph (with
+# graph optimization off, so start-up skips it). FACE_ORT_TUNING=false ignores
+# the profile; FACE_ORT_AUTOTUNE=true tunes missing models at start-up.
+
+import os
+import onnxruntime as ort
+
+PROVIDERS = ["CPUExecutionProvider"]
+
+EXECUTION_MODES = {
+    "sequential": ort.ExecutionMode.ORT_SEQUENTIAL,
+    "parallel": ort.ExecutionMode.ORT_PARALLEL,
+}
+OPTIMIZATION_LEVELS = {
+    "disabled": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+DEFAULT_SETTINGS = {
+    "intra_op_threads": None,       # None = the worker's budget
+    "inter_op_threads": 1,
+    "execution_mode": "sequential",
+    "graph_optimization": "all",
+    "cpu_mem_arena": True,
+    "mem_pattern": True,
+}
+
+
+def cpu_count():
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def worker_count():
+    """Processes sharing this host (set by the prefork server; 1 for `python app.py`)."""
+    return max(1, int(os.getenv("FACE_WORKERS", "1")))
+
+
+def intra_op_threads():
+    explicit = int(os.getenv("FACE_INTRA_OP_THREADS", "0"))
+    return explicit or max(1, cpu_count() // worker_count())
+
+
+def parallel_allowed(budget=None):
+    """Parallel execution needs spare threads, and its inter-op pool does not
+    survive fork(): with a budget of 1 gunicorn.conf.py preloads the sessions
+    in the master, so they must stay sequential."""
+    return (intra_op_threads() if budget is None else budget) > 1
+
+
+def session_options(settings=None):
+    """SessionOptions for `settings` (DEFAULT_SETTINGS keys); intra- and
+    inter-op threads never exceed this worker's budget."""
+    s = {**DEFAULT_SETTINGS, **(settings or {})}
+    budget = intra_op_threads()
+    mode = s["execution_mode"] if parallel_allowed(budget) else "sequential"
+    so = ort.SessionOptions()
+    so.intra_op_num_threads = min(s["intra_op_threads"] or budget, budget)
+    so.inter_op_num_threads = min(s["inter_op_threads"], budget) if mode == "parallel" else 1
+    so.execution_mode = EXECUTION_MODES[mode]
+    so.graph_optimization_level = OPTIMIZATION_LEVELS[s["graph_optimization"]]
+    so.enable_cpu_mem_arena = s["cpu_mem_arena"]
+    so.enable_mem_pattern = s["mem_pattern"]
+    return so
+
+
+def create_session(model_path):
+    if os.getenv("FACE_ORT_TUNING", "true").lower() != "true":
+        return ort.InferenceSession(model_path, sess_options=session_options(), providers=PROVIDERS)
+
+    import ort_tuning
+    entry = ort_tuning.lookup(model_path)
+    if entry is None and os.getenv("FACE_ORT_AUTOTUNE", "false").lower() == "true":
+        entry = ort_tuning.tune_and_save(model_path)
+    if entry is None:
+        return ort.InferenceSession(model_path, sess_options=session_options(), providers=PROVIDERS)
+
+    optimized = entry.get("optimized")
+    if optimized and os.path.exists(optimized):
+        so = session_options({**entry["settings"], "graph_optimization": "disabled"})
+        try:
+            sess = ort.InferenceSession(optimized, sess_options=so, providers=PROVIDERS)
+            print(f"⚙️ {os.path.basename(model_path)}: tuned profile, pre-optimized graph")
+            return sess
+        except Exception as e:  # stale or corrupt cache file: optimize from the original
+            print(f"⚠️ Cannot load {optimized}: {e}")
+    print(f"⚙️ {os.path.basename(model_path)}: tuned profile")
+    return ort.InferenceSession(model_path, sess_options=session_options(entry["settings"]), providers=PROVIDERS)
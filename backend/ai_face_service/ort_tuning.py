@@ -0,0 +1,257 @@
+# ort_tuning.py — per-host ONNX Runtime settings for the face models
+#
+# Benchmarks session settings for a model on this machine — intra/inter-op
+# threads, sequential vs parallel execution, graph optimization level and the
+# CPU memory arena / memory pattern — and keeps the fastest. The winner is
+# stored in a JSON profile together with the graph ORT optimized under those
+# settings (optimized_model_filepath), so ort_config.create_session() can
+# load the pre-optimized file with optimization disabled on later start-ups.
+#
+# Intra- and inter-op thread counts are capped by the worker budget
+# (ort_config.intra_op_threads), and parallel execution is only tried with a
+# budget above 1 (gunicorn.conf.py preloads single-thread sessions before fork),
+# so tune with the same FACE_WORKERS / FACE_INTRA_OP_THREADS the service runs
+# with. The profile is only valid for the host it was measured on (machine,
+# core count, ORT version); on any other it is ignored.
+#
+#   python ort_tuning.py                       # buffalo_l detector + recognizer, greedy search
+#   python ort_tuning.py --search grid --workers 4
+#   python ort_tuning.py --show
+
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import platform
+import itertools
+import threading
+
+import numpy as np
+import onnxruntime as ort
+
+from ort_config import PROVIDERS, DEFAULT_SETTINGS, cpu_count, intra_op_threads, parallel_allowed, session_options
+
+CACHE_DIR = os.path.expanduser(os.getenv("FACE_ORT_CACHE", "~/.insightface/ort_tuned"))
+PROFILE_PATH = os.path.join(CACHE_DIR, "profile.json")
+MIN_GAIN = 0.03   # greedy search: a change must beat the current best by 3%
+
+_lock = threading.Lock()
+_profile = None
+
+
+def host_key():
+    return f"{platform.machine()}|{cpu_count()}cpu|ort{ort.__version__}"
+
+
+def model_key(model_path):
+    st = os.stat(model_path)
+    return f"{os.path.basename(model_path)}:{st.st_size}:{int(st.st_mtime)}"
+
+
+# ---------- profile ----------
+def load_profile(path=PROFILE_PATH):
+    """The tuned profile for this host ({} if missing or measured elsewhere)."""
+    global _profile
+    with _lock:
+        if _profile is None:
+            _profile = {}
+            if os.path.exists(path):
+                try:
+                    with open(path, encoding="utf-8") as f:
+                        data = json.load(f)
+                except ValueError as e:
+                    print(f"⚠️ Unreadable ORT profile {path}: {e}")
+                    return _profile
+                if data.get("host") == host_key():
+                    _profile = data
+                else:
+                    print(f"⚠️ ORT profile {path} is for {data.get('host')}, not {host_key()}: ignored")
+        return _profile
+
+
+def lookup(model_path):
+    """Profile entry for this exact model file, or None."""
+    return load_profile().get("models", {}).get(model_key(model_path))
+
+
+def save_entry(model_path, entry, path=PROFILE_PATH):
+    """Merge one model's entry into the profile file (atomic replace)."""
+    global _profile
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with _lock:
+        data = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        if data.get("host") != host_key():
+            data = {"host": host_key(), "models": {}}
+        data["models"][model_key(model_path)] = entry
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp, path)
+        _profile = data
+
+
+# ---------- benchmark ----------
+def dummy_feed(sess, spatial=640):
+    """Random inputs for the session; dynamic dims get batch 1 / `spatial` px."""
+    rng = np.random.default_rng(0)
+    feed = {}
+    for inp in sess.get_inputs():
+        shape = [d if isinstance(d, int) and d > 0 else (1 if i == 0 else spatial) for i, d in enumerate(inp.shape)]
+        feed[inp.name] = rng.standard_normal(shape).astype(np.float32)
+    return feed
+
+
+def measure(model_path, settings, runs=20, warmup=3, spatial=640):
+    """Median / p90 latency of one inference under `settings` (ms)."""
+    t = time.perf_counter()
+    sess = ort.InferenceSession(model_path, sess_options=session_options(settings), providers=PROVIDERS)
+    load_ms = (time.perf_counter() - t) * 1000
+    feed = dummy_feed(sess, spatial)
+    for _ in range(warmup):
+        sess.run(None, feed)
+    times = []
+    for _ in range(runs):
+        t = time.perf_counter()
+        sess.run(None, feed)
+        times.append((time.perf_counter() - t) * 1000)
+    return {"median_ms": float(np.median(times)), "p90_ms": float(np.percentile(times, 90)), "load_ms": load_ms}
+
+
+def search_space(budget):
+    """(setting names, candidate values) per dimension, in greedy search order."""
+    threads = sorted({t for t in (1, 2, 4, budget) if t <= budget})
+    execution = [("sequential", 1)]
+    if parallel_allowed(budget):
+        execution += [("parallel", t) for t in sorted({2, budget})]
+    return [
+        (("intra_op_threads",), [(t,) for t in threads]),
+        (("execution_mode", "inter_op_threads"), execution),
+        (("graph_optimization",), [("basic",), ("extended",), ("all",)]),
+        (("cpu_mem_arena", "mem_pattern"), [(True, True), (True, False), (False, False)]),
+    ]
+
+
+def tune(model_path, search="greedy", runs=20, spatial=640, log=print):
+    """Fastest settings for `model_path` on this host; returns (settings, result, trials)."""
+    budget = intra_op_threads()
+    space = search_space(budget)
+    trials = []
+
+    def trial(settings):
+        result = measure(model_path, settings, runs=runs, spatial=spatial)
+        trials.append({"settings": settings, **result})
+        log(f"   {result['median_ms']:8.2f} ms  {settings}")
+        return result
+
+    if search == "grid":
+        best, best_result = None, None
+        for combo in itertools.product(*(values for _, values in space)):
+            settings = dict(DEFAULT_SETTINGS)
+            for (names, _), values in zip(space, combo):
+                settings.update(zip(names, values))
+            result = trial(settings)
+            if best_result is None or result["median_ms"] < best_result["median_ms"]:
+                best, best_result = settings, result
+        return best, best_result, trials
+
+    # greedy: one dimension at a time, starting from the service defaults
+    best = {**DEFAULT_SETTINGS, "intra_op_threads": budget}
+    best_result = trial(best)
+    for names, values in space:
+        current = tuple(best[n] for n in names)
+        for value in values:
+            if value == current:
+                continue
+            candidate = {**best, **dict(zip(names, value))}
+            result = trial(candidate)
+            if result["median_ms"] < best_result["median_ms"] * (1 - MIN_GAIN):
+                best, best_result = candidate, result
+    return best, best_result, trials
+
+
+def save_optimized(model_path, settings, cache_dir=CACHE_DIR):
+    """Serialize the graph ORT produces under `settings`; returns its path."""
+    os.makedirs(cache_dir, exist_ok=True)
+    tag = hashlib.blake2b(f"{model_key(model_path)}|{host_key()}|{sorted(settings.items())}".encode(),
+                          digest_size=6).hexdigest()
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    out = os.path.join(cache_dir, f"{stem}.{tag}.opt.onnx")
+    tmp = f"{out}.{os.getpid()}.tmp"
+    so = session_options(settings)
+    so.optimized_model_filepath = tmp
+    ort.InferenceSession(model_path, sess_options=so, providers=PROVIDERS)
+    os.replace(tmp, out)
+    return out
+
+
+def tune_and_save(model_path, search="greedy", runs=20, spatial=640, log=print):
+    """Tune one model, write its optimized graph and profile entry; returns the entry."""
+    log(f"🔧 Tuning {os.path.basename(model_path)} ({search}, budget {intra_op_threads()} thread(s))")
+    baseline = measure(model_path, None, runs=runs, spatial=spatial)
+    settings, result, trials = tune(model_path, search=search, runs=runs, spatial=spatial, log=log)
+    entry = {
+        "model": os.path.abspath(model_path),
+        "settings": settings,
+        "median_ms": result["median_ms"],
+        "baseline_ms": baseline["median_ms"],
+        "budget": intra_op_threads(),
+        "trials": len(trials),
+        "optimized": save_optimized(model_path, settings),
+        "tuned_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    save_entry(model_path, entry)
+    opt = measure(entry["optimized"], {**settings, "graph_optimization": "disabled"}, runs=runs, spatial=spatial)
+    log(f"✅ {os.path.basename(model_path)}: {baseline['median_ms']:.2f} → {result['median_ms']:.2f} ms/run, "
+        f"session load {result['load_ms']:.0f} → {opt['load_ms']:.0f} ms with the pre-optimized graph")
+    return entry
+
+
+def default_models():
+    """buffalo_l detector + recognizer, wherever the service / scripts find them."""
+    from face_models import find_model, DET_PATTERNS, REC_PATTERNS
+    root = os.path.dirname(os.path.abspath(__file__))
+    dirs = [os.path.expanduser("~/.insightface/models/buffalo_l"), os.path.join(root, "models", "buffalo_l")]
+    models = []
+    for patterns in (DET_PATTERNS, REC_PATTERNS):
+        for d in dirs:
+            try:
+                models.append(find_model(d, patterns))
+                break
+            except FileNotFoundError:
+                continue
+    return models
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Tune ONNX Runtime session settings for the face models")
+    ap.add_argument("models", nargs="*", help="ONNX files (default: buffalo_l detector + recognizer)")
+    ap.add_argument("--search", choices=("greedy", "grid"), default="greedy")
+    ap.add_argument("--runs", type=int, default=20, help="timed runs per candidate")
+    ap.add_argument("--det-size", type=int, default=640, help="spatial size for dynamic (detector) inputs")
+    ap.add_argument("--workers", type=int, help="worker processes the budget is shared by (FACE_WORKERS)")
+    ap.add_argument("--show", action="store_true", help="print the current profile and exit")
+    args = ap.parse_args()
+
+    if args.show:
+        print(json.dumps(load_profile(), indent=2))
+        return 0
+    if args.workers:
+        os.environ["FACE_WORKERS"] = str(args.workers)
+
+    models = args.models or default_models()
+    if not models:
+        print("❌ No models found; pass the ONNX files to tune")
+        return 1
+    for path in models:
+        tune_and_save(path, search=args.search, runs=args.runs, spatial=args.det_size)
+    print(f"📄 Profile: {PROFILE_PATH}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,67 @@
+# pipeline.py — bounded drop-oldest queues between the liveness stages
+#
+# A slow consumer must never stall its producer: when a queue is full, put()
+# discards the oldest item (counted as dropped) instead of blocking, so every
+# stage always works on the freshest data.
+
+import threading
+from collections import deque
+
+
+class DropOldestQueue:
+    def __init__(self, maxsize=2, name="queue"):
+        self.maxsize = max(1, int(maxsize))
+        self.name = name
+        self._items = deque()
+        self._cond = threading.Condition()
+        self.closed = False
+        self.put_count = 0
+        self.dropped = 0
+        self.max_depth = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, item):
+        with self._cond:
+            if len(self._items) >= self.maxsize:
+                self._items.popleft()
+                self.dropped += 1
+            self._items.append(item)
+            self.put_count += 1
+            self.max_depth = max(self.max_depth, len(self._items))
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """Oldest queued item; None on timeout or once closed and drained."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._items or self.closed, timeout):
+                return None
+            return self._items.popleft() if self._items else None
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {"depth": len(self._items), "max_depth": self.max_depth,
+                    "put": self.put_count, "dropped": self.dropped}
+
+
+def start_monitor(queues, stats, stop, interval=2.0, extra=None):
+    """Log queue depths and per-stage latencies every `interval` seconds until `stop` is set."""
+    def run():
+        while not stop.wait(interval):
+            depths = "  ".join(f"{q.name}={len(q)} (drop {q.dropped})" for q in queues)
+            stages = stats.report()["stages"]
+            lat = "  ".join(f"{name}={s['mean_ms']:.1f}ms" for name, s in stages.items())
+            line = f"⏱️ queues: {depths} | stages: {lat}"
+            if extra is not None:
+                line += f" | {extra()}"
+            print(line)
+
+    t = threading.Thread(target=run, name="pipeline-monitor", daemon=True)
+    t.start()
+    return t
@@ -0,0 +1,61 @@
+# pipeline_stats.py — per-stage timing for the frame loops (liveness, register)
+#
+#   stats = PipelineStats()
+#   with stats.stage("mesh"): ...
+#   stats.frame()            # once per processed frame
+#   stats.print_report()
+#
+# A stage's FPS is 1 / its mean time: the rate that stage alone could sustain.
+
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+
+class PipelineStats:
+    def __init__(self, window=10000):
+        self.window = window
+        self._stages = {}            # name -> deque of seconds, in first-seen order
+        self.frames = 0
+        self.started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - t)
+
+    def add(self, name, seconds):
+        times = self._stages.get(name)
+        if times is None:
+            times = self._stages[name] = deque(maxlen=self.window)
+        times.append(seconds)
+
+    def frame(self):
+        self.frames += 1
+
+    def report(self):
+        wall = time.perf_counter() - self.started
+        stages = {}
+        # list() snapshots: stage threads may add while we report
+        for name, times in list(self._stages.items()):
+            ms = np.array(list(times), dtype=np.float64) * 1000
+            mean = float(ms.mean()) if ms.size else 0.0
+            stages[name] = {
+                "count": len(times),
+                "mean_ms": mean,
+                "p95_ms": float(np.percentile(ms, 95)) if ms.size else 0.0,
+                "fps": 1000.0 / mean if mean > 0 else 0.0,
+            }
+        return {"frames": self.frames, "wall_s": wall, "fps": self.frames / wall if wall > 0 else 0.0, "stages": stages}
+
+    def print_report(self, title="Pipeline"):
+        r = self.report()
+        print(f"📊 {title}: {r['frames']} frames in {r['wall_s']:.2f}s → {r['fps']:.1f} fps")
+        for name, s in r["stages"].items():
+            print(f"   {name:12s} {s['mean_ms']:8.2f} ms  p95 {s['p95_ms']:8.2f} ms  {s['fps']:8.1f} fps  (n={s['count']})")
+        return r
@@ -0,0 +1,108 @@
+# quality.py — cheap face-quality gate, run between detection and the ArcFace embedding
+#
+# Tiny, dark, blurred or side-on faces fail matching anyway; rejecting them
+# before the 512-d embedder saves its cost and gives the client a reason it
+# can act on ("move closer", "hold still", ...). Checks run cheapest first
+# and stop at the first failure:
+#
+#   too_small             shorter bbox side below min_size px
+#   pose                  |yaw| or pitch offset from the 5 detector keypoints
+#   too_dark / too_bright mean luma of the crop
+#   blurry                Laplacian variance of the crop resized to probe×probe
+#
+# Resizing to a fixed probe makes the blur score independent of face size and
+# bounds the cost (~0.2 ms per face at 96 px on one core).
+
+import threading
+
+import cv2
+
+from headturn import yaw_from_kps
+
+REASONS = ("too_small", "pose", "too_dark", "too_bright", "blurry")
+
+
+class FaceRejected(Exception):
+    """A detected face failed the quality gate; `verdict` is QualityGate.check()'s dict."""
+
+    def __init__(self, verdict):
+        super().__init__(verdict["reason"])
+        self.verdict = verdict
+
+
+def pitch_from_kps(kps):
+    """Nose height between the eye line and the mouth line (≈0.5 frontal, 0/1 looking up/down)."""
+    eye_y = 0.5 * (kps[0][1] + kps[1][1])
+    mouth_y = 0.5 * (kps[3][1] + kps[4][1])
+    return float((kps[2][1] - eye_y) / (mouth_y - eye_y + 1e-6))
+
+
+class QualityGate:
+    def __init__(self, min_size=64, min_brightness=40.0, max_brightness=220.0,
+                 min_sharpness=40.0, max_yaw=0.35, pitch_range=(0.2, 0.8), probe=96):
+        self.min_size = min_size
+        self.min_brightness = min_brightness
+        self.max_brightness = max_brightness
+        self.min_sharpness = min_sharpness
+        self.max_yaw = max_yaw
+        self.pitch_range = pitch_range
+        self.probe = probe
+        self._lock = threading.Lock()
+
+        # counters
+        self.checked = 0
+        self.rejected = dict.fromkeys(REASONS, 0)
+
+    def check(self, img, bbox=None, kps=None, rgb=False):
+        """Verdict for the face at `bbox` (whole image if None):
+        {"ok", "reason", <measured values>}; `reason` is None when ok."""
+        verdict = {"ok": True, "reason": None}
+        h, w = img.shape[:2]
+        if bbox is None:
+            x0, y0, x1, y1 = 0, 0, w, h
+        else:
+            x0, y0 = max(0, int(bbox[0])), max(0, int(bbox[1]))
+            x1, y1 = min(w, int(bbox[2])), min(h, int(bbox[3]))
+        verdict["size"] = int(min(x1 - x0, y1 - y0))
+        reason = None
+        if verdict["size"] < self.min_size:
+            reason = "too_small"
+
+        if reason is None and kps is not None:
+            verdict["yaw"] = round(yaw_from_kps(kps), 3)
+            verdict["pitch"] = round(pitch_from_kps(kps), 3)
+            lo, hi = self.pitch_range
+            if abs(verdict["yaw"]) > self.max_yaw or not lo <= verdict["pitch"] <= hi:
+                reason = "pose"
+
+        if reason is None:
+            small = cv2.resize(img[y0:y1, x0:x1], (self.probe, self.probe), interpolation=cv2.INTER_AREA)
+            gray = cv2.cvtColor(small, cv2.COLOR_RGB2GRAY if rgb else cv2.COLOR_BGR2GRAY)
+            verdict["brightness"] = round(float(gray.mean()), 1)
+            if verdict["brightness"] < self.min_brightness:
+                reason = "too_dark"
+            elif verdict["brightness"] > self.max_brightness:
+                reason = "too_bright"
+            else:
+                verdict["sharpness"] = round(float(cv2.Laplacian(gray, cv2.CV_32F).var()), 1)
+                if verdict["sharpness"] < self.min_sharpness:
+                    reason = "blurry"
+
+        with self._lock:
+            self.checked += 1
+            if reason is not None:
+                self.rejected[reason] += 1
+        if reason is not None:
+            verdict["ok"], verdict["reason"] = False, reason
+        return verdict
+
+    def stats(self):
+        with self._lock:
+            rejected = sum(self.rejected.values())
+            return {
+                "checked": self.checked,
+                "rejected": rejected,
+                "reject_rate": rejected / self.checked if self.checked else 0.0,
+                "by_reason": dict(self.rejected),
+            }
+
@@ -1,110 +1,106 @@
-# register.py — capture a few face crops, make ArcFace embeddings with ONNX Runtime, save into face_db.pkl
+# register.py — capture a few face crops, make ArcFace embeddings with ONNX Runtime, save into the face gallery
 
-import os
 import sys
 import cv2
 import time
-import pickle
 import numpy as np
-import onnxruntime as ort
 
-
-def register_from_frame(name, frame):
-    sess = ort.InferenceSession(ARCFACE_ONNX, providers=["CPUExecutionProvider"])
-
-    collected = []
-    for _ in range(10):
+from inference import (
+    find_arcface_model, arcface_session, get_embeddings, find_face_box,
+    open_gallery, l2_normalize,
+)
+from camera_stream import CameraStream
+from pipeline_stats import PipelineStats
+from quality import QualityGate
+
+# crop jitter as a fraction of the face box: (dx, dy) shifts of a 94% window
+JITTER_SHIFTS = ((-0.03, -0.03), (0.03, 0.03))
+JITTER_SCALE = 0.94
+
+# blurred / dark / tiny crops are skipped before they reach ArcFace
+quality_gate = QualityGate()
+
+
+def augment_views(face):
+    """Cheap extra views of one crop: itself, its mirror and two jittered windows."""
+    h, w = face.shape[:2]
+    views = [face, cv2.flip(face, 1)]
+    cw, ch = int(w * JITTER_SCALE), int(h * JITTER_SCALE)
+    for dx, dy in JITTER_SHIFTS:
+        x0 = int(np.clip((w - cw) / 2 + dx * w, 0, w - cw))
+        y0 = int(np.clip((h - ch) / 2 + dy * h, 0, h - ch))
+        views.append(face[y0:y0 + ch, x0:x0 + cw])
+    return views
+
+
+def inlier_views(embs, min_sim=0.5, mad_k=3.0):
+    """Mask of views that agree with the consensus (robust to a bad crop)."""
+    if len(embs) <= 2:
+        return np.ones(len(embs), dtype=bool)
+    sims = embs @ l2_normalize(embs.mean(axis=0))
+    med = np.median(sims)
+    mad = np.median(np.abs(sims - med))
+    keep = sims >= min(med, max(min_sim, med - mad_k * 1.4826 * mad))
+    keep[np.argmax(sims)] = True
+    return keep
+
+
+def build_template(faces, augment=True):
+    """One batched ArcFace call over all views; returns (template, kept, total)."""
+    views = [v for f in faces for v in (augment_views(f) if augment else [f])]
+    embs = get_embeddings(views)
+    keep = inlier_views(embs)
+    return l2_normalize(embs[keep].mean(axis=0)).astype(np.float32), int(keep.sum()), len(views)
+
+
+def register_from_frame(name, frames, augment=True):
+    """Enroll `name` from one frame or a list of frames (multi-view)."""
+    if isinstance(frames, np.ndarray) and frames.ndim == 3:
+        frames = [frames]
+
+    faces = []
+    rejected = None
+    for frame in frames:
         box = find_face_box(frame)
-        if not box:
-            return False, "Face not detected"
-
-        x0,y0,x1,y1 = box
-        face = frame[y0:y1, x0:x1]
-        emb = get_embedding(sess, face)
-        collected.append(emb)
-
-    mean_emb = l2_normalize(np.mean(np.stack(collected), axis=0))
+        if box:
+            verdict = quality_gate.check(frame, box)
+            if not verdict["ok"]:
+                rejected = verdict["reason"]
+                continue
+            x0,y0,x1,y1 = box
+            faces.append(frame[y0:y1, x0:x1])
+    if not faces:
+        return False, f"Face rejected: {rejected}" if rejected else "Face not detected"
 
-    db = load_face_db()
-    db[name] = mean_emb.astype(np.float32)
-    save_face_db(db)
+    template, kept, total = build_template(faces, augment=augment)
+    open_gallery().add(name, template)
 
-    return True, f"Face registered for {name}"
+    return True, f"Face registered for {name} ({kept}/{total} views)"
 
 # ---------- Paths ----------
-ROOT = os.path.dirname(os.path.abspath(__file__))
-MODEL_DIR = os.path.join(ROOT, "models", "buffalo_l")
-ARCFACE_ONNX = None
-
-# Try common file names inside buffalo_l pack
-for fname in ["w600k_r50.onnx", "glintr100.onnx", "arcface_r100_v1.onnx"]:
-    p = os.path.join(MODEL_DIR, fname)
-    if os.path.exists(p):
-        ARCFACE_ONNX = p
-        break
-
-if ARCFACE_ONNX is None:
-    raise FileNotFoundError("ArcFace ONNX model not found in models/buffalo_l. "
-                            "Place buffalo_l ONNX there (e.g., w600k_r50.onnx).")
-
-FACE_DB_PATH = os.path.join(ROOT, "face_db.pkl")
-
-# ---------- Helpers ----------
-def load_face_db():
-    if os.path.exists(FACE_DB_PATH):
-        with open(FACE_DB_PATH, "rb") as f:
-            return pickle.load(f)
-    return {}
-
-def save_face_db(db):
-    with open(FACE_DB_PATH, "wb") as f:
-        pickle.dump(db, f)
-
-def l2_normalize(v):
-    n = np.linalg.norm(v)
-    return v / max(n, 1e-12)
-
-def preprocess_arcface(img_bgr, size=(112,112)):
-    # ArcFace expects RGB, 112x112, float32 normalized roughly to [-1,1]
-    img = cv2.resize(img_bgr, size)
-    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB).astype(np.float32)
-    img = (img - 127.5) / 128.0
-    img = np.transpose(img, (2,0,1))  # CHW
-    img = np.expand_dims(img, 0)      # NCHW
-    return img
-
-def get_embedding(session, face_bgr):
-    x = preprocess_arcface(face_bgr)
-    input_name = session.get_inputs()[0].name
-    out = session.run(None, {input_name: x})[0][0]
-    return l2_normalize(out)
-
-def find_face_box(img):
-    # Try a simple Haar-cascade detector as fallback if you don’t have SCRFD ONNX
-    # (ships with OpenCV; good enough for capture)
-    cascade = cv2.CascadeClassifier(cv2.data.haarcascades +
-                                    "haarcascade_frontalface_default.xml")
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    faces = cascade.detectMultiScale(gray, scaleFactor=1.2, minNeighbors=5, minSize=(80,80))
-    if len(faces) == 0:
-        return None
-    # take the largest face
-    faces = sorted(faces, key=lambda r: r[2]*r[3], reverse=True)
-    (x,y,w,h) = faces[0]
-    # add a bit of margin
-    pad = int(0.1 * max(w,h))
-    x0 = max(0, x - pad); y0 = max(0, y - pad)
-    x1 = min(img.shape[1], x + w + pad); y1 = min(img.shape[0], y + h + pad)
-    return (x0,y0,x1,y1)
+# Fail at import, as before, if the buffalo_l ArcFace model is missing.
+ARCFACE_ONNX = find_arcface_model()
+
+def option(args, flag, default=None):
+    if flag in args:
+        i = args.index(flag)
+        if i + 1 < len(args):
+            return args[i+1]
+    return default
 
 def main():
-    # read name from CLI arg: --name John
-    name = None
+    # --name NAME         person to enroll (prompted if missing)
+    # --source SPEC       webcam (default) | video file | image dir | synthetic[:WxH[:frames[:image]]]
+    # --fps N             capture pacing: source rate by default, 0 = as fast as possible
+    # --headless          no window
+    # --sample-every N    recordings: take one crop every N frames (default 15 ≈ 0.5 s)
+    # --db                also upsert into student_faces
     args = sys.argv[1:]
-    if "--name" in args:
-        i = args.index("--name")
-        if i + 1 < len(args):
-            name = args[i+1].strip()
+    name = (option(args, "--name") or "").strip()
+    source = option(args, "--source")
+    fps = option(args, "--fps")
+    headless = "--headless" in args
+    sample_every = int(option(args, "--sample-every", "15"))
 
     if not name:
         # fallback to interactive prompt if ran directly
@@ -114,61 +110,94 @@ def main():
         print("❌ Invalid name")
         return
 
-    # Init ONNX session
-    sess = ort.InferenceSession(ARCFACE_ONNX, providers=["CPUExecutionProvider"])
+    # Init ONNX session (shared, created once per process)
+    arcface_session()
 
-    # Capture multiple views
-    cap = cv2.VideoCapture(0, cv2.CAP_DSHOW)
-    if not cap.isOpened():
-        print("❌ Cannot open camera")
+    # Capture multiple views; recordings are replayed frame by frame
+    offline = source is not None and not (source.isdigit() or source.startswith("webcam"))
+    stream = CameraStream(source=source, fps=None if fps is None else float(fps), backpressure=offline)
+    try:
+        stream.start()
+    except (RuntimeError, FileNotFoundError) as e:
+        print(f"❌ Cannot open camera: {e}")
         return
 
     print(f"📸 Registering face for: {name}")
     print("Look at camera; the app will grab ~10 crops automatically.")
-    collected = []
+    collected = []   # face crops; embedded together once capture is done
     target_count = 10
     last_saved = 0
+    last_seq = -sample_every
+    stats = PipelineStats()
+    seq = 0
 
     while len(collected) < target_count:
-        ret, frame = cap.read()
-        if not ret:
-            continue
-        frame = cv2.flip(frame, 1)
-
-        box = find_face_box(frame)
+        seq, view = stream.wait_for_frame(seq, timeout=10.0)
+        if view is None:
+            break  # recording finished (or the camera stalled)
+        frame = view if headless else view.copy()
+
+        with stats.stage("face_box"):
+            box = find_face_box(frame)
+        verdict = None
         if box:
+            with stats.stage("quality"):
+                verdict = quality_gate.check(frame, box)
+        if verdict and not verdict["ok"]:
+            # not worth an embedding: wait for a better frame
+            if not headless:
+                (x0,y0,x1,y1) = box
+                cv2.rectangle(frame, (x0,y0), (x1,y1), (0,0,255), 2)
+                cv2.putText(frame, f"Rejected: {verdict['reason']}",
+                            (10,30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0,0,255), 2)
+        elif box:
             (x0,y0,x1,y1) = box
             face = frame[y0:y1, x0:x1].copy()
-            cv2.rectangle(frame, (x0,y0), (x1,y1), (0,255,0), 2)
 
             now = time.time()
-            # sample roughly 2 per second
-            if now - last_saved > 0.5:
-                emb = get_embedding(sess, face)
-                collected.append(emb)
-                last_saved = now
-
+            # sample roughly 2 per second (of recording time when replaying)
+            due = seq - last_seq >= sample_every if offline else now - last_saved > 0.5
+            if due:
+                collected.append(face)
+                last_saved, last_seq = now, seq
+
+            if not headless:
+                cv2.rectangle(frame, (x0,y0), (x1,y1), (0,255,0), 2)
                 cv2.putText(frame, f"Captured: {len(collected)}/{target_count}",
                             (10,30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0,255,0), 2)
 
-        cv2.imshow("Register Face", frame)
-        if cv2.waitKey(1) & 0xFF == 27:
-            break
+        stats.frame()
+        if not headless:
+            cv2.imshow("Register Face", frame)
+            if cv2.waitKey(1) & 0xFF == 27:
+                break
 
-    cap.release()
-    cv2.destroyAllWindows()
+    stream.stop()
+    if not headless:
+        cv2.destroyAllWindows()
 
     if not collected:
         print("❌ No samples captured")
         return
 
-    # Average embedding
-    mean_emb = l2_normalize(np.mean(np.stack(collected, axis=0), axis=0))
-
-    db = load_face_db()
-    db[name] = mean_emb.astype(np.float32)
-    save_face_db(db)
-    print(f"✅ Saved embedding for {name}. Total people in DB: {len(db)}")
+    # One batched embedding over all views, outliers dropped, then averaged
+    with stats.stage("embed"):
+        mean_emb, kept, total = build_template(collected)
+    stats.print_report("Register")
+    q = quality_gate.stats()
+    if q["rejected"]:
+        reasons = ", ".join(f"{r} {n}" for r, n in q["by_reason"].items() if n)
+        print(f"   quality gate: {q['rejected']}/{q['checked']} crops rejected ({reasons})")
+
+    gallery = open_gallery()
+    gallery.add(name, mean_emb)
+    print(f"✅ Saved embedding for {name} ({kept}/{total} views). Total people in DB: {len(gallery)}")
+
+    if "--db" in args:
+        # also upsert into student_faces; running services pick it up via the change feed
+        from db import save_face_embedding
+        save_face_embedding(name, mean_emb)
+        print(f"🗄️ Synced {name} to student_faces")
 
 if __name__ == "__main__":
     main()
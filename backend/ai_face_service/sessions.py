@@ -0,0 +1,130 @@
+# sessions.py — roster-scoped recognition sessions
+#
+# A lecture only needs to match against its own 40–200 enrolled students.
+# Opening a session pins that roster's embeddings in a small FaceGallery of
+# its own; recognition calls carrying the session id search only that matrix,
+# which is both cheaper and avoids false matches against the rest of campus.
+#
+# The registry is per process. app.py persists each session's roster in the
+# face_sessions table so any worker can rebuild it on first use, and
+# re-validates local copies every `recheck` seconds so an explicit close on
+# one worker is seen by the others.
+
+import time
+import secrets
+import threading
+
+from gallery import FaceGallery
+
+
+class SessionLimit(RuntimeError):
+    """Too many open sessions in this process."""
+
+
+class RecognitionSession:
+    def __init__(self, session_id, names, vectors, expires_at):
+        self.id = session_id
+        self.names = list(dict.fromkeys(names))
+        self.gallery = FaceGallery(capacity=max(1, len(self.names)))
+        self.gallery.load((n, vectors[n]) for n in self.names if n in vectors)
+        self.gallery.loaded = True
+        self.expires_at = float(expires_at)     # epoch seconds, same clock as the DB row
+        self.checked_at = time.monotonic()
+
+    @property
+    def not_enrolled(self):
+        return [n for n in self.names if n not in self.gallery]
+
+    def expired(self, now=None):
+        return (time.time() if now is None else now) >= self.expires_at
+
+    def info(self):
+        return {
+            "session_id": self.id,
+            "roster": len(self.names),
+            "enrolled": len(self.gallery),
+            "not_enrolled": self.not_enrolled,
+            "expires_in": max(0.0, self.expires_at - time.time()),
+        }
+
+
+class SessionRegistry:
+    def __init__(self, max_sessions=64, recheck=30.0):
+        self.max_sessions = max(1, int(max_sessions))
+        self.recheck = float(recheck)
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.expired = 0
+
+    def __len__(self):
+        return len(self._sessions)
+
+    @staticmethod
+    def new_id():
+        return secrets.token_urlsafe(12)
+
+    def _sweep_locked(self, now):
+        for sid in [sid for sid, s in self._sessions.items() if s.expired(now)]:
+            del self._sessions[sid]
+            self.expired += 1
+
+    def create(self, session_id, names, vectors, expires_at):
+        """Pin a roster; `vectors` maps student_name -> embedding."""
+        session = RecognitionSession(session_id, names, vectors, expires_at)
+        with self._lock:
+            self._sweep_locked(time.time())
+            if session_id not in self._sessions and len(self._sessions) >= self.max_sessions:
+                raise SessionLimit(f"At most {self.max_sessions} open sessions per worker")
+            self._sessions[session_id] = session
+            self.opened += 1
+        return session
+
+    def get(self, session_id):
+        """Live session or None (expired sessions are dropped here)."""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None and session.expired():
+                del self._sessions[session_id]
+                self.expired += 1
+                return None
+            return session
+
+    def needs_recheck(self, session):
+        return time.monotonic() - session.checked_at >= self.recheck
+
+    def mark_checked(self, session, expires_at=None):
+        session.checked_at = time.monotonic()
+        if expires_at is not None:
+            session.expires_at = float(expires_at)
+
+    def close(self, session_id):
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def update(self, name, emb):
+        """Re-registration: refresh `name` in every session whose roster has it."""
+        with self._lock:
+            sessions = list(self._sessions.values())
+        n = 0
+        for s in sessions:
+            if name in s.names:
+                s.gallery.upsert(name, emb)
+                n += 1
+        return n
+
+    def remove(self, name):
+        with self._lock:
+            sessions = list(self._sessions.values())
+        return sum(1 for s in sessions if s.gallery.remove(name))
+
+    def stats(self):
+        with self._lock:
+            self._sweep_locked(time.time())
+            return {
+                "open": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "pinned_faces": sum(len(s.gallery) for s in self._sessions.values()),
+                "opened": self.opened,
+                "expired": self.expired,
+            }